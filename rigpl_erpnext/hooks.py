@@ -64,6 +64,10 @@ doc_events = {
     "Account": {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.account.validate"
     },
+    "Address": {
+        "on_update": "rigpl_erpnext.utils.contact_keys.update_contact_keys",
+        "on_trash": "rigpl_erpnext.utils.contact_keys.delete_contact_keys"
+    },
     "Attendance": {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.attendance.validate",
         "on_update": "rigpl_erpnext.rigpl_erpnext.validations.attendance.on_update",
@@ -72,9 +76,14 @@ doc_events = {
     "Communication": {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.communication.validate"
     },
+    "Contact": {
+        "on_update": "rigpl_erpnext.utils.contact_keys.update_contact_keys",
+        "on_trash": "rigpl_erpnext.utils.contact_keys.delete_contact_keys"
+    },
     "Customer": {
         "on_update": "rigpl_erpnext.rigpl_erpnext.validations.customer.on_update",
-        "validate": "rigpl_erpnext.rigpl_erpnext.validations.customer.validate"
+        "validate": "rigpl_erpnext.rigpl_erpnext.validations.customer.validate",
+        "on_trash": "rigpl_erpnext.utils.contact_keys.delete_contact_keys"
     },
     "Delivery Note": {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.delivery_note.validate",
@@ -93,7 +102,8 @@ doc_events = {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.expense_claim.validate"
     },
     "Holiday List": {
-        "validate": "rigpl_erpnext.rigpl_erpnext.validations.holiday_list.validate"
+        "validate": "rigpl_erpnext.rigpl_erpnext.validations.holiday_list.validate",
+        "on_change": "rigpl_erpnext.utils.hr_calendar.clear_calendar_cache"
     },
     "Item": {
         "validate": "rigpl_erpnext.rigpl_erpnext.item.validate",
@@ -107,11 +117,13 @@ doc_events = {
     },
     "Lead": {
         "on_update": "rigpl_erpnext.rigpl_erpnext.validations.lead.on_update",
-        "validate": "rigpl_erpnext.rigpl_erpnext.validations.lead.validate"
+        "validate": "rigpl_erpnext.rigpl_erpnext.validations.lead.validate",
+        "on_trash": "rigpl_erpnext.utils.contact_keys.delete_contact_keys"
     },
     "Leave Application": {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.leave_application.validate",
-        "on_submit": "rigpl_erpnext.rigpl_erpnext.validations.leave_application.on_submit"
+        "on_submit": "rigpl_erpnext.rigpl_erpnext.validations.leave_application.on_submit",
+        "on_change": "rigpl_erpnext.utils.hr_calendar.clear_calendar_cache"
     },
     "Opportunity": {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.opportunity.validate"
@@ -141,7 +153,8 @@ doc_events = {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.quotation.validate"
     },
     "Salary Component": {
-        "validate": "rigpl_erpnext.rigpl_erpnext.validations.salary_component.validate"
+        "validate": "rigpl_erpnext.rigpl_erpnext.validations.salary_component.validate",
+        "on_change": "rigpl_erpnext.utils.payroll_batch.clear_payroll_cache"
     },
     "Salary Slip": {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.salary_slip.validate",
@@ -149,7 +162,8 @@ doc_events = {
         "on_cancel": "rigpl_erpnext.rigpl_erpnext.validations.salary_slip.on_cancel"
     },
     "Salary Structure": {
-        "validate": "rigpl_erpnext.rigpl_erpnext.validations.salary_structure.validate"
+        "validate": "rigpl_erpnext.rigpl_erpnext.validations.salary_structure.validate",
+        "on_change": "rigpl_erpnext.utils.payroll_batch.clear_payroll_cache"
     },
     "Salary Structure Assignment": {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.salary_structure_assignment.validate"
@@ -164,6 +178,10 @@ doc_events = {
         "on_submit": "rigpl_erpnext.rigpl_erpnext.validations.sales_order.on_submit",
         "on_cancel": "rigpl_erpnext.rigpl_erpnext.validations.sales_order.on_cancel"
     },
+    "Sales Person": {
+        "on_change": "rigpl_erpnext.utils.rigpl_perm.clear_customer_index",
+        "on_trash": "rigpl_erpnext.utils.rigpl_perm.clear_customer_index"
+    },
     "Stock Entry": {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.stock_entry.validate",
         "on_submit": "rigpl_erpnext.rigpl_erpnext.validations.stock_entry.validate"
@@ -177,6 +195,9 @@ doc_events = {
     "ToDo": {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.todo.validate"
     },
+    "User": {
+        "on_update": "rigpl_erpnext.utils.rigpl_perm.clear_index_on_user_change"
+    },
     "Warehouse": {
         "validate": "rigpl_erpnext.rigpl_erpnext.validations.warehouse.validate"
     },
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+
+def execute():
+	# Open Shipments within the Carrier's window are Polled in the next run
+	frappe.reload_doc("rigpl_erpnext", "doctype", "carrier_tracking")
+	frappe.db.sql("""UPDATE `tabCarrier Tracking` ctrack, `tabTransporters` tpt SET ctrack.next_poll_at = NOW()
+		WHERE tpt.name = ctrack.carrier_name AND ctrack.docstatus != 2 AND ctrack.status != "Delivered"
+		AND ctrack.manual_exception_removed = 0 AND ctrack.next_poll_at IS NULL
+		AND ((tpt.fedex_credentials = 1 OR tpt.fedex_tracking_only = 1)
+		AND DATEDIFF(CURDATE(), ctrack.creation) < 150
+		OR (tpt.fedex_credentials = 0 AND tpt.fedex_tracking_only = 0)
+		AND DATEDIFF(CURDATE(), ctrack.creation) < 60)""")
+	print("Next Poll set for {} Carrier Tracking".format(frappe.db.sql("""SELECT COUNT(name)
+		FROM `tabCarrier Tracking` WHERE next_poll_at IS NOT NULL""")[0][0]))
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+
+def execute():
+	#Scan Summary for existing Carrier Tracking and Index on Creation for Date Filters in Reports
+	frappe.reload_doc("rigpl_erpnext", "doctype", "carrier_tracking")
+	frappe.db.add_index("Carrier Tracking", ["creation"])
+	frappe.db.sql("""UPDATE `tabCarrier Tracking` ct,
+		(SELECT parent, MIN(time) AS first_scan, MAX(time) AS last_scan FROM `tabCourier Tracking Scans`
+		WHERE parenttype = 'Carrier Tracking' AND time IS NOT NULL GROUP BY parent) sc
+		SET ct.first_scan_time = sc.first_scan, ct.last_scan_time = sc.last_scan
+		WHERE ct.name = sc.parent""")
+	frappe.db.sql("""UPDATE `tabCarrier Tracking` ct, `tabCourier Tracking Scans` sc
+		SET ct.last_scan_status = LEFT(sc.status_detail, 140), ct.last_scan_location = LEFT(sc.location, 140)
+		WHERE sc.parent = ct.name AND sc.parenttype = 'Carrier Tracking' AND sc.time = ct.last_scan_time""")
+	frappe.db.sql("""UPDATE `tabCarrier Tracking` SET transit_days = ROUND(TIMESTAMPDIFF(SECOND,
+		IFNULL(pickup_date, first_scan_time), IFNULL(delivery_date_time, last_scan_time))/86400, 1)
+		WHERE first_scan_time IS NOT NULL""")
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+from rigpl_erpnext.utils.contact_keys import rebuild_contact_keys
+
+def execute():
+	#Contact Key Index for Lead, Customer, Contact and Address used by IndiaMart to find Duplicates
+	frappe.reload_doc("rigpl_erpnext", "doctype", "contact_key_index")
+	rebuild_contact_keys()
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+from rigpl_erpnext.rigpl_erpnext.doctype.daily_call.daily_call import rebuild_daily_call_summary
+
+def execute():
+	#Daily Call Summary for DCR Analysis from all Submitted Daily Calls
+	frappe.reload_doc("rigpl_erpnext", "doctype", "daily_call_summary")
+	rebuild_daily_call_summary()
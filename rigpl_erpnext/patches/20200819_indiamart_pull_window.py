@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+from frappe.utils import flt
+
+def execute():
+	#Window in Hours replaces Days to Add for IndiaMart, Days below 1 were Hours/100
+	frappe.reload_doc("rigpl_erpnext", "doctype", "indiamart_pull_leads")
+	days_to_add = flt(frappe.db.get_single_value("IndiaMart Pull Leads", "days_to_add"))
+	if days_to_add >= 1:
+		window_hours = days_to_add * 24
+	elif days_to_add >= 0.01:
+		window_hours = days_to_add * 100
+	else:
+		window_hours = 1
+	frappe.db.set_value("IndiaMart Pull Leads", "IndiaMart Pull Leads", "window_hours", window_hours)
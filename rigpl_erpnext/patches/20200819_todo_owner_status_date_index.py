@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+
+def execute():
+	#ToDo Report filters on Owner and Status and sorts on Date
+	frappe.db.add_index("ToDo", ["owner", "status", "date"])
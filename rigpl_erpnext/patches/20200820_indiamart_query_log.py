@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+
+def execute():
+	#Queries already linked to Leads are recorded so they are not processed again
+	frappe.reload_doc("rigpl_erpnext", "doctype", "indiamart_query")
+	frappe.db.sql("""INSERT IGNORE INTO `tabIndiaMart Query` (name, creation, modified, owner, modified_by,
+		query_id, lead, received_on, action) SELECT indiamart_query_id, NOW(), NOW(), 'Administrator',
+		'Administrator', indiamart_query_id, name, creation, 'Lead Updated' FROM `tabLead`
+		WHERE IFNULL(indiamart_query_id, '') != ''""")
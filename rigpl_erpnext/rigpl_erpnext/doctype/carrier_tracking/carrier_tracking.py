@@ -8,7 +8,7 @@ import re
 import frappe
 from fedex.tools.conversion import sobject_to_dict
 from frappe.website.website_generator import WebsiteGenerator
-from frappe.utils import flt
+from frappe.utils import flt, now_datetime
 from frappe.utils.file_manager import remove_all
 from ...scheduled_tasks.shipment_data_update import getOrderShipmentDetails, pushOrderData, courier_charges_validation
 from ...validations.sales_invoice import create_new_carrier_track
@@ -64,6 +64,7 @@ class CarrierTracking(WebsiteGenerator):
                 trans_doc.docstatus = 1
                 trans_doc.manual_exception_removed = 1
         self.update_fields(trans_doc)
+        self.set_next_poll()
         from_address_doc = frappe.get_doc("Address", self.from_address)
         to_address_doc = frappe.get_doc("Address", self.to_address)
         contact_doc = frappe.get_doc("Contact", self.contact_person)
@@ -79,6 +80,13 @@ class CarrierTracking(WebsiteGenerator):
             self.non_fedex_validations()
         #self.auto_submit_ctrack(trans_doc)
 
+    def set_next_poll(self):
+        # New Shipments or Shipments where AWB or Carrier is changed are Polled in the next run
+        doc_before_save = self.get_doc_before_save()
+        if not doc_before_save or doc_before_save.awb_number != self.awb_number or \
+                doc_before_save.carrier_name != self.carrier_name:
+            self.next_poll_at = now_datetime()
+
     def auto_submit_ctrack(self, trans_doc):
         if trans_doc.fedex_credentials == 1:
             if self.status is not None and self.status != "Booked":
@@ -3,17 +3,24 @@
 # For license information, please see license.txt
 from __future__ import unicode_literals
 import re
+import os
 import frappe
 import base64
+import hashlib
 from datetime import datetime
 from datetime import date
 from frappe.utils import flt, cstr
 from fedex.tools.conversion import sobject_to_dict
-from frappe.utils.file_manager import save_file
+from frappe.utils.file_manager import get_file_name
+from rigpl_erpnext.utils.tracking_utils import append_new_scans, get_tracking_snapshot, save_if_changed, \
+    set_poll_backoff
 
 uom_mapper = {"Kg": "KG", "LB": "LB", "kg": "KG", "cm": "CM"}
 allowed_docs = ['Sales Invoice', 'Purchase Order', 'Customer', 'Supplier', 'Company', 'Employee', 'Sales Partner']
 allowed_docs_items = ['Sales Invoice', 'Purchase Order']
+# Kept for the Process, Config is keyed on Transporter and its Modified so an edited Transporter gets a new Config
+fedex_config_cache = {}
+wsdl_client_cache = {}
 
 def get_rates_from_fedex(track_doc):
     credentials, from_address_doc, to_address_doc, from_country_doc, to_country_doc, transporter_doc, \
@@ -31,8 +38,9 @@ def shipment_booking(track_doc):
                             from_country_doc, to_country_doc, transporter_doc, contact_doc)
 
 def start_delete_shipment(track_doc):
-    credentials = get_required_docs(track_doc)[0]
-    transporter_doc = get_required_docs(track_doc)[5]
+    required_docs = get_required_docs(track_doc)
+    credentials = required_docs[0]
+    transporter_doc = required_docs[5]
     delete_shipment_service(track_doc, credentials, transporter_doc)
 
 
@@ -62,6 +70,7 @@ def create_shipment_service(track_doc, credentials, from_address_doc, to_address
     set_commercial_invoice_info(track_doc, shipment)
 
     pkg_count = track_doc.total_handling_units
+    label_files = []
     for index, pkg in enumerate(track_doc.shipment_package_details):
         pkg_doc = frappe.get_doc("Shipment Package", pkg.shipment_package)
         if index:
@@ -83,8 +92,10 @@ def create_shipment_service(track_doc, credentials, from_address_doc, to_address
             track_doc.awb_number = tracking_id
         track_doc.status = "Booked"
         set_package_details(pkg, cstr(shipment.response), tracking_id)
-        store_label(shipment, tracking_id, track_doc.doctype, track_doc.name)
+        label_files.append(store_label(shipment, tracking_id, track_doc.doctype, track_doc.name))
         track_doc.save()
+    if len(label_files) > 1 and frappe.db.get_single_value("RIGPL Settings", "merge_fedex_labels") == 1:
+        merge_labels(label_files, 'FEDEX-LABELS-{0}.pdf'.format(track_doc.name), track_doc.doctype, track_doc.name)
     return shipment
 
 
@@ -147,96 +158,107 @@ def get_tracking_from_fedex(track_doc):
     else:
         fedex_account = 0
     if fedex_account == 1:
-        from fedex.services.track_service import FedexTrackRequest
-        tk_req = FedexTrackRequest(credentials)
-        tk_req.SelectionDetails.PackageIdentifier.Value = track_doc.awb_number
-        tk_req.ProcessingOptions = 'INCLUDE_DETAILED_SCANS'
-        tk_req.IncludeDetailedScans = True
+        tk_req = make_fedex_track_request(track_doc, credentials)
         tk_req.send_request()
-        if tk_req.response.HighestSeverity == "SUCCESS":
-            response = sobject_to_dict(tk_req.response)
-            comp_trks = response.get("CompletedTrackDetails")
-            if not comp_trks:
-                frappe.msgprint("No Tracking Found for {}".format(track_doc.name))
-                if track_doc.docstatus == 1:
-                    track_doc.docstatus = 2
-                else:
-                    track_doc.docstatus = 1
-                track_doc.manual_exception_removed = 1
-                track_doc.save()
-                exit()
-            trk_details = comp_trks[0].get('TrackDetails')
-            trk_details_status = trk_details[0].get('Notification')
-            if trk_details_status.get('Severity') == 'SUCCESS':
-                stat_details = trk_details[0].get('StatusDetail')
-                status_code = stat_details.get('Code')
-                if status_code == 'DL':
-                    # if trk_details[0].get('AvailableImages')[0].get('Type') == 'SIGNATURE_PROOF_OF_DELIVERY':
-                    #    track_doc.sign_proof = 'SIGNATURE_PROOF_OF_DELIVERY'
-                    track_doc.status = 'Delivered'
-                    track_doc.recipient = trk_details[0].get('DeliverySignatureName')
-                elif status_code == 'CA':
-                    track_doc.status = 'Cancelled'
-                    track_doc.docstatus = 2
-                elif status_code == 'OC':
-                    track_doc.status = 'Booked'
-                else:
-                    track_doc.status = 'In Transit'
-                des_dict = trk_details[0].get('DestinationAddress')
-                scan_events = trk_details[0].get('Events')
-                des_city = des_dict.get('City', None)
-                des_state = des_dict.get('StateOrProvinceCode', None)
-                des_country = des_dict.get('CountryName', None)
-                ship_to_city = (str(des_city) + ", " if des_city is not None else "") + \
-                               (str(des_state) + ", " if des_state is not None else "") + \
-                               (str(des_country) if des_country is not None else "")
-                if trk_details[0].get('DatesOrTimes'):
-                    pickup_date = trk_details[0].get('DatesOrTimes')[0].get('DateOrTimestamp')
-                    track_doc.pickup_date = datetime.strptime(pickup_date[:19], '%Y-%m-%dT%H:%M:%S')
-                scans = []
-                if scan_events:
-                    for event in scan_events:
-                        if event.get('EventType') == 'DL':
-                            track_doc.delivery_date_time = event.get('Timestamp').replace(tzinfo=None)
-                        row_dict = {"time": event.get('Timestamp').replace(tzinfo=None)}
-                        city = event.get('Address').get('City', None)
-                        state = event.get('Address').get('StateOrProvinceCode', None)
-                        postcode = event.get('Address').get('PostalCode', None)
-                        country = event.get('Address').get('CountryName', None)
-                        location = (str(city) if city is not None else "") + (", " if city is not None else "") + \
-                                   (str(state) if state is not None else "") + (", " if state is not None else "") + \
-                                   (str(postcode) if postcode is not None else "") + (
-                                       ", " if postcode is not None else "") + \
-                                   (str(country) if country is not None else "Base Location")
-                        row_dict["location"] = location
-                        event_desc = event.get('EventDescription', None)
-                        excep_code = event.get('StatusExceptionCode', None)
-                        excep_desc = event.get('StatusExceptionDescription', None)
-                        event_full_desc = event_desc + (" Excep Code: " if excep_code is not None else "") + \
-                                          (str(excep_code) if excep_code is not None else "") + \
-                                          " " + (str(excep_desc) if excep_desc is not None else "")
-                        row_dict["status_detail"] = event_full_desc
-                        scans.append(row_dict)
-                else:
-                    frappe.throw('NO SCANS Recevied')
-                track_doc.scans = []
-                track_doc.status_code = status_code
-                track_doc.ship_to_city = ship_to_city
-                for scan in scans:
-                    track_doc.append("scans", scan)
-                track_doc.save(ignore_permissions=True)
+        update_tracking_from_fedex(track_doc, tk_req)
+    else:
+        frappe.throw("Not Fedex Account")
+
+
+def make_fedex_track_request(track_doc, credentials, timeout=None):
+    # Request is made here and sent separately so that sending can be done in a Thread
+    from fedex.services.track_service import FedexTrackRequest
+    tk_req = FedexTrackRequest(credentials)
+    tk_req.SelectionDetails.PackageIdentifier.Value = track_doc.awb_number
+    tk_req.ProcessingOptions = 'INCLUDE_DETAILED_SCANS'
+    tk_req.IncludeDetailedScans = True
+    if timeout:
+        tk_req.client.set_options(timeout=timeout)
+    return tk_req
+
+
+def update_tracking_from_fedex(track_doc, tk_req):
+    if tk_req.response.HighestSeverity == "SUCCESS":
+        response = sobject_to_dict(tk_req.response)
+        comp_trks = response.get("CompletedTrackDetails")
+        if not comp_trks:
+            frappe.msgprint("No Tracking Found for {}".format(track_doc.name))
+            if track_doc.docstatus == 1:
+                track_doc.docstatus = 2
             else:
-                track_doc.manual_exception_removed = 1
+                track_doc.docstatus = 1
+            track_doc.manual_exception_removed = 1
+            track_doc.save()
+            return
+        trk_details = comp_trks[0].get('TrackDetails')
+        trk_details_status = trk_details[0].get('Notification')
+        if trk_details_status.get('Severity') == 'SUCCESS':
+            snapshot = get_tracking_snapshot(track_doc)
+            stat_details = trk_details[0].get('StatusDetail')
+            status_code = stat_details.get('Code')
+            if status_code == 'DL':
+                # if trk_details[0].get('AvailableImages')[0].get('Type') == 'SIGNATURE_PROOF_OF_DELIVERY':
+                #    track_doc.sign_proof = 'SIGNATURE_PROOF_OF_DELIVERY'
+                track_doc.status = 'Delivered'
+                track_doc.recipient = trk_details[0].get('DeliverySignatureName')
+            elif status_code == 'CA':
+                track_doc.status = 'Cancelled'
                 track_doc.docstatus = 2
-                #Cancel the doc since the AWB no is WRONG.
-                track_doc.add_comment(trk_details_status.get('Message'))
-                track_doc.save()
+            elif status_code == 'OC':
+                track_doc.status = 'Booked'
+            else:
+                track_doc.status = 'In Transit'
+            des_dict = trk_details[0].get('DestinationAddress')
+            scan_events = trk_details[0].get('Events')
+            des_city = des_dict.get('City', None)
+            des_state = des_dict.get('StateOrProvinceCode', None)
+            des_country = des_dict.get('CountryName', None)
+            ship_to_city = (str(des_city) + ", " if des_city is not None else "") + \
+                           (str(des_state) + ", " if des_state is not None else "") + \
+                           (str(des_country) if des_country is not None else "")
+            if trk_details[0].get('DatesOrTimes'):
+                pickup_date = trk_details[0].get('DatesOrTimes')[0].get('DateOrTimestamp')
+                track_doc.pickup_date = datetime.strptime(pickup_date[:19], '%Y-%m-%dT%H:%M:%S')
+            scans = []
+            if scan_events:
+                for event in scan_events:
+                    if event.get('EventType') == 'DL':
+                        track_doc.delivery_date_time = event.get('Timestamp').replace(tzinfo=None)
+                    row_dict = {"time": event.get('Timestamp').replace(tzinfo=None)}
+                    city = event.get('Address').get('City', None)
+                    state = event.get('Address').get('StateOrProvinceCode', None)
+                    postcode = event.get('Address').get('PostalCode', None)
+                    country = event.get('Address').get('CountryName', None)
+                    location = (str(city) if city is not None else "") + (", " if city is not None else "") + \
+                               (str(state) if state is not None else "") + (", " if state is not None else "") + \
+                               (str(postcode) if postcode is not None else "") + (
+                                   ", " if postcode is not None else "") + \
+                               (str(country) if country is not None else "Base Location")
+                    row_dict["location"] = location
+                    event_desc = event.get('EventDescription', None)
+                    excep_code = event.get('StatusExceptionCode', None)
+                    excep_desc = event.get('StatusExceptionDescription', None)
+                    event_full_desc = event_desc + (" Excep Code: " if excep_code is not None else "") + \
+                                      (str(excep_code) if excep_code is not None else "") + \
+                                      " " + (str(excep_desc) if excep_desc is not None else "")
+                    row_dict["status_detail"] = event_full_desc
+                    scans.append(row_dict)
+            else:
+                frappe.throw('NO SCANS Recevied')
+            track_doc.status_code = status_code
+            track_doc.ship_to_city = ship_to_city
+            new_scans = append_new_scans(track_doc, scans)
+            save_if_changed(track_doc, snapshot, new_scans, carrier="Fedex", ignore_permissions=True)
         else:
-            print('Failed to Fetch Status from Fedex for {}'.format(track_doc.name))
-            frappe.msgprint('Failed to Fetch Status from Fedex for {}'.format(track_doc.name))
-
+            track_doc.manual_exception_removed = 1
+            track_doc.docstatus = 2
+            #Cancel the doc since the AWB no is WRONG.
+            track_doc.add_comment(trk_details_status.get('Message'))
+            track_doc.save()
     else:
-        frappe.throw("Not Fedex Account")
+        print('Failed to Fetch Status from Fedex for {}'.format(track_doc.name))
+        frappe.msgprint('Failed to Fetch Status from Fedex for {}'.format(track_doc.name))
+        set_poll_backoff(track_doc, carrier="Fedex")
 
 
 def delete_shipment_service(track_doc, credentials, transporter_doc):
@@ -348,7 +370,7 @@ def availabiltiy_commitment(credentials, from_address_doc, to_address_doc, from_
 
 
 def get_required_docs(track_doc):
-    transporter_doc = frappe.get_doc("Transporters", track_doc.carrier_name)
+    transporter_doc = frappe.get_cached_doc("Transporters", track_doc.carrier_name)
     if transporter_doc.fedex_credentials == 1:
         fedex_cred = 1
     elif transporter_doc.fedex_tracking_only == 1:
@@ -613,25 +635,115 @@ def set_package_details(pkg, shipment_response, tracking_id):
 
 
 def store_label(shipment, tracking_id, ps_doctype, ps_name):
-    label_data = base64.b64decode(
-        shipment.response.CompletedShipmentDetail.CompletedPackageDetails[0].Label.Parts[0].Image)
-    store_file('FEDEX-ID-{0}.pdf'.format(tracking_id), label_data, ps_doctype, ps_name)
+    # Returns the Path of the Label File
+    label_path = store_file('FEDEX-ID-{0}.pdf'.format(tracking_id),
+                            shipment.response.CompletedShipmentDetail.CompletedPackageDetails[0].Label.Parts[0].Image,
+                            ps_doctype, ps_name)
     if hasattr(shipment.response.CompletedShipmentDetail, 'ShipmentDocuments'):
-        invoice_data = base64.b64decode(
-            shipment.response.CompletedShipmentDetail.ShipmentDocuments[0].Parts[0].Image)
-        store_file('COMMER-INV-{0}-{1}.pdf'.format(ps_name, tracking_id), invoice_data, ps_doctype, ps_name)
+        store_file('COMMER-INV-{0}-{1}.pdf'.format(ps_name, tracking_id),
+                   shipment.response.CompletedShipmentDetail.ShipmentDocuments[0].Parts[0].Image, ps_doctype, ps_name)
+    return label_path
 
 
 def store_file(file_name, image_data, ps_doctype, ps_name):
-    frappe.msgprint(str(file_name))
-    save_file(file_name, image_data, ps_doctype, ps_name, is_private=1)
+    # Base64 Image is decoded in Chunks directly to the Private Files so that the whole File is never in Memory
+    # Returns the Path of the File
+    if isinstance(image_data, bytes):
+        image_data = image_data.decode('ascii')
+    if "\n" in image_data or "\r" in image_data:
+        image_data = image_data.replace("\r", "").replace("\n", "")
+    file_name = get_file_name(file_name, frappe.generate_hash(length=6))
+    file_path = frappe.get_site_path("private", "files", file_name)
+    content_hash = hashlib.md5()
+    chunk_size = 4 * 64 * 1024
+    with open(file_path, "wb") as f:
+        for i in range(0, len(image_data), chunk_size):
+            chunk = base64.b64decode(image_data[i:i + chunk_size])
+            content_hash.update(chunk)
+            f.write(chunk)
+    file_doc = attach_file(file_name, file_path, content_hash.hexdigest(), ps_doctype, ps_name)
+    return file_doc.get_full_path()
+
+
+def attach_file(file_name, file_path, content_hash, ps_doctype, ps_name):
+    # Single File Insert for a File already written to Private Files, Returns the File. If the same File is
+    # already attached then the existing File is returned and the written File is removed like save_file
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": file_name,
+        "file_url": "/private/files/" + file_name,
+        "attached_to_doctype": ps_doctype,
+        "attached_to_name": ps_name,
+        "is_private": 1,
+        "file_size": os.path.getsize(file_path),
+        "content_hash": content_hash
+    })
+    try:
+        file_doc.insert(ignore_permissions=True)
+    except frappe.DuplicateEntryError:
+        os.remove(file_path)
+        return frappe.get_doc("File", file_doc.duplicate_entry)
+    except Exception:
+        os.remove(file_path)
+        raise
+    return file_doc
+
+
+def merge_labels(label_files, file_name, ps_doctype, ps_name):
+    # Pages are read from the Label Files one at a time and written to a single PDF
+    from PyPDF2 import PdfFileMerger
+    file_name = get_file_name(file_name, frappe.generate_hash(length=6))
+    file_path = frappe.get_site_path("private", "files", file_name)
+    merger = PdfFileMerger(strict=False)
+    for label_path in label_files:
+        merger.append(label_path, import_bookmarks=False)
+    with open(file_path, "wb") as f:
+        merger.write(f)
+    merger.close()
+    content_hash = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            content_hash.update(chunk)
+    attach_file(file_name, file_path, content_hash.hexdigest(), ps_doctype, ps_name)
 
 
 def get_fedex_credentials(transporter_doc):
-    from fedex.config import FedexConfig
-    credentials = FedexConfig(key=transporter_doc.fedex_key,
-                              password=transporter_doc.fedex_password,
-                              account_number=transporter_doc.fedex_account_number,
-                              meter_number=transporter_doc.fedex_meter_number,
-                              use_test_server=transporter_doc.is_test_server)
-    return credentials
\ No newline at end of file
+    key = (transporter_doc.name, cstr(transporter_doc.modified))
+    if key not in fedex_config_cache:
+        from fedex.config import FedexConfig
+        clear_fedex_cache(transporter_doc.name)
+        fedex_config_cache[key] = FedexConfig(key=transporter_doc.fedex_key,
+                                              password=transporter_doc.fedex_password,
+                                              account_number=transporter_doc.fedex_account_number,
+                                              meter_number=transporter_doc.fedex_meter_number,
+                                              use_test_server=transporter_doc.is_test_server)
+        use_cached_wsdl()
+    return fedex_config_cache[key]
+
+
+def clear_fedex_cache(transporter=None):
+    for key in list(fedex_config_cache):
+        if transporter is None or key[0] == transporter:
+            del fedex_config_cache[key]
+
+
+def use_cached_wsdl():
+    # python-fedex makes a new suds Client for every Request which parses the WSDL each time.
+    # Client is replaced with one which parses each WSDL once and returns a clone for every Request,
+    # clone shares only the WSDL and has its own options and objects.
+    import fedex.base_service as base_service
+    if getattr(base_service, "rigpl_cached_client", 0) == 1:
+        return
+    from suds.client import Client
+
+    def cached_client(url, **kwargs):
+        if url not in wsdl_client_cache:
+            wsdl_client_cache[url] = Client(url, **kwargs)
+        client = wsdl_client_cache[url].clone()
+        from rigpl_erpnext.utils import http_utils
+        if http_utils.STUB is not None:
+            client.set_options(transport=http_utils.STUB.suds_transport())
+        return client
+
+    base_service.Client = cached_client
+    base_service.rigpl_cached_client = 1
\ No newline at end of file
@@ -4,17 +4,25 @@
 
 from __future__ import unicode_literals
 import frappe
+import hashlib
 from frappe.model.document import Document
 from datetime import datetime, date, timedelta
-from frappe.utils import getdate, add_days, now_datetime, nowtime, get_datetime, time_diff_in_seconds
+from frappe.utils import getdate, add_days, now_datetime, nowtime, get_datetime, time_diff_in_seconds, \
+	cint, cstr
+
+COMM_FIELDS = ["owner", "user", "communication_date", "duration", "sender", "follow_up", "next_action_date",
+	"communication_subtype", "communication_medium", "communication_type", "content", "reference_doctype",
+	"reference_name", "timeline_doctype", "timeline_name", "subject", "status", "sent_or_received"]
 
 class DailyCall(Document):
 	#TODO: Move Many of the COmmunications' Validatoins to Comm
 	def on_submit(self):
 		self.create_communications()
+		update_daily_call_summary(self, 1)
 
 	def on_cancel(self):
 		self.delete_communications()
+		update_daily_call_summary(self, -1)
 
 	def delete_communications(self):
 		for row in self.call_details:
@@ -27,12 +35,23 @@ class DailyCall(Document):
 				row.communication = ''
 
 	def create_communications(self):
-		self.validate()
+		#Validate is already run by Submit, Communications are Inserted in one Query
+		comm_list = []
 		for row in self.call_details:
-			create_new_communication(self.created_by, self.next_action_by, row)
+			comm_list.append(get_new_communication(self.created_by, self.next_action_by, row))
+		bulk_insert_communications(comm_list)
+		frappe.db.sql("""UPDATE `tabDaily Call Details` SET communication = CASE name %s END
+			WHERE name IN (%s)""" %(" ".join(["WHEN %s THEN %s"] * len(comm_list)), \
+			", ".join(["%s"] * len(comm_list))), tuple([val for row in self.call_details \
+				for val in (row.name, row.communication)] + [row.name for row in self.call_details]))
+		frappe.msgprint("Created New Communications {}".format(", ".join([frappe.get_desk_link(\
+			'Communication', row.communication) for row in self.call_details])))
 
 	def validate(self):
 		if self.call_details:
+			#Contacts and Leads for all Rows in one Query each
+			contact_map = get_contact_map(self.call_details)
+			lead_map = get_lead_map(self.call_details)
 			for row in self.call_details:
 				if row.communication:
 					frappe.throw('Communication {} already exists for Row# {}'.\
@@ -40,29 +59,32 @@ class DailyCall(Document):
 				if row.document == "Customer":
 					if row.document_name:
 						if row.contact:
-							check_contact(row.document, row.document_name, row.contact)
+							check_contact(row.document, row.document_name, row.contact, \
+								contact_map.get(row.document_name, []))
 						else:
-							row.contact = check_contact(row.document, row.document_name, row.contact)[0][0]
+							row.contact = check_contact(row.document, row.document_name, row.contact, \
+								contact_map.get(row.document_name, []))[0][0]
 					else:
 						frappe.throw("Customer is Mandatory")
 				elif row.document == "Lead":
 					#Check if Lead is converted
 					if row.document_name:
-						lead = frappe.get_doc("Lead", row.document_name)
+						lead = lead_map.get(row.document_name)
+						if not lead:
+							frappe.throw("Lead {} in Row# {} does not exist".format(row.document_name, row.idx))
 						if not row.lead_status:
 							row.lead_status = lead.status
 						else:
 							if row.lead_status != lead.status:
-								update_lead_status(lead, row.lead_status)
+								update_lead_status(frappe.get_doc("Lead", row.document_name), row.lead_status)
+								lead.status = row.lead_status
 						row.lead_contact_name = lead.lead_name
 						row.lead_organisation_name = lead.company_name
 						if lead.status == "Converted":
-							customer = frappe.db.sql("""SELECT name FROM `tabCustomer` 
-								WHERE lead_name = '%s'""" %(row.document_name), as_list=1)
-							if customer:
+							if lead.customer:
 								frappe.throw(("Selected Lead is already converted to {}. \n\
 									Please select the customer and not this Lead in Row # {}.").\
-									format(frappe.get_desk_link("Customer", customer[0][0]), \
+									format(frappe.get_desk_link("Customer", lead.customer), \
 										row.idx))
 							else:
 								frappe.throw("Selected Lead {} in Row# {} is Marked as Converted. \n\
@@ -87,16 +109,12 @@ class DailyCall(Document):
 					frappe.throw('Type of Communication is Mandatory')
 				if not row.details:
 					frappe.throw('Details of Communication are Mandatory')
-			
-			if row.no_action_required == 1:
-				#Check only System Managers can do this Entry
-				user = frappe.session.user
-				roles = frappe.db.sql("""SELECT role from `tabUserRole` where parent = '%s' """ \
-					%user, as_list=1)
-				row.next_action_date = ""
-			else:
-				if not row.next_action_date:
-					frappe.throw("Please add a Next Action Date")
+				#Communications are Inserted without their Validation so every Row is checked here
+				if row.no_action_required == 1:
+					row.next_action_date = ""
+				else:
+					if not row.next_action_date:
+						frappe.throw("Please add a Next Action Date in Row# {}".format(row.idx))
 		else:
 			frappe.throw("Enter Call Details before creating Communications")
 		
@@ -159,10 +177,33 @@ def get_linked_contact(doctype, txt, searchfield, start, page_len, filters, link
 			'page_len': page_len,
 		})
 
-def check_contact(link_doctype, link_docname, selected_contact=None):
-	contact = frappe.db.sql(""" SELECT parent FROM `tabDynamic Link` 
-		WHERE parenttype = 'Contact' AND link_doctype = '%s' 
-		AND link_name = '%s'"""%(link_doctype, link_docname), as_list=1)
+def get_contact_map(call_details):
+	contact_map = {}
+	customers = list(set([row.document_name for row in call_details \
+		if row.document == "Customer" and row.document_name]))
+	if customers:
+		for con in frappe.db.sql("""SELECT link_name, parent FROM `tabDynamic Link` 
+			WHERE parenttype = 'Contact' AND link_doctype = 'Customer' 
+			AND link_name IN (%s)"""%(", ".join(["%s"] * len(customers))), tuple(customers), as_list=1):
+			contact_map.setdefault(con[0], []).append([con[1]])
+	return contact_map
+
+def get_lead_map(call_details):
+	lead_map = {}
+	leads = list(set([row.document_name for row in call_details \
+		if row.document == "Lead" and row.document_name]))
+	if leads:
+		for lead in frappe.db.sql("""SELECT ld.name, ld.status, ld.lead_name, ld.company_name,
+			cu.name AS customer FROM `tabLead` ld LEFT JOIN `tabCustomer` cu ON cu.lead_name = ld.name
+			WHERE ld.name IN (%s)"""%(", ".join(["%s"] * len(leads))), tuple(leads), as_dict=1):
+			lead_map.setdefault(lead.name, lead)
+	return lead_map
+
+def check_contact(link_doctype, link_docname, selected_contact=None, contact=None):
+	if contact is None:
+		contact = frappe.db.sql(""" SELECT parent FROM `tabDynamic Link` 
+			WHERE parenttype = 'Contact' AND link_doctype = '%s' 
+			AND link_name = '%s'"""%(link_doctype, link_docname), as_list=1)
 	if contact:
 		if selected_contact:
 			check = 0
@@ -177,18 +218,19 @@ def check_contact(link_doctype, link_docname, selected_contact=None):
 	else:
 		frappe.throw('No Contact Found for {}: {}'.format(link_doctype, link_docname))
 
-def create_new_communication(created_by, next_action_by, row):
-	comm = frappe.new_doc("Communication")
+def get_new_communication(created_by, next_action_by, row):
+	comm = frappe._dict()
 	comm.owner = created_by
 	comm.user = next_action_by
 	comm.communication_date = row.communication_date
-	comm.duration = row.duration
+	comm.duration = cint(row.duration)
+	comm.follow_up = 0
 	comm.sender = created_by
 	#add custom field for next_action_date in Communication
 	#add custom field for communication_subtype in Communication
 	if row.no_action_required != 1:
 		comm.follow_up = 1
-	comm.next_action_date = row.next_action_date #This would add a TODO to USER fields' account on that day
+	comm.next_action_date = row.next_action_date or None #This would add a TODO to USER fields' account on that day
 	comm.communication_subtype = "Sales Related"
 	comm.communication_medium = row.type_of_communication 
 	#Change the above Select field by customize form view in Communication
@@ -209,7 +251,65 @@ def create_new_communication(created_by, next_action_by, row):
 			row.lead_organisation_name + " Contact:" + row.lead_contact_name
 	else:
 		frappe.throw("Error Contact aditya@rigpl.com")
-	comm.insert()
-	frappe.db.set_value('Daily Call Details', row.name, 'communication', comm.name)
+	comm.status = "Linked"
+	comm.sent_or_received = "Sent"
+	comm.name = frappe.generate_hash("Communication", 10)
 	row.communication = comm.name
-	frappe.msgprint("Created New Communication {}".format(frappe.get_desk_link('Communication', comm.name)))
\ No newline at end of file
+	return comm
+
+def bulk_insert_communications(comm_list):
+	'''
+	Inserts Communications of Daily Call in one Query. Rows are validated by Daily Call so
+	Communication Validations are not run again for every Row. Frappe's Communication Hooks
+	are also not run so Comment Count of the Reference and Realtime Timeline Updates are not
+	done for these Communications.
+	'''
+	if not comm_list:
+		return
+	now = now_datetime()
+	values = []
+	for comm in comm_list:
+		values.extend([comm.name, now, now, frappe.session.user] + [comm.get(field) for field in COMM_FIELDS])
+	placeholders = ", ".join(["(" + ", ".join(["%s"] * (len(COMM_FIELDS) + 4)) + ")"] * len(comm_list))
+	frappe.db.sql("""INSERT INTO `tabCommunication` (name, creation, modified, modified_by, %s) 
+		VALUES %s"""%(", ".join(["`%s`" % field for field in COMM_FIELDS]), placeholders), tuple(values))
+
+def get_summary_name(user, comm_date, document, type_of_communication):
+	#Same as MD5(CONCAT_WS()) used in rebuild_daily_call_summary
+	key = "|".join([cstr(user), cstr(comm_date), cstr(document), cstr(type_of_communication)])
+	return hashlib.md5(key.encode("utf-8")).hexdigest()
+
+def update_daily_call_summary(dcr, sign):
+	#Calls and Duration per User, Date, Document and Type are added on Submit and removed on Cancel
+	summary = {}
+	for row in dcr.call_details:
+		comm_date = getdate(row.communication_date)
+		key = (dcr.created_by, comm_date, row.document, row.type_of_communication)
+		summary.setdefault(key, [0, 0])
+		summary[key][0] += sign
+		summary[key][1] += sign * cint(row.duration)
+	if not summary:
+		return
+	now = now_datetime()
+	values = []
+	for key, val in summary.items():
+		values.extend([get_summary_name(*key), now, now, frappe.session.user, frappe.session.user] + \
+			list(key) + val)
+	placeholders = ", ".join(["(" + ", ".join(["%s"] * 11) + ")"] * len(summary))
+	frappe.db.sql("""INSERT INTO `tabDaily Call Summary` (name, creation, modified, owner, modified_by, 
+		user, communication_date, document, type_of_communication, calls, duration) VALUES %s 
+		ON DUPLICATE KEY UPDATE calls = calls + VALUES(calls), duration = duration + VALUES(duration), 
+		modified = VALUES(modified)"""%(placeholders), tuple(values))
+
+def rebuild_daily_call_summary():
+	frappe.db.sql("""DELETE FROM `tabDaily Call Summary`""")
+	frappe.db.sql("""INSERT INTO `tabDaily Call Summary` (name, creation, modified, owner, modified_by, 
+		user, communication_date, document, type_of_communication, calls, duration) 
+		SELECT MD5(CONCAT_WS('|', IFNULL(dcr.created_by, ''), DATE(dcrd.communication_date), 
+		IFNULL(dcrd.document, ''), IFNULL(dcrd.type_of_communication, ''))), NOW(), NOW(), 
+		'Administrator', 'Administrator', dcr.created_by, DATE(dcrd.communication_date), dcrd.document, 
+		dcrd.type_of_communication, COUNT(dcrd.name), SUM(IFNULL(dcrd.duration, 0)) 
+		FROM `tabDaily Call` dcr, `tabDaily Call Details` dcrd 
+		WHERE dcr.docstatus = 1 AND dcrd.parent = dcr.name AND dcrd.parenttype = 'Daily Call' 
+		GROUP BY dcr.created_by, DATE(dcrd.communication_date), dcrd.document, 
+		dcrd.type_of_communication""")
\ No newline at end of file
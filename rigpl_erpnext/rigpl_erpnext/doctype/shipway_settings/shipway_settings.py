@@ -4,11 +4,11 @@
 
 from __future__ import unicode_literals
 import frappe
-import requests
 import json
 from frappe.model.document import Document
 from frappe.integrations.utils import make_get_request, make_post_request, create_request_log
 from rigpl_erpnext.rigpl_erpnext.scheduled_tasks.shipment_data_update import get_shipway_url
+from rigpl_erpnext.utils.http_utils import http_get
 
 class ShipwaySettings(Document):
 	'''
@@ -43,7 +43,7 @@ class ShipwaySettings(Document):
 	'''
 	def get_carriers(self):
 		url = get_shipway_url() + "carriers"
-		carriers = requests.get(url=url, verify=False)
+		carriers = http_get(url, verify=False)
 		json_response = json.loads(carriers.text)
 		text = "Courier Name\t\t\t\tCourier ID\n"
 		courier_list = json_response.get("couriers")
@@ -15,4 +15,8 @@ class Transporters(Document):
 			self.fedex_credentials = 0
 		elif self.fedex_tracking_only == 1:
 			self.track_on_shipway = 0
-			self.fedex_credentials = 0
\ No newline at end of file
+			self.fedex_credentials = 0
+
+	def on_update(self):
+		from rigpl_erpnext.rigpl_erpnext.doctype.carrier_tracking.fedex_functions import clear_fedex_cache
+		clear_fedex_cache(self.name)
\ No newline at end of file
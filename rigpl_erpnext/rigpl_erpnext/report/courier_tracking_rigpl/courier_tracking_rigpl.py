@@ -26,7 +26,8 @@ def get_columns(filters):
 			"AWB No::100", "Status::90", "Code::60", 
 			"Receiver:Dynamic Link/Receiver Name:200", "Weight:Float:60", "Cost:Currency:80",
 			"City::100", "Country::90", "Pickup Date:Date:80", "From Address::150", 
-			"Delivery Date:Date:120", "Duration:Float:80", 
+			"Delivery Date:Date:120", "Duration:Float:80", "Last Scan:Datetime:130",
+			"Last Scan Status::200", "Last Location::120",
 			"Ref Doc:Dynamic Link/Document:100", "Integrity:Int:50", "Doc Status::50", 
 			"Creation:Date:120", "Created By:Link/User:100","Document::10", "Receiver Name::10"
 		]
@@ -48,42 +49,37 @@ def get_data(filters):
 			GROUP BY carrier_name
 			ORDER BY carrier_name"""%(conditions)
 	elif filters.get("detailed_report"):
-		query = """SELECT name, carrier_name, awb_number, status, status_code, 
-			receiver_name, CAST(IFNULL(total_weight,0) AS DECIMAL(10,2)), 
-			IFNULL(shipment_cost, 0), 
-			IFNULL(ship_to_city, 'X'), country, IFNULL(pickup_date, '1900-01-01'), 
-			IFNULL(from_address,"X"), delivery_date_time, 
-			DATEDIFF(IFNULL(delivery_date_time, CURDATE()), IFNULL(pickup_date, creation)),
-			document_name, invoice_integrity, docstatus, creation, owner, 
-			document, receiver_document
+		query = """SELECT %s
 			FROM `tabCarrier Tracking`
 			WHERE docstatus!=2 %s
-			ORDER BY creation ASC"""%(conditions)
+			ORDER BY creation ASC"""%(get_detail_fields(), conditions)
 	elif filters.get("pending_exceptions"):
-		query = """SELECT name, carrier_name, awb_number, status, status_code, 
-			receiver_name, CAST(IFNULL(total_weight,0) AS DECIMAL(10,2)), 
-			IFNULL(shipment_cost, 0), 
-			IFNULL(ship_to_city, 'X'), country, pickup_date, IFNULL(from_address,"X"), 
-			delivery_date_time, 
-			DATEDIFF(IFNULL(delivery_date_time, CURDATE()), IFNULL(pickup_date, creation)),
-			document_name, invoice_integrity, docstatus, creation, owner, 
-			document, receiver_document
+		query = """SELECT %s
 			FROM `tabCarrier Tracking`
 			WHERE docstatus != 2 AND status != "Delivered" AND manual_exception_removed = 0 
-			ORDER BY creation ASC"""
+			ORDER BY creation ASC"""%(get_detail_fields())
 	else:
-		query = """SELECT name, carrier_name, awb_number, status, status_code, 
-			receiver_name, ship_to_city, country, 
-			pickup_date, delivery_date_time, DATEDIFF(IFNULL(delivery_date_time, CURDATE()), 
-			IFNULL(pickup_date, creation)), document_name, invoice_integrity, 
-			docstatus, creation, document, receiver_document
+		query = """SELECT %s
 			FROM `tabCarrier Tracking`
 			WHERE docstatus != 0 AND status_code != 'DEL' %s
-			ORDER BY creation ASC""" %(cond_dates)
+			ORDER BY creation ASC""" %(get_detail_fields(), cond_dates)
 	data = frappe.db.sql(query, as_list=1)
 
 	return data
 
+def get_detail_fields():
+	#Scan Summary is kept on Carrier Tracking when Scans are received so Scans are not read here
+	return """name, carrier_name, awb_number, status, status_code, 
+		receiver_name, CAST(IFNULL(total_weight,0) AS DECIMAL(10,2)), 
+		IFNULL(shipment_cost, 0), 
+		IFNULL(ship_to_city, 'X'), country, IFNULL(pickup_date, '1900-01-01'), 
+		IFNULL(from_address,"X"), delivery_date_time, 
+		IF(status = 'Delivered' AND transit_days IS NOT NULL, transit_days,
+			DATEDIFF(IFNULL(delivery_date_time, CURDATE()), IFNULL(pickup_date, creation))),
+		last_scan_time, last_scan_status, last_scan_location,
+		document_name, invoice_integrity, docstatus, creation, owner, 
+		document, receiver_document"""
+
 
 def get_conditions(filters):
 	conditions = ""
@@ -93,7 +89,7 @@ def get_conditions(filters):
 		cond_dates += " AND creation >= '%s'" %(filters["from_date"])
 	if filters.get("to_date"):
 		conditions += " AND creation <= '%s'" %(filters["to_date"])
-		cond_dates += " AND creation <= '%s'" %(filters["from_date"])
+		cond_dates += " AND creation <= '%s'" %(filters["to_date"])
 	if filters.get("transporter"):
 		conditions += " AND carrier_name = '%s'" %filters["transporter"]
 	if filters.get("awb_no"):
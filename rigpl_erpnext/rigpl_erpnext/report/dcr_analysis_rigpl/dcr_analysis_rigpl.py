@@ -62,15 +62,15 @@ def get_columns(filters):
 				"Comm Owner::120", "Comm Next Contact By::120"
 			]
 def get_data(filters):
-	cond_dcr, cond_lead = get_conditions(filters)
+	cond_dcr, cond_lead, cond_sum = get_conditions(filters)
 
 	if filters.get("analysis_summary") == 1:
-		query = """SELECT dcr.created_by, dcrd.type_of_communication, COUNT(dcrd.name),
-			SUM(dcrd.duration)
-			FROM `tabDaily Call` dcr,  `tabDaily Call Details` dcrd 
-			WHERE dcr.docstatus = 1 
-			AND dcrd.parent = dcr.name %s 
-			GROUP BY dcr.created_by, dcrd.type_of_communication""" %(cond_dcr)
+		#Daily Call Summary is written on Submit and Cancel of Daily Call
+		query = """SELECT dcs.user, dcs.type_of_communication, SUM(dcs.calls),
+			SUM(dcs.duration)
+			FROM `tabDaily Call Summary` dcs 
+			WHERE dcs.calls != 0 %s 
+			GROUP BY dcs.user, dcs.type_of_communication""" %(cond_sum)
 	elif filters.get("analysis_details") == 1:
 		frappe.throw("WIP")
 	elif filters.get("comm_summary") == 1:
@@ -92,17 +92,21 @@ def get_data(filters):
 def get_conditions(filters):
 	cond_dcr = ""
 	cond_lead = ""
+	cond_sum = ""
 	if filters.get("from_date"):
 		cond_dcr += " AND dcrd.communication_date >= '%s'" %filters["from_date"]
+		cond_sum += " AND dcs.communication_date >= '%s'" %filters["from_date"]
 
 	if filters.get("to_date"):
 		cond_dcr += " AND dcrd.communication_date <= '%s'" %filters["to_date"]
+		cond_sum += " AND dcs.communication_date <= '%s'" %filters["to_date"]
 
 	if filters.get("document"):
 		cond_dcr += " AND dcrd.document <= '%s'" %filters["document"]
+		cond_sum += " AND dcs.document = '%s'" %filters["document"]
 
 	if filters.get("document") == 'Lead':
 		if filters.get("document_name"):
 			cond_lead += " AND ld.name = '%s'" %filters["document_name"]
 	
-	return cond_dcr, cond_lead
\ No newline at end of file
+	return cond_dcr, cond_lead, cond_sum
\ No newline at end of file
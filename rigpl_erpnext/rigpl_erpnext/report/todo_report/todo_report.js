@@ -23,6 +23,47 @@ frappe.query_reports["ToDo Report"] = {
 			"reqd": 1,
 			"default": "Open"
 		},
+		{
+			"fieldname":"from_date",
+			"label": "From Due Date",
+			"fieldtype": "Date"
+		},
+		{
+			"fieldname":"to_date",
+			"label": "To Due Date",
+			"fieldtype": "Date"
+		},
+		{
+			"fieldname":"reference_type",
+			"label": "Reference Type",
+			"fieldtype": "Link",
+			"options": "DocType"
+		},
+		{
+			"fieldname":"reference_name",
+			"label": "Reference Name",
+			"fieldtype": "Dynamic Link",
+			"options": "reference_type"
+		},
+		{
+			"fieldname":"sort_by",
+			"label": "Sort By",
+			"fieldtype": "Select",
+			"options": "Owner\nDue Date\nAssignment Date\nPriority",
+			"default": "Owner"
+		},
+		{
+			"fieldname":"page_length",
+			"label": "Rows per Page",
+			"fieldtype": "Int",
+			"default": 500
+		},
+		{
+			"fieldname":"page",
+			"label": "Page",
+			"fieldtype": "Int",
+			"default": 1
+		},
 		{
 			"fieldname":"summary",
 			"label": "Summary",
@@ -5,7 +5,12 @@ from __future__ import unicode_literals
 import frappe
 from frappe import _
 from frappe.desk.reportview import execute as runreport
-from frappe.utils import getdate
+from frappe.utils import getdate, cint
+
+#Sort Options of the Report and the Columns they Sort on
+SORT_BY = {"Owner": "owner, date", "Due Date": "date, owner", "Assignment Date": "creation DESC",
+	"Priority": "FIELD(priority, 'High', 'Medium', 'Low'), date"}
+DEFAULT_PAGE_LENGTH = 500
 
 def execute(filters=None):
 	if not filters: filters = {}
@@ -28,28 +33,27 @@ def get_columns(filters):
 		]
 
 def get_todo(filters):
-	conditions = get_conditions(filters)
+	conditions, values = get_conditions(filters)
 	
 	if filters.get("summary") != 1:
+		#Filters, Permission, Sort and Page are applied in the Query, uses Index on Owner, Status, Date
+		page_length = cint(filters.get("page_length")) or DEFAULT_PAGE_LENGTH
+		values["limit"] = page_length
+		values["offset"] = (max(cint(filters.get("page")), 1) - 1) * page_length
 		query = """SELECT name, priority, date, creation, description, 
 			reference_type, reference_name, owner, assigned_by
 		FROM `tabToDo` %s
-		ORDER BY owner, date""" % conditions
+		ORDER BY %s LIMIT %%(limit)s OFFSET %%(offset)s""" % (conditions, 
+			SORT_BY.get(filters.get("sort_by"), SORT_BY["Owner"]))
 			
-		data = frappe.db.sql(query ,as_dict=1)
+		data = frappe.db.sql(query, values, as_dict=1)
 		result = []
-		role = frappe.db.sql("""SELECT role FROM `tabUserRole` 
-			WHERE parent = '%s'""" % frappe.session.user, as_list=1)
-		for i in role:
-			if 'System Manager' in i:
-				role = "Allowed"
 		for todo in data:
-			if todo.owner==frappe.session.user or todo.assigned_by==frappe.session.user or role == 'Allowed':
-				if todo.reference_type:
-					todo.reference = """<a href="#Form/%s/%s">%s: %s</a>""" % (todo.reference_type,
-							todo.reference_name, todo.reference_type, todo.reference_name)
-				result.append([todo.name, todo.priority, todo.date, todo.creation,
-					todo.description, todo.reference, todo.owner, todo.assigned_by])
+			if todo.reference_type:
+				todo.reference = """<a href="#Form/%s/%s">%s: %s</a>""" % (todo.reference_type,
+						todo.reference_name, todo.reference_type, todo.reference_name)
+			result.append([todo.name, todo.priority, todo.date, todo.creation,
+				todo.description, todo.reference, todo.owner, todo.assigned_by])
 	else:
 
 		query = """SELECT td.owner, COUNT(IF(td.status = 'Open', 1, NULL)), 
@@ -65,20 +69,24 @@ def get_todo(filters):
 
 def get_conditions(filters):
 
-	conditions = ""
-	
-	if filters.get("status"):
-		conditions += "WHERE status = '%s'" % filters["status"]
+	conditions = []
+	values = {}
+	for field in ["status", "owner", "assigned_by", "reference_type", "reference_name"]:
+		if filters.get(field):
+			conditions.append("%s = %%(%s)s" % (field, field))
+			values[field] = filters[field]
 
-	if filters.get("owner"):
-		conditions += " and owner = '%s'" % filters["owner"]
+	if filters.get("from_date"):
+		conditions.append("date >= %(from_date)s")
+		values["from_date"] = getdate(filters["from_date"])
 
+	if filters.get("to_date"):
+		conditions.append("date <= %(to_date)s")
+		values["to_date"] = getdate(filters["to_date"])
 
-	if filters.get("assigned_by"):
-		conditions += " and assigned_by = '%s'" % filters["assigned_by"]
-		
-	if filters.get("trial_owner"):
-		conditions += " and tt.trial_owner = '%s'" % filters["trial_owner"]
-		
+	#Users other than System Manager only see ToDo they Own or have Assigned
+	if "System Manager" not in frappe.get_roles():
+		conditions.append("(owner = %(user)s OR assigned_by = %(user)s)")
+		values["user"] = frappe.session.user
 
-	return conditions
\ No newline at end of file
+	return ("WHERE " + " AND ".join(conditions)) if conditions else "", values
\ No newline at end of file
@@ -2,28 +2,136 @@
 # Copyright (c) 2019, Rohit Industries Ltd. and contributors
 # For license information, please see license.txt
 
+'''
+1. Delete all DocShare for Inactive Users.
+2. Get Leads modified after the Watermark along with Leads whose Quotations or
+   Addresses are modified after the Watermark. Full Reconciliation checks all Leads.
+3. Lead, its Quotations and Addresses are shared with the Lead Owner only, if the
+   Lead Owner is not the Owner of the Document. Shares are Added and Deleted in Bulk.
+'''
 from __future__ import unicode_literals
 import frappe
+from frappe.utils import cint, now_datetime, time_diff_in_hours
 from rigpl_erpnext.utils.rigpl_perm import *
-from rigpl_erpnext.rigpl_erpnext.validations.lead \
-	import lead_docshare, lead_quote_share, lead_address_share
-from frappe.share import add, remove
-
-def execute():
-	inactive_users = get_users(active=0)
-	for user in inactive_users:
-		delete_docshare(user=user[0])
+from frappe.share import add
+
+def execute(full=0):
+	run_started = now_datetime()
+	frappe.db.sql("""DELETE ds FROM `tabDocShare` ds, `tabUser` usr
+		WHERE usr.name = ds.user AND usr.enabled = 0""")
 	frappe.db.commit()
-	active_users = get_users(active=1)
-	lead_list = frappe.db.sql("""SELECT name FROM `tabLead` 
-		ORDER BY creation DESC""", as_list=1)
-	commit_chk = 0
-	for lead in lead_list:
-		lead_doc = frappe.get_doc("Lead", lead[0])
-		print("Checking For Lead " + lead[0])
-		lead_docshare(lead_doc)
-		lead_quote_share(lead_doc)
-		lead_address_share(lead_doc)
-		commit_chk += 1
-		if commit_chk%100 == 0:
-			frappe.db.commit()
\ No newline at end of file
+	watermark, last_full, full_days = frappe.db.get_value("User Share Settings", \
+		"User Share Settings", ["docshare_watermark", "last_full_reconciliation", \
+		"full_reconciliation_days"])
+	if not watermark:
+		full = 1
+	elif cint(full_days) > 0:
+		if not last_full or time_diff_in_hours(run_started, last_full) >= cint(full_days) * 24:
+			full = 1
+
+	if full == 1:
+		lead_list = frappe.db.sql("""SELECT name FROM `tabLead`
+			ORDER BY creation DESC""", as_list=1)
+	else:
+		lead_list = get_changed_leads(watermark)
+	print("Checking DocShare for {} Leads".format(len(lead_list)))
+	lead_names = [lead[0] for lead in lead_list]
+	for i in range(0, len(lead_names), 500):
+		sync_lead_shares(lead_names[i:i + 500])
+		frappe.db.commit()
+
+	frappe.db.set_value("User Share Settings", "User Share Settings", \
+		"docshare_watermark", run_started, update_modified=False)
+	if full == 1:
+		frappe.db.set_value("User Share Settings", "User Share Settings", \
+			"last_full_reconciliation", run_started, update_modified=False)
+	frappe.db.commit()
+
+def get_changed_leads(watermark):
+	query = """SELECT ld.name FROM `tabLead` ld WHERE ld.modified >= '%s'
+		UNION
+		SELECT qo.lead FROM `tabQuotation` qo WHERE qo.modified >= '%s'
+		AND IFNULL(qo.lead, '') != '' AND qo.customer IS NULL
+		UNION
+		SELECT dl.link_name FROM `tabDynamic Link` dl, `tabAddress` ad
+		WHERE dl.parenttype = 'Address' AND dl.link_doctype = 'Lead'
+		AND ad.name = dl.parent AND ad.modified >= '%s'"""%(watermark, watermark, watermark)
+	lead_list = frappe.db.sql(query, as_list=1)
+	return lead_list
+
+def sync_lead_shares(lead_names):
+	if not lead_names:
+		return
+	in_cond = ", ".join(["%s"] * len(lead_names))
+	lead_dict = frappe.db.sql("""SELECT name, owner, lead_owner FROM `tabLead`
+		WHERE name IN (%s)"""%(in_cond), tuple(lead_names), as_dict=1)
+	lead_owners = {}
+	for lead in lead_dict:
+		lead_owners[lead.name] = lead.lead_owner
+	quote_dict = frappe.db.sql("""SELECT name, owner, lead FROM `tabQuotation`
+		WHERE lead IN (%s) AND customer IS NULL"""%(in_cond), tuple(lead_names), as_dict=1)
+	add_dict = frappe.db.sql("""SELECT ad.name, ad.owner, dl.link_name AS lead
+		FROM `tabDynamic Link` dl, `tabAddress` ad
+		WHERE dl.parenttype = 'Address' AND dl.link_doctype = 'Lead'
+		AND dl.link_name IN (%s) AND ad.name = dl.parent"""%(in_cond), \
+		tuple(lead_names), as_dict=1)
+
+	#Target Documents as {(doctype, name): {lead_owner: rule}}
+	targets = {}
+	rule_cache = {}
+	documents = [["Lead", lead.name, lead.owner, lead.lead_owner] for lead in lead_dict]
+	documents += [["Quotation", qo.name, qo.owner, lead_owners.get(qo.lead)] \
+		for qo in quote_dict]
+	documents += [["Address", ad.name, ad.owner, lead_owners.get(ad.lead)] \
+		for ad in add_dict]
+	for doc in documents:
+		if not doc[3] or doc[2] == doc[3]:
+			continue
+		rule = get_share_rule(doc[3], doc[0], rule_cache)
+		if rule:
+			targets.setdefault((doc[0], doc[1]), {})[doc[3]] = rule
+
+	to_delete = []
+	to_insert = []
+	for doctype in ["Lead", "Quotation", "Address"]:
+		doc_names = [key[1] for key in targets if key[0] == doctype]
+		if not doc_names:
+			continue
+		shared_dict = frappe.db.sql("""SELECT name, user, share_name FROM `tabDocShare`
+			WHERE share_doctype = %s AND share_name IN (%s)"""%("%s", \
+			", ".join(["%s"] * len(doc_names))), tuple([doctype] + doc_names), as_dict=1)
+		shared_users = {}
+		for shared_doc in shared_dict:
+			allowed_users = targets[(doctype, shared_doc.share_name)]
+			if shared_doc.user in allowed_users:
+				shared_users.setdefault(shared_doc.share_name, []).append(shared_doc.user)
+			else:
+				to_delete.append(shared_doc.name)
+		for doc_name in doc_names:
+			for user, rule in targets[(doctype, doc_name)].items():
+				if user not in shared_users.get(doc_name, []):
+					if rule.notify_by_email:
+						#Share one by one so that the User gets Notified
+						add(doctype, doc_name, user=user, write=rule.write_access, \
+							share=rule.share_access, notify=rule.notify_by_email)
+					else:
+						to_insert.append({"user": user, "share_doctype": doctype, \
+							"share_name": doc_name, "write": rule.write_access, \
+							"share": rule.share_access})
+	bulk_delete_docshare(to_delete)
+	bulk_insert_docshare(to_insert)
+
+def get_share_rule(user, doctype, rule_cache):
+	#Returns the Share Access for User and Doctype if it needs to be Shared
+	if (user, doctype) not in rule_cache:
+		rule = None
+		enabled = frappe.get_value("User", user, "enabled")
+		role_list = get_user_roles(user)
+		if enabled == 1 and role_list and check_system_manager(user=user) != 1:
+			role_in_settings, write_access, share_access, notify_by_email = \
+				check_role_usershare(role_list=role_list, doctype=doctype)
+			if role_in_settings:
+				rule = frappe._dict({"write_access": write_access, \
+					"share_access": share_access, "notify_by_email": notify_by_email})
+		rule_cache[(user, doctype)] = rule
+	return rule_cache[(user, doctype)]
@@ -4,58 +4,78 @@
 
 from __future__ import unicode_literals
 import frappe
-from frappe.utils import nowdate, time_diff_in_hours, now_datetime
+from frappe.utils import nowdate, time_diff_in_hours, now_datetime, format_datetime, get_url_to_form
 import html2text
 
+DIGEST_TEMPLATE = "rigpl_erpnext/templates/emails/todo_digest.html"
+
 def daily():
-	today = nowdate()
 	now = now_datetime()
 	#First Check for Communications which can be used for making TODO
 	#only communication_type == "Communication" and communication_subtype == "Sales Related" 
 	#and next_action_date IS NOT NULL
-	comm = frappe.db.sql ("""SELECT name FROM `tabCommunication` 
-		WHERE communication_type = 'Communication' AND follow_up = 1 
-		AND next_action_date <= NOW()""", as_list= 1)
-
-	for i in comm:
-		print("Comm: " + str(i[0]) + " is going to TODO")
-		#Check if the communication is already in TODO for the user and Open.
-		#TODO Assigned by == Owner of the Communication
-		#TODO Owner  == User of Communication
-		comm = frappe.get_doc("Communication", i[0])
-		todo = frappe.db.sql("""SELECT name FROM `tabToDo` 
-			WHERE reference_type = 'Communication' AND reference_name = '%s' AND 
-			assigned_by = '%s' AND owner = '%s' """ %(i[0], comm.owner, comm.user), as_list=1)
-		
+	comm_list = frappe.db.sql("""SELECT name, owner, user, modified_by, subject, content,
+		communication_subtype, reference_doctype, reference_name, next_action_date
+		FROM `tabCommunication` WHERE communication_type = 'Communication' AND follow_up = 1 
+		AND next_action_date <= NOW()""", as_dict= 1)
+	if not comm_list:
+		return
+	#Existing TODO for all Communications in one Query
+	#TODO Assigned by == Owner of the Communication
+	#TODO Owner  == User of Communication
+	todo_map = get_todo_map([comm.name for comm in comm_list])
+	reopen_list = []
+	digest = {}
+	for comm in comm_list:
+		print("Comm: " + str(comm.name) + " is going to TODO")
+		todo = todo_map.get((comm.name, comm.owner, comm.user))
 		if todo:
-			tododoc = frappe.get_doc("ToDo", todo[0][0])
-			if tododoc.status == "Open":
-				send_reminder = check_follow_up_time(comm.next_action_date, now)
-				if send_reminder == 1:
-					send_follow_up_email(comm.user, comm.modified_by, comm.subject, \
-						comm.content, comm.reference_doctype, comm.reference_name)
-			else:
-				frappe.db.set_value("ToDo", todo[0][0], "status", "Open")
-				send_reminder = check_follow_up_time(comm.next_action_date, now)
-				if send_reminder == 1:
-					send_follow_up_email(comm.user, comm.modified_by, comm.subject, \
-						comm.content, comm.reference_doctype, comm.reference_name)
+			if todo.status != "Open":
+				reopen_list.append(todo.name)
+			send_reminder = check_follow_up_time(comm.next_action_date, now)
+			if send_reminder == 1:
+				add_to_digest(digest, comm, comm.modified_by)
 		else:
-			#Create TODO
-			todo = frappe.new_doc("ToDo")
-			todo.status = "Open"
-			todo.priority = "High"
-			todo.date = comm.next_action_date.date()
-			todo.owner = comm.user
-			todo.reference_type = "Communication"
-			todo.reference_name = comm.name
-			todo.type = comm.communication_subtype
-			todo.assigned_by = comm.owner
-			todo.description = comm.subject + "\n" + html2text.html2text(comm.content)[0:100] \
-				+ "\n" + comm.reference_doctype + " " + comm.reference_name
-			todo.insert()
-			send_follow_up_email(comm.user, comm.owner, comm.subject, \
-				comm.content, comm.reference_doctype, comm.reference_name)
+			make_todo(comm)
+			add_to_digest(digest, comm, comm.owner)
+	reopen_todos(reopen_list, now)
+	send_digests(digest)
+
+def get_todo_map(comm_names):
+	todo_map = {}
+	todo_list = frappe.db.sql("""SELECT name, status, reference_name, assigned_by, owner
+		FROM `tabToDo` WHERE reference_type = 'Communication' AND reference_name IN (%s)
+		ORDER BY creation""" %(", ".join(["%s"] * len(comm_names))), tuple(comm_names), as_dict=1)
+	for todo in todo_list:
+		todo_map.setdefault((todo.reference_name, todo.assigned_by, todo.owner), todo)
+	return todo_map
+
+def make_todo(comm):
+	todo = frappe.new_doc("ToDo")
+	todo.status = "Open"
+	todo.priority = "High"
+	todo.date = comm.next_action_date.date()
+	todo.owner = comm.user
+	todo.reference_type = "Communication"
+	todo.reference_name = comm.name
+	todo.type = comm.communication_subtype
+	todo.assigned_by = comm.owner
+	todo.description = comm.subject + "\n" + get_excerpt(comm) \
+		+ "\n" + comm.reference_doctype + " " + comm.reference_name
+	todo.insert()
+
+def reopen_todos(todo_list, now):
+	if not todo_list:
+		return
+	frappe.db.sql("""UPDATE `tabToDo` SET status = 'Open', modified = %s, modified_by = %s
+		WHERE name IN (%s)""" %("%s", "%s", ", ".join(["%s"] * len(todo_list))), \
+		tuple([now, frappe.session.user] + todo_list))
+
+def get_excerpt(comm):
+	#html2text only once per Communication for the TODO and the Digest
+	if comm.excerpt is None:
+		comm.excerpt = html2text.html2text(comm.content or "")[0:100]
+	return comm.excerpt
 
 def check_follow_up_time(time, now):
 	send_reminder = 0
@@ -63,8 +83,26 @@ def check_follow_up_time(time, now):
 		send_reminder = 1
 	return send_reminder
 
-def send_follow_up_email(user, sender, subject, content, ref_doc, ref_name):
-	frappe.sendmail(recipients=user,
-		sender=sender,
-		subject="Follow Up for: " + subject, 
-		content= content + "\n"  + ref_doc + " " + ref_name)
\ No newline at end of file
+def add_to_digest(digest, comm, sender):
+	if not comm.user:
+		return
+	get_excerpt(comm)
+	comm.sender = sender
+	comm.next_action = format_datetime(comm.next_action_date)
+	comm.comm_link = get_url_to_form("Communication", comm.name)
+	if comm.reference_doctype and comm.reference_name:
+		comm.ref_link = get_url_to_form(comm.reference_doctype, comm.reference_name)
+	digest.setdefault(comm.user, []).append(comm)
+
+def send_digests(digest):
+	#One Email per User with all the Follow Ups, Sender is kept if all are from one Sender
+	for user, items in digest.items():
+		senders = set([item.sender for item in items])
+		if len(items) == 1:
+			subject = "Follow Up for: " + items[0].subject
+		else:
+			subject = "Follow Up for {} Communications".format(len(items))
+		frappe.sendmail(recipients=user,
+			sender=senders.pop() if len(senders) == 1 else None,
+			subject=subject,
+			content=frappe.render_template(DIGEST_TEMPLATE, {"items": items}))
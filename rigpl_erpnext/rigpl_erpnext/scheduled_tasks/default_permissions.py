@@ -4,28 +4,89 @@
 
 '''
 1. Check if User is Active, if yes then get all default values for User
+2. The job runs on every scheduler tick so a fingerprint of Users, Roles and
+   User Permission Settings is stored after each run. If nothing changed since
+   the last run the job exits after a single query. User Permissions are not in
+   the fingerprint since this job and the hourly permission jobs write them, a
+   deleted default is made again on the next change of the User or a full run.
+3. If only Users or Roles changed then only the changed Users are checked,
+   a change in the Settings would check all the Users again.
 '''
 from __future__ import unicode_literals
 import frappe
+import hashlib
+from frappe.utils import now_datetime
 from rigpl_erpnext.utils.rigpl_perm import *
 
-def create_defaults():
-	user_list = get_users(active=1)
+def create_defaults(full=0):
+	settings_hash, users_hash, last_fingerprint, last_run = get_defaults_fingerprint()
+	fingerprint = settings_hash + "-" + users_hash
+	if full != 1 and fingerprint == last_fingerprint:
+		return
+	run_started = now_datetime()
+	if full == 1 or not last_fingerprint or not last_run or \
+		last_fingerprint.split("-")[0] != settings_hash:
+		user_list = get_users(active=1)
+	else:
+		user_list = get_changed_users(last_run)
+		if not user_list:
+			#Something was deleted which could not be traced to a User
+			user_list = get_users(active=1)
+
+	all_role_settings = get_user_perm_settings(apply_to_all_roles=1)
 	for user in user_list:
 		print("Checking for Defaults for User:" + user[0])
 		role_list = get_user_roles(user[0])
-		for role in role_list:
-			all_role_settings = get_user_perm_settings(apply_to_all_roles=1)
+		if role_list:
 			for setting in all_role_settings:
 				create_new_user_perm(allow=setting[1], \
 					for_value=setting[2], user=user[0], \
 					applicable_for=setting[3], \
 					apply_to_all_doctypes=setting[4])
-
+		for role in role_list:
 			default_value_settings = get_user_perm_settings(role=role[0], \
 				apply_to_all_doctypes="None")
 			for setting in default_value_settings:
 				create_new_user_perm(allow=setting[1], \
 					for_value=setting[2], user=user[0], \
 					applicable_for=setting[3], \
-					apply_to_all_doctypes=setting[4])
\ No newline at end of file
+					apply_to_all_doctypes=setting[4])
+	#Fingerprint taken at the start so that changes made during the run are
+	#picked up in the next run
+	set_defaults_fingerprint(fingerprint, run_started)
+
+def get_defaults_fingerprint():
+	'''
+	Returns the hash for the Settings, the hash for Users and Roles along with
+	the fingerprint and time of the last run
+	'''
+	fp = frappe.db.sql("""SELECT
+		(SELECT CONCAT_WS(',', COUNT(name), MAX(modified))
+			FROM `tabUser Permission Rules` WHERE parent = 'User Permission Settings'
+			AND parentfield = 'rules'),
+		(SELECT CONCAT_WS(',', COUNT(name), SUM(enabled), MAX(modified)) FROM `tabUser`),
+		(SELECT CONCAT_WS(',', COUNT(name), MAX(modified)) FROM `tabHas Role`
+			WHERE parenttype = 'User'),
+		(SELECT value FROM `tabSingles` WHERE doctype = 'User Permission Settings'
+			AND field = 'defaults_fingerprint'),
+		(SELECT value FROM `tabSingles` WHERE doctype = 'User Permission Settings'
+			AND field = 'defaults_last_run')""", as_list=1)[0]
+	settings_hash = hashlib.md5(str(fp[0]).encode('utf-8')).hexdigest()
+	users_hash = hashlib.md5((str(fp[1]) + "|" + str(fp[2])).encode('utf-8')).hexdigest()
+	return settings_hash, users_hash, fp[3], fp[4]
+
+def get_changed_users(last_run):
+	query = """SELECT usr.name FROM `tabUser` usr
+		WHERE usr.enabled = 1 AND (usr.modified >= '%s'
+		OR usr.name IN (SELECT hr.parent FROM `tabHas Role` hr
+			WHERE hr.parenttype = 'User' AND hr.modified >= '%s'))"""%(last_run, last_run)
+	user_list = frappe.db.sql(query, as_list=1)
+	return user_list
+
+def set_defaults_fingerprint(fingerprint, run_started):
+	#Modified is not updated else the Settings hash would change on every run
+	frappe.db.set_value("User Permission Settings", "User Permission Settings", \
+		"defaults_fingerprint", fingerprint, update_modified=False)
+	frappe.db.set_value("User Permission Settings", "User Permission Settings", \
+		"defaults_last_run", run_started, update_modified=False)
+	frappe.db.commit()
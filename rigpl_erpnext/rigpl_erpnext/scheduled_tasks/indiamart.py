@@ -5,10 +5,14 @@
 from __future__ import unicode_literals
 import frappe
 import json
-import requests
 from datetime import datetime
-from frappe.utils import add_days, flt, add_to_date
-from frappe.utils.global_search import rebuild_for_doctype, update_global_search
+from frappe.utils import add_to_date, cstr, flt, get_datetime, now_datetime
+from rigpl_erpnext.utils.contact_keys import find_by_key
+from rigpl_erpnext.utils.http_utils import http_get
+
+DEFAULT_START = '2010-01-01 00:00:00'
+MIN_WINDOW_HOURS = 1
+MAX_WINDOW_HOURS = 24
 
 
 def execute():
@@ -16,144 +20,105 @@ def execute():
 
 
 def get_indiamart_leads():
-    update_lead_global_search()
-    last_execution = frappe.get_value("IndiaMart Pull Leads", "IndiaMart Pull Leads", "last_execution")
-
-    if not last_execution:
-        last_execution = '2010-01-01 00:00:00.000000'
-    else:
-        last_execution = datetime.now()
-
-    days_to_add = flt(frappe.db.get_value("IndiaMart Pull Leads", "IndiaMart Pull Leads", "days_to_add"))
-
-    from_date_dt, to_date_dt, max_days = get_date_range(days_to_add)
-    time_diff = (datetime.now() - to_date_dt).total_seconds()
-    time_diff_from_dt = (datetime.now() - from_date_dt).total_seconds()
-
-    if time_diff < 0:
-        if time_diff_from_dt > 24 * 3600:
-            days_to_add = int(time_diff_from_dt / 24 / 3600)
-        elif time_diff_from_dt > 3600:
-            days_to_add = (int(time_diff_from_dt / 3600)) / 100
-        else:
-            print("Less than 1 hour time difference")
-            exit()
-        from_date_dt, to_date_dt, max_days = get_date_range(days_to_add)
+    '''
+    Pulls Leads from the Cursor (To Date of last Run) for a Window of Hours. Cursor only moves
+    once Leads of the Window are ingested so no Window is downloaded twice. Window doubles
+    when few Leads are received and halves on Throttling or when Max Leads is breached.
+    '''
+    im_pull = frappe.get_doc("IndiaMart Pull Leads", "IndiaMart Pull Leads")
+    rigpl_sett = frappe.get_doc("RIGPL Settings", "RIGPL Settings")
+    max_leads = flt(rigpl_sett.max_leads)
+    max_hours = flt(rigpl_sett.max_days) * 24 or MAX_WINDOW_HOURS
+    window_hours = min(max(flt(im_pull.window_hours) or max_hours, MIN_WINDOW_HOURS), max_hours)
+    last_execution = now_datetime()
+
+    from_date_dt, to_date_dt = get_date_range(im_pull.to_date, window_hours)
+    if (to_date_dt - from_date_dt).total_seconds() < MIN_WINDOW_HOURS * 3600:
+        print("Less than {} hour since Last Pull".format(MIN_WINDOW_HOURS))
+        return
 
     from_date_txt = from_date_dt.strftime('%d-%b-%Y %H:%M:%S')  # Text Date
     to_date_txt = to_date_dt.strftime('%d-%b-%Y %H:%M:%S')
     parsed_response, last_link = get_im_reply(from_date_txt, to_date_txt)
-
-    total_leads = parsed_response[0].get('TOTAL_COUNT')
-    max_leads = flt(frappe.db.get_value("RIGPL Settings", "RIGPL Settings", "max_leads"))
-    print(str(days_to_add))
-    if flt(total_leads) > max_leads:
-        print("Exiting Since Max Leads breached " + str(max_leads))
-        if days_to_add >= 2:
-            frappe.db.set_value('Indiamart Pull Leads', 'Indiamart Pull Leads', 'days_to_add', (days_to_add - 1))
-            frappe.db.commit()
-            exit()
-        elif 1 > days_to_add > 0.01:
-            frappe.db.set_value('Indiamart Pull Leads', 'Indiamart Pull Leads', 'days_to_add', (days_to_add - 0.01))
-            frappe.db.commit()
-            exit()
-        elif days_to_add == 0.01:
-            frappe.db.set_value('Indiamart Pull Leads', 'Indiamart Pull Leads', 'days_to_add', 0.0059)
-            frappe.db.commit()
-            exit()
-        elif days_to_add < 0.01:
-            frappe.db.set_value('Indiamart Pull Leads', 'Indiamart Pull Leads', 'days_to_add', days_to_add - 0.001)
-            frappe.db.commit()
-            exit()
-        elif days_to_add == 1:
-            frappe.db.set_value('Indiamart Pull Leads', 'Indiamart Pull Leads', 'days_to_add', 0.23)
-            frappe.db.commit()
-            exit()
-        else:
-            print('Unsupported Value for Days to Add')
-            exit()
-    else:
-        if days_to_add != max_days:
-            frappe.db.set_value('Indiamart Pull Leads', 'Indiamart Pull Leads', 'days_to_add', max_days)
-        make_or_update_lead(parsed_response, from_date_txt, to_date_txt, last_execution, last_link)
-
-    update_db(from_date_txt, to_date_txt, last_execution, last_link, total_leads)
-    update_lead_global_search()
+    reply_status = get_reply_status(parsed_response)
+    total_leads = flt(parsed_response[0].get('TOTAL_COUNT')) if parsed_response else 0
+
+    if reply_status == "Throttled":
+        print('Time Limit Reached, Window of {} Hours not Pulled'.format(window_hours))
+        update_window(max(window_hours / 2, MIN_WINDOW_HOURS))
+        return
+    elif reply_status == "OK" and max_leads and total_leads > max_leads and window_hours > MIN_WINDOW_HOURS:
+        print("Max Leads {} breached for Window of {} Hours".format(max_leads, window_hours))
+        update_window(max(window_hours / 2, MIN_WINDOW_HOURS))
+        return
+    elif reply_status == "OK":
+        make_or_update_lead(parsed_response)
+
+    if total_leads < max_leads / 2:
+        window_hours = min(window_hours * 2, max_hours)
+    update_db(from_date_dt, to_date_dt, last_execution, last_link, total_leads, window_hours)
     print('Done')
 
 
-def get_date_range(days_to_add):
-    from_date = frappe.get_value("IndiaMart Pull Leads", "IndiaMart Pull Leads", "to_date")
-    max_days = flt(frappe.get_value("RIGPL Settings", "RIGPL Settings", "max_days"))
-    if from_date is None:
-        from_date = '2010-01-01 00:00:00.000000'
+def get_date_range(cursor, window_hours):
+    from_date_dt = get_datetime(cursor or DEFAULT_START)
+    to_date_dt = min(add_to_date(from_date_dt, hours=window_hours), now_datetime())
+    return from_date_dt, to_date_dt
 
-    from_date_dt = datetime.strptime(from_date, '%Y-%m-%d %H:%M:%S.%f')  # Date Time Date
-    if days_to_add < 0.01 or days_to_add > max_days:
-        days_to_add = max_days
 
-    if days_to_add >= 1:
-        to_date_dt = add_days(from_date_dt, days_to_add)
-    elif days_to_add >= 0.01:
-        hrs_to_add = int(flt(days_to_add * 100))
-        print(str(hrs_to_add))
-        to_date_dt = add_to_date(from_date_dt, hours=hrs_to_add)
-        print(str(to_date_dt))
-    else:
-        to_date_dt = add_days(from_date_dt, max_days)
-        frappe.set_value("IndiaMart Pull Leads", "IndiaMart Pull Leads", "days_to_add", max_days)
+def get_reply_status(parsed_response):
+    if not parsed_response:
+        return "No Lead"
+    error_message = parsed_response[0].get('Error_Message', "NO ERROR")
+    if error_message == "NO ERROR":
+        return "OK"
+    elif "crossed this limit" in error_message:
+        return "Throttled"
+    elif "no leads" in error_message:
+        return "No Lead"
+    frappe.throw("IndiaMart Error: {}".format(error_message))
 
-    return from_date_dt, to_date_dt, max_days
 
+def update_window(window_hours):
+    frappe.db.set_value('IndiaMart Pull Leads', 'IndiaMart Pull Leads', 'window_hours', window_hours)
+    frappe.db.commit()
 
-def update_db(frm_dt_txt, to_dt_txt, lst_exe_dt, last_link, total_leads=0):
-    from_date = datetime.strptime(frm_dt_txt, '%d-%b-%Y %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S.%f')
-    to_date = datetime.strptime(to_dt_txt, '%d-%b-%Y %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S.%f')
 
-    frappe.db.set_value('Indiamart Pull Leads', 'Indiamart Pull Leads', 'from_date', from_date)
-    frappe.db.set_value('Indiamart Pull Leads', 'Indiamart Pull Leads', 'to_date', to_date)
-    frappe.db.set_value('Indiamart Pull Leads', 'Indiamart Pull Leads', 'last_lead_count', flt(total_leads))
-    frappe.db.set_value('Indiamart Pull Leads', 'Indiamart Pull Leads', 'last_link', last_link)
-    frappe.db.set_value('Indiamart Pull Leads', 'Indiamart Pull Leads', 'last_execution', lst_exe_dt)
+def update_db(from_date, to_date, lst_exe_dt, last_link, total_leads, window_hours):
+    frappe.db.set_value('IndiaMart Pull Leads', 'IndiaMart Pull Leads', {
+        'from_date': from_date, 'to_date': to_date, 'last_lead_count': flt(total_leads),
+        'last_link': last_link, 'last_execution': lst_exe_dt, 'window_hours': window_hours})
     frappe.db.commit()
 
 
-def make_or_update_lead(parsed_response, frm_dt_txt, to_dt_txt, lst_exe_dt, last_link):
-    em_time_limit = "It is advised to hit this API once in every 15 minutes,but it seems that you have crossed " \
-                    "this limit. please try again after 15 minutes."
-    em_no_lead = "There are no leads in the given time duration.please try for a different duration."
-    error_message = parsed_response[0].get('Error_Message', "NO ERROR")
-
-    if len(error_message) == len(em_time_limit):
-        print('Time Limit Reached')
-        exit()
-    elif len(error_message) == len(em_no_lead):
-        # Change the From Date and To Date and Execution Date and Lead Count so to run in future
-        update_db(frm_dt_txt, to_dt_txt, lst_exe_dt, last_link)
-        print('No Lead in Time Period')
-        exit()
-    elif error_message == "NO ERROR":
-        print(error_message)
-
-    total_leads = parsed_response[0].get('TOTAL_COUNT')
+def make_or_update_lead(parsed_response):
+    # Every Processed Query is kept in IndiaMart Query so a Window can be pulled again safely
+    query_ids = [cstr(lead.get('QUERY_ID')) for lead in parsed_response if lead.get('QUERY_ID')]
+    done_queries = get_processed_queries(query_ids)
     for lead in parsed_response:
+        query_id = cstr(lead.get('QUERY_ID'))
+        if query_id and query_id in done_queries:
+            print("Query ID {} already Processed".format(query_id))
+            continue
+        done_queries.add(query_id)
+        recd_time = datetime.strptime(lead.get('DATE_TIME_RE'), '%d-%b-%Y %I:%M:%S %p')
         lead_list = search_existing(search_m=lead.get('MOB', 'NO MOBILE'), search_e= \
             lead.get('SENDEREMAIL', 'NO EMAIL'), country=lead.get('COUNTRY_ISO'))
         if lead_list:
             for lead_name in lead_list:
-                frappe.db.set_value("Lead", lead_name, "source", "Campaign")
-                frappe.db.set_value("Lead", lead_name, "campaign_name", "India Mart")
-                recd_time = datetime.strptime(lead.get('DATE_TIME_RE'), '%d-%b-%Y %I:%M:%S %p')
-                frappe.db.set_value("Lead", lead_name, "creation", recd_time)
+                frappe.db.set_value("Lead", lead_name, {"source": "Campaign", "campaign_name": "India Mart",
+                                                        "indiamart_query_id": query_id})
                 print("Updated Lead {}".format(str(lead_name)))
+            record_query(query_id, lead_list[0], recd_time, "Lead Updated")
         else:
             if lead.get('MOB') is None and lead.get('SENDEREMAIL') is None:
-                print('No Lead Created for Query ID' + lead.get("QUERY_ID"))
+                print('No Lead Created for Query ID' + query_id)
+                record_query(query_id, None, recd_time, "Skipped")
             else:
                 print("Creating New Lead")
                 ld = frappe.new_doc("Lead")
                 ld.email_id = lead.get('SENDEREMAIL', 'IM-Email')
-                print(lead.get('QUERY_ID'))
+                print(query_id)
                 if lead.get('GLUSR_USR_COMPANYNAME') is None or (str(lead.get('GLUSR_USR_COMPANYNAME'))).replace(" ",
                                                                                                                  "") == "":
                     ld.company_name = 'IM-Company'
@@ -167,15 +132,33 @@ def make_or_update_lead(parsed_response, frm_dt_txt, to_dt_txt, lst_exe_dt, last
                     ld.territory = 'Exports'
                 ld.source = 'Campaign'
                 ld.campaign_name = 'India Mart'
+                ld.indiamart_query_id = query_id
                 ld.requirement = 100
-                ld.creation = datetime.strptime(lead.get('DATE_TIME_RE'), '%d-%b-%Y %I:%M:%S %p')
+                ld.creation = recd_time
                 ld.remark = str(lead.get('SUBJECT')) + " " + str(lead.get('ENQ_MESSAGE'))
                 ld.save()
                 print("Created New Lead# " + ld.name)
-                frappe.db.commit()
-                lead_doc = frappe.get_doc("Lead", ld.name)
-                update_global_search(lead_doc)
-            # update_lead_global_search()
+                record_query(query_id, ld.name, recd_time, "Lead Created")
+        frappe.db.commit()
+
+
+def record_query(query_id, lead_name, recd_time, action):
+    # Query ID is the Name so a Query is only recorded once, committed with its Lead
+    if not query_id:
+        return
+    now = now_datetime()
+    frappe.db.sql("""INSERT IGNORE INTO `tabIndiaMart Query` (name, creation, modified, owner, modified_by,
+        query_id, lead, received_on, action) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                  (query_id, now, now, frappe.session.user, frappe.session.user, query_id, lead_name, recd_time,
+                   action))
+
+
+def get_processed_queries(query_ids):
+    if not query_ids:
+        return set()
+    done = frappe.db.sql("""SELECT name FROM `tabIndiaMart Query` WHERE name IN (%s)"""
+                         % (", ".join(["%s"] * len(query_ids))), tuple(query_ids), as_list=1)
+    return set([row[0] for row in done])
 
 
 def get_im_reply(from_date, to_date):
@@ -186,7 +169,7 @@ def get_im_reply(from_date, to_date):
     link += 'GLUSR_MOBILE/' + str(im_mobile) + '/GLUSR_MOBILE_KEY/' + str(im_pass)
     link += '/Start_Time/' + str(from_date) + '/End_Time/' + str(to_date) + '/'
 
-    response = requests.get(link)
+    response = http_get(link)
     new_response = response.text
     frappe.db.set_value("IndiaMart Pull Leads", "IndiaMart Pull Leads", "json_reply", new_response)
     # new_response = json_reply
@@ -195,43 +178,13 @@ def get_im_reply(from_date, to_date):
 
 
 def search_existing(search_e, search_m, country):
-    if search_e != 'NO EMAIL' and search_e:
-        search_e_key = '%' + search_e + '%'
-    else:
-        search_e_key = "NO EMAIL ENTERED"
-
-    if search_m != 'NO MOBILE' and country == 'IN' and search_m:
-        if len(search_m) == 14:
-            search_m = search_m[4:]
-        elif len(search_m) < 5:
-            search_m = 'NO MOBILE'
-
-    if search_m != 'NO MOBILE' and search_m:
-        search_m_key = '%' + search_m + '%'
-    else:
-        search_m_key = None
-
-    if search_m_key:
-        lead_m = frappe.db.sql("""SELECT doctype, name FROM __global_search WHERE doctype = 'Lead' 
-        AND content LIKE '%s'""" % (search_m_key), as_dict=1)
-    else:
-        lead_m = {}
-
+    # Exact Match on Contact Key Index, Mobile is searched first and then Email
     lead_list = []
-    if lead_m:
-        for lead in lead_m:
-            lead_list.append(lead.name)
-        return lead_list
-    else:
-        if search_e_key:
-            lead_e = frappe.db.sql("""SELECT doctype, name FROM __global_search WHERE doctype = 'Lead' AND content 
-            LIKE '%s'""" % (search_e_key), as_dict=1)
-        if lead_e:
-            for lead in lead_e:
-                lead_list.append(lead.name)
-            return lead_list
-        else:
-            return []
+    if search_m and search_m != 'NO MOBILE':
+        lead_list = find_by_key("Phone", search_m, link_doctype="Lead", country=country)
+    if not lead_list and search_e and search_e != 'NO EMAIL':
+        lead_list = find_by_key("Email", search_e, link_doctype="Lead")
+    return lead_list
 
 
 def get_indiamart_login():
@@ -240,6 +193,3 @@ def get_indiamart_login():
     im_mobile = rigpl_sett.indiamart_primary_mobile
     return im_mobile, im_pass
 
-
-def update_lead_global_search():
-    rebuild_for_doctype('Lead')
@@ -9,13 +9,14 @@
 '''
 from __future__ import unicode_literals
 import frappe
-from frappe.utils.global_search import rebuild_for_doctype, \
-	delete_global_search_records_for_doctype
+from frappe.utils.global_search import rebuild_for_doctype
 from rigpl_erpnext.utils.rigpl_perm import *
 
 def check_permission_exist():
 	#'''
 	#delete_extra_global_search()
+	#Rebuild the Employee and Customer Index once a day
+	clear_permission_index()
 	clean_dynamic_link_table()
 	clean_sales_team_table()
 	check_all_account_perm()
@@ -96,16 +97,7 @@ def check_permission_exist():
 				#Check If user linked to Employee if yes then check if linked to Sales Person
 				#then check if Sales Person is linked to customer and then add customer
 				#then check corresponding Contact and Address and then add to permissions
-				emp = get_user_emp(user[0])
-				if emp:
-					s_person = get_sales_person(emp[0][0])
-				else:
-					s_person = []
-
-				if s_person:
-					cust_list = get_cust_from_sperson(s_person[0][0], 'Customer')
-				else:
-					cust_list = []
+				cust_list = get_user_allowed_customers(user[0])
 				role_in_settings, apply_to_all_doctypes, applicable_for = \
 					check_role(role_list, doctype="Customer", apply_to_all_doctypes="None")
 				if role_in_settings == 1:
@@ -113,15 +105,15 @@ def check_permission_exist():
 						for customer in cust_list:
 							#find existing permission and if not create perm
 							cust_perm = get_permission(user=user[0], allow='Customer', \
-								for_value=customer[0], applicable_for=applicable_for, \
+								for_value=customer, applicable_for=applicable_for, \
 								apply_to_all_doctypes=apply_to_all_doctypes)
 							if not cust_perm:
 								create_new_user_perm(user=user[0], allow='Customer', \
-								for_value=customer[0], applicable_for=applicable_for, \
+								for_value=customer, applicable_for=applicable_for, \
 								apply_to_all_doctypes=apply_to_all_doctypes)
 
 							con_list = get_dl_parent(dt='Contact', linked_dt='Customer', \
-								linked_dn= customer[0])
+								linked_dn= customer)
 							role_in_settings, apply_to_all_doctypes, applicable_for = \
 								check_role(role_list, doctype="Contact", apply_to_all_doctypes="None")
 							if role_in_settings == 1:
@@ -137,7 +129,7 @@ def check_permission_exist():
 												applicable_for=applicable_for, \
 												apply_to_all_doctypes=apply_to_all_doctypes)
 							add_list = get_dl_parent(dt='Address', linked_dt='Customer', \
-								linked_dn= customer[0])
+								linked_dn= customer)
 							role_in_settings, apply_to_all_doctypes, applicable_for = \
 								check_role(role_list, doctype="Address", apply_to_all_doctypes="None")
 							if role_in_settings == 1:
@@ -156,14 +148,11 @@ def check_permission_exist():
 			role_in_settings, apply_to_all_doctypes, applicable_for = \
 				check_role(role_list, doctype="Employee", apply_to_all_doctypes="None")
 			if role_in_settings == 1:
-				emp_list = get_employees(status='Active')
+				emp_list = get_user_allowed_employees(user[0])
 				for emp in emp_list:
-					allowed_ids = get_employees_allowed_ids(emp[0])
-					if allowed_ids:
-						if user[0] in allowed_ids:
-							create_new_user_perm(allow="Employee", user=user[0], \
-								for_value=emp[0], apply_to_all_doctypes=apply_to_all_doctypes, \
-								applicable_for=applicable_for)
+					create_new_user_perm(allow="Employee", user=user[0], \
+						for_value=emp, apply_to_all_doctypes=apply_to_all_doctypes, \
+						applicable_for=applicable_for)
 		print("Completed Adding Permissions for User: " + user[0])
 	#'''
 	delete_extra_perms()
@@ -186,7 +175,8 @@ def delete_extra_global_search():
 		if check == 1:
 			rebuild_for_doctype(doctype[0])
 		else:
-			delete_global_search_records_for_doctype(doctype[0])
+			purge_table("__global_search", " AND doctype = '%s'"%(doctype[0]), \
+				purge_key="Global Search:" + doctype[0])
 		print("Completed Rebuilding Global Search for " + doctype[0])
 
 def check_dt_exists(doctype):
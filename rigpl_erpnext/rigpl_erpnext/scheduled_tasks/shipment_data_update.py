@@ -5,163 +5,252 @@
 from __future__ import unicode_literals
 import re
 import json
+import hashlib
 import frappe
-import requests
 from datetime import datetime, date
-from ..doctype.carrier_tracking.fedex_functions import get_tracking_from_fedex
+from frappe.utils import now_datetime
+from ..doctype.carrier_tracking.fedex_functions import get_tracking_from_fedex, get_fedex_credentials, \
+    make_fedex_track_request, update_tracking_from_fedex
+from rigpl_erpnext.utils.http_utils import TokenBucket, fetch_concurrently, http_get, \
+    get_http_settings, print_http_metrics
+from rigpl_erpnext.utils.tracking_utils import append_new_scans, get_tracking_snapshot, save_if_changed, \
+    set_poll_backoff
+
+
+def reconcile_carrier_tracking():
+    # Carrier Tracking with Sales Invoice and Transporter are read in one Query and Changes are worked out
+    # in memory. Only changed Rows are Updated in Bulk.
+    # 1. Invoice Integrity: AWB is copied from SI to Ctrack or Ctrack to SI, if both have different AWB then
+    #    they are updated only if they are same without Spaces else they need to be changed manually.
+    # 2. Bypass Courier Charges Check is set where Courier Charged in Invoice is lower than Cost.
+    # 3. Delivery Date Time for Delivered Fedex Shipments is taken from the Last Scan.
+    ct_list = frappe.db.sql("""SELECT ct.name, ct.docstatus, ct.awb_number, ct.status, ct.status_code,
+        ct.document, ct.document_name, ct.invoice_integrity, ct.bypass_courier_charged_check, ct.purpose,
+        ct.shipment_cost, ct.amount, ct.courier_charged, ct.delivery_date_time,
+        tpt.max_percent_of_invoice_value, si.name as si_name, si.lr_no
+        FROM `tabCarrier Tracking` ct
+        LEFT JOIN `tabTransporters` tpt ON tpt.name = ct.carrier_name
+        LEFT JOIN `tabSales Invoice` si ON ct.document = 'Sales Invoice' AND si.name = ct.document_name
+        WHERE ct.docstatus != 2 ORDER BY ct.creation DESC""", as_dict=1)
+    ct_updates = {}
+    si_updates = {}
+    manual = 0
+    for ct in ct_list:
+        ct_upd = {}
+        if ct.document == 'Sales Invoice' and ct.invoice_integrity == 0 and ct.si_name:
+            ct_awb = 0 if ct.awb_number in ("NA", "", None) else 1
+            si_awb = 0 if ct.lr_no in ("NA", "", None) else 1
+            if ct.awb_number == ct.lr_no:
+                ct_upd["invoice_integrity"] = 1
+            elif ct_awb == 0 and si_awb == 1:
+                print("Update from SI. SI AWB= {} but Ctrack AWB= {} for {}".format(ct.lr_no, ct.awb_number,
+                                                                                    ct.name))
+                ct_upd["awb_number"] = ct.lr_no
+                ct_upd["next_poll_at"] = now_datetime()
+                ct.awb_number = ct.lr_no
+                if ct.docstatus == 0 and is_courier_cost_high(ct):
+                    ct_upd["bypass_courier_charged_check"] = 1
+            elif ct_awb == 1 and si_awb == 0:
+                print("Update from Ctrack. Ctrack AWB= {} but SI AWB= {} SI# {}".format(ct.awb_number, ct.lr_no,
+                                                                                       ct.si_name))
+                si_updates[ct.si_name] = ct.awb_number
+            elif ct_awb == 1 and si_awb == 1:
+                if re.sub('[^A-Za-z0-9]+', '', str(ct.awb_number)) == re.sub('[^A-Za-z0-9]+', '', str(ct.lr_no)):
+                    print("Updated SI# {} from CTRACK# {} as both were same without spaces".format(ct.si_name,
+                                                                                                 ct.name))
+                    si_updates[ct.si_name] = re.sub('[^A-Za-z0-9]+', '', str(ct.lr_no))
+                else:
+                    manual += 1
+                    print("{}. SI# {} and CTRACK# {} have different AWB".format(manual, ct.si_name, ct.name))
+        if ct.document == 'Sales Invoice' and ct.bypass_courier_charged_check == 0 and \
+                ct.status not in ("", "Not Booked") and is_courier_cost_high(ct):
+            ct_upd["bypass_courier_charged_check"] = 1
+        if ct_upd:
+            ct_updates[ct.name] = ct_upd
+
+    for ct_name, dl_time in get_missing_delivery_times():
+        ct_updates.setdefault(ct_name, {})["delivery_date_time"] = dl_time
+
+    print("Updating {} Carrier Tracking and {} Sales Invoice".format(len(ct_updates), len(si_updates)))
+    bulk_update_rows("Carrier Tracking", ct_updates)
+    bulk_update_rows("Sales Invoice", dict([(si, {"lr_no": lr_no}) for si, lr_no in si_updates.items()]))
+    frappe.db.commit()
+
+
+def get_missing_delivery_times():
+    # Returns [[name, delivery time]] from the Last Scan, Delivered ones without Scans are fetched from Fedex
+    dl_list = frappe.db.sql("""SELECT ct.name, MAX(sc.time) FROM `tabCarrier Tracking` ct
+        LEFT JOIN `tabCourier Tracking Scans` sc ON sc.parent = ct.name AND sc.parenttype = 'Carrier Tracking'
+        WHERE ct.status = 'Delivered' AND ct.docstatus != 2 AND ct.status_code = 'DL'
+        AND ct.delivery_date_time IS NULL GROUP BY ct.name""", as_list=1)
+    for ct in dl_list:
+        if not ct[1]:
+            print("{} has no Scans, Getting Delivery Time from Fedex".format(ct[0]))
+            get_tracking_from_fedex(frappe.get_doc('Carrier Tracking', ct[0]))
+            frappe.db.commit()
+    return [ct for ct in dl_list if ct[1]]
+
+
+def bulk_update_rows(doctype, updates, chunk_size=500):
+    # updates = {name: {field: value}}, one UPDATE per Field for each Chunk of Rows
+    fields = {}
+    for name, values in updates.items():
+        for field, value in values.items():
+            fields.setdefault(field, []).append([name, value])
+    for field, rows in fields.items():
+        for i in range(0, len(rows), chunk_size):
+            chunk = rows[i:i + chunk_size]
+            frappe.db.sql("""UPDATE `tab%s` SET `%s` = CASE name %s END, modified = %s
+                WHERE name IN (%s)""" % (doctype, field, " ".join(["WHEN %s THEN %s"] * len(chunk)), "%s",
+                                         ", ".join(["%s"] * len(chunk))),
+                          tuple([val for row in chunk for val in row] + [now_datetime()] +
+                                [row[0] for row in chunk]))
 
 
 def update_delivery_date_time():
-    ctrack_dict = frappe.db.sql("""SELECT ct.name FROM `tabCarrier Tracking` ct WHERE ct.status = 'Delivered' 
-    AND ct.docstatus !=2 AND ct.status_code = 'DL' AND ct.delivery_date_time IS NULL 
-    ORDER BY ct.creation ASC""", as_dict=1)
-    sno=1
-    for ct in ctrack_dict:
-        ct_doc = frappe.get_doc('Carrier Tracking', ct.name)
-        print(str(sno) + ". " + ct.name + " is being Updated")
-        sno +=1
-        get_tracking_from_fedex(ct_doc)
-        frappe.db.commit()
+    reconcile_carrier_tracking()
+
 
 def update_costing_bypass():
-    bypass_ct = frappe.db.sql("""SELECT ct.name FROM `tabCarrier Tracking` ct WHERE ct.docstatus<2 
-        AND ct.document = 'Sales Invoice' ORDER BY ct.creation DESC""")
-    sno = 0
-    for ct in bypass_ct:
-        ctrack_doc = frappe.get_doc("Carrier Tracking", ct[0])
-        trans_doc = frappe.get_doc('Transporters', ctrack_doc.carrier_name)
-        cost_high = courier_charges_validation(ctrack_doc, trans_doc, backend=1)
-        if cost_high == 1 and ctrack_doc.bypass_courier_charged_check==0 and ctrack_doc.status != "" \
-                and ctrack_doc.status != "Not Booked":
-            print('{}. Setting Bypass Courier Charges Check for {}'.format(str(sno+1), ct[0]))
-            ctrack_doc.bypass_courier_charged_check = 1
-            ctrack_doc.save()
-            sno += 1
+    reconcile_carrier_tracking()
 
 
 def update_ctrack_from_invoice():
-    ct_list = frappe.db.sql("""SELECT ct.name, ct.document_name FROM `tabCarrier Tracking` ct 
-        WHERE ct.docstatus !=2 AND ct.document = 'Sales Invoice' AND ct.invoice_integrity = 0 
-        ORDER BY ct.creation DESC""", as_list=1)
-    #AND DATEDIFF(CURDATE(),ct.creation) < 180
-    ct_sno = 0
-    si_sno = 0
-    man_sno = 0
-    for ct in ct_list:
-        ctrack_doc = frappe.get_doc('Carrier Tracking', ct[0])
-        trans_doc = frappe.get_doc('Transporters', ctrack_doc.carrier_name)
-
-        si_doc = frappe.get_doc('Sales Invoice', ct[1])
-        if ctrack_doc.awb_number == si_doc.lr_no:
-            print("Updating {} and making Invoice Integrity = 1".format(ctrack_doc.name))
-            ctrack_doc.invoice_integrity = 1
-            ctrack_doc.save()
-        else:
-            # If the data is not same in Ctrack and Sales Invoice
-            # then we need to check if Ctrack = NA or "" or it could be SI is NA or ""
-            # if both have value then do the change manually.
-            if ctrack_doc.awb_number == "NA" or ctrack_doc.awb_number == "" or ctrack_doc.awb_number is None:
-                ctrack_awb = 0
-            else:
-                ctrack_awb = 1
-            if si_doc.lr_no == "NA" or si_doc.lr_no == "" or si_doc.lr_no is None:
-                si_awb = 0
-            else:
-                si_awb = 1
-            if ctrack_awb == 0 and si_awb == 1:
-                if ctrack_doc.docstatus == 0:
-                    ctrack_doc.awb_number = si_doc.lr_no
-                else:
-                    frappe.db.set_value('Carrier Tracking', ctrack_doc.name, 'awb_number', si_doc.lr_no)
-                print(str(si_sno + 1) + ". Update from SI. SI AWB= " + si_doc.lr_no + " but Ctrack AWB= " +
-                      str(ctrack_doc.awb_number))
-                cost_high = courier_charges_validation(ctrack_doc, trans_doc, backend=1)
-                if cost_high == 1:
-                    ctrack_doc.bypass_courier_charged_check = 1
-                if ctrack_doc.docstatus == 0:
-                    ctrack_doc.save()
-                si_sno += 1
-            elif ctrack_awb == 1 and si_awb == 0:
-                print(str(ct_sno+1) + ". Update from Ctrack. Ctrack AWB= " + ctrack_doc.awb_number + " but SI AWB= "
-                      + str(si_doc.lr_no) + " SI# " + si_doc.name)
-                si_doc.lr_no = ctrack_doc.awb_number
-                si_doc.save()
-                ct_sno += 1
-            elif ctrack_awb == 1 and si_awb == 1:
-                #Both CTRACK and SI have different AWB now check if the AWB is same without SPACES.
-                if re.sub('[^A-Za-z0-9]+', '', str(ctrack_doc.awb_number)) == \
-                        re.sub('[^A-Za-z0-9]+', '', str(si_doc.lr_no)):
-                    print ("Updated SI# " + si_doc.name + " from CTRACK# " + ctrack_doc.name + " as both were"
-                                                                                               " same without spaces")
-                    si_doc.lr_no = re.sub('[^A-Za-z0-9]+', '', str(si_doc.lr_no))
-                    si_doc.save()
-                else:
-                    print(str(man_sno+1) + ". SI# " + si_doc.name + " and CTRACK# " + ctrack_doc.name +
-                      " have different AWB")
-                    man_sno += 1
+    reconcile_carrier_tracking()
+
+
+def is_courier_cost_high(ct):
+    # Same check as courier_charges_validation for a Sales Invoice sold Shipment without the Messages
+    if ct.max_percent_of_invoice_value is None or ct.shipment_cost is None or not ct.amount or ct.amount <= 0:
+        return 0
+    if ct.shipment_cost / ct.amount * 100 > ct.max_percent_of_invoice_value and ct.purpose == "SOLD" and \
+            ct.document == "Sales Invoice" and (ct.courier_charged or 0) < ct.shipment_cost and \
+            ct.bypass_courier_charged_check != 1:
+        return 1
+    return 0
 
 
 def send_bulk_tracks():
-    # Pause of 5seconds for sending data means 720 shipment data per hour can be sent
-    # Get the list of all Shipments which are not posted
-    unposted = frappe.db.sql("""SELECT ct.name FROM `tabCarrier Tracking` ct, `tabTransporters` tpt
-        WHERE ct.posted_to_shipway = 0 AND ct.docstatus != 2 AND ct.awb_number <> "NA"
-        AND ct.awb_number != "" AND tpt.track_on_shipway = 1 AND ct.carrier_name = tpt.name
-        ORDER BY ct.creation DESC """, as_list=1)
-    for tracks in unposted:
-        track_doc = frappe.get_doc("Carrier Tracking", tracks[0])
-        trans_doc = frappe.get_doc("Transporters", track_doc.carrier_name)
-        if trans_doc.fedex_credentials == 1 or trans_doc.fedex_tracking_only == 1:
-            print(("Direct Fedex Booking for {}. Not Posting to Shipway").format(track_doc.name))
-        else:
-            days_diff = (datetime.today().date() - track_doc.modified.date()).days
-            if 1 < days_diff < 20:
-                print('Pushed ' + track_doc.name + ' Older than 1 days. Total Days Old = ' + str(days_diff))
-                pushOrderData(track_doc)
-                frappe.db.commit()
-            elif days_diff >= 20:
-                print('NOT POSTING ' + track_doc.name + ' since Data is Now STALE with ' + str(days_diff) + " Days Old")
-            else:
-                print('NOT POSTING ' + track_doc.name + " " + \
-                      str(track_doc.creation) + ' Not Old Enough')
+    # Builds the Payload for all Shipments not Posted and older than 1 day and for Posted ones which have
+    # changed since they were Posted. Only the ones where Payload Hash differs from the last Posted are sent.
+    # Shipway takes one Order per Request so Requests are sent in Threads with Rate Limit.
+    # Fedex Shipments are not Posted and Data older than 20 days is STALE.
+    pending = frappe.db.sql("""SELECT ct.name, ct.awb_number, ct.posted_to_shipway, ct.shipway_payload_hash,
+        tpt.shipway_id, DATEDIFF(CURDATE(), ct.modified) as days_diff
+        FROM `tabCarrier Tracking` ct, `tabTransporters` tpt
+        WHERE ct.docstatus != 2 AND ct.awb_number <> "NA" AND ct.awb_number != ""
+        AND tpt.track_on_shipway = 1 AND ct.carrier_name = tpt.name
+        AND tpt.fedex_credentials != 1 AND tpt.fedex_tracking_only != 1
+        AND DATEDIFF(CURDATE(), ct.modified) < 20
+        AND ((ct.posted_to_shipway = 0 AND DATEDIFF(CURDATE(), ct.modified) > 1)
+        OR (ct.posted_to_shipway = 1 AND IFNULL(ct.shipway_payload_hash, '') != ''))
+        ORDER BY ct.creation DESC """, as_dict=1)
+    rset = frappe.get_single("RIGPL Settings")
+    timeout, retries, backoff = get_http_settings()
+    limiter = TokenBucket(rset.shipway_requests_per_second or 2)
+    username, license_key = get_shipway_pass()
+    jobs = []
+    to_push = {}
+    for tracks in pending:
+        payload = get_shipway_payload(tracks.name, tracks.awb_number, tracks.shipway_id)
+        payload_hash = get_payload_hash(payload)
+        if payload_hash == tracks.shipway_payload_hash:
+            continue
+        print('Pushing {} with Total Days Old = {}'.format(tracks.name, tracks.days_diff))
+        to_push[tracks.name] = [tracks, payload_hash]
+        jobs.append({"name": tracks.name, "function": shipway_push_request,
+                     "args": [payload, username, license_key, timeout, retries, backoff], "limiter": limiter})
+    print("{} of {} Shipments are New or Changed and would be Posted to Shipway".format(len(jobs), len(pending)))
+
+    results = fetch_concurrently(jobs, max_workers=rset.tracking_workers or 8)
+    failed = []
+    for name, res in results.items():
+        tracks, payload_hash = to_push[name]
+        if res["error"] or res["result"].get("status") != "Success":
+            print("Some Issues in posting {}: {}".format(name, res["error"] or res["result"]))
+            if tracks.posted_to_shipway == 0:
+                failed.append(name)
+            continue
+        values = {"posted_to_shipway": 1, "shipway_payload_hash": payload_hash}
+        if tracks.posted_to_shipway == 0:
+            values["status"] = "Shipment Data Uploaded"
+        frappe.db.set_value("Carrier Tracking", name, values)
+
+    # Unposted Orders whose Push failed may already be on Shipway, those are marked as Posted
+    check_jobs = [{"name": name, "function": shipway_tracking_request,
+                   "args": [name, username, license_key, timeout, retries, backoff], "limiter": limiter}
+                  for name in failed]
+    for name, res in fetch_concurrently(check_jobs, max_workers=rset.tracking_workers or 8).items():
+        if not res["error"] and res["result"].get("status") == "Success":
+            print("{} is already on Shipway, Marking it as Posted".format(name))
+            frappe.db.set_value("Carrier Tracking", name, {"posted_to_shipway": 1,
+                                                           "shipway_payload_hash": to_push[name][1],
+                                                           "status": "Shipment Data Uploaded"})
+    frappe.db.commit()
+    print_http_metrics()
 
 
 def get_all_ship_data():
-    # Pause of 5seconds for sending data means 720 shipment data per hour can be sent
-    # Get the list of all Shipments which are POSTED and NOT DELIVERED
-    pending_ships = frappe.db.sql("""SELECT ctrack.name as name, tpt.fedex_credentials as cred, 
-        ctrack.creation as creation, tpt.fedex_tracking_only as tracking_only, ctrack.modified as modified
-        FROM `tabCarrier Tracking` ctrack, `tabTransporters` tpt 
-        WHERE (ctrack.posted_to_shipway = 1 OR tpt.fedex_credentials = 1 or tpt.fedex_tracking_only = 1) 
-        AND ctrack.manual_exception_removed = 0 AND ctrack.docstatus != 2 AND tpt.name = ctrack.carrier_name 
-        AND ctrack.status != "Delivered" 
-        AND ctrack.awb_number != "NA" AND ctrack.awb_number != "" ORDER BY ctrack.creation DESC """, as_dict=1)
+    # Get the list of all Shipments which are POSTED and NOT DELIVERED and due for Polling as per Next Poll
+    # Requests are sent in Threads with Rate Limit per Carrier, Docs are Updated after all Requests are done
+    pending_ships = frappe.db.sql("""SELECT ctrack.name as name, tpt.fedex_credentials as cred,
+        tpt.fedex_tracking_only as tracking_only
+        FROM `tabCarrier Tracking` ctrack, `tabTransporters` tpt
+        WHERE ctrack.next_poll_at <= NOW()
+        AND (ctrack.posted_to_shipway = 1 OR tpt.fedex_credentials = 1 or tpt.fedex_tracking_only = 1)
+        AND ctrack.manual_exception_removed = 0 AND ctrack.docstatus != 2 AND tpt.name = ctrack.carrier_name
+        AND ctrack.status != "Delivered"
+        AND ctrack.awb_number != "NA" AND ctrack.awb_number != "" ORDER BY ctrack.next_poll_at""", as_dict=1)
+    rset = frappe.get_single("RIGPL Settings")
+    workers = rset.tracking_workers or 8
+    timeout, retries, backoff = get_http_settings()
+    shipway_limiter = TokenBucket(rset.shipway_requests_per_second or 2)
+    fedex_limiter = TokenBucket(rset.fedex_requests_per_second or 5)
+    username, license_key = get_shipway_pass()
+    fedex_cred = {}
+    jobs = []
+    track_docs = {}
     sno = 0
     for tracks in pending_ships:
-        days_diff = (datetime.today().date() - tracks.creation.date()).days
-        last_update_hrs = (datetime.now() - tracks.modified).seconds/3600
-        if (tracks.cred == 1 or tracks.tracking_only == 1) and days_diff < 150:
-            # Get from Fedex only if less than 150 days old
-            if last_update_hrs > 6:
-                print("{}. Getting Tracking for {} from Fedex".format(str(sno+1), tracks.name))
-                track_doc = frappe.get_doc("Carrier Tracking", tracks.name)
-                getOrderShipmentDetails(track_doc)
-            else:
-                print("{}. Fedex Tracking was updated less than 6 hrs ago hence skipping {}".
-                      format(str(sno+1), tracks.name))
-        elif (tracks.cred == 0 and tracks.tracking_only == 0) and days_diff < 60:
-            # Get from Shipway only less than 60 days old shipments
-            if last_update_hrs > 6:
-                print("{}. Getting Tracking for {} from Shipway".format(str(sno+1), tracks.name))
-                track_doc = frappe.get_doc("Carrier Tracking", tracks.name)
-                getOrderShipmentDetails(track_doc)
-            else:
-                print("{}. Shipway Tracking was updated less than 6 hrs ago hence skipping {}".
-                      format(str(sno + 1), tracks.name))
-        #track_doc.flags.ignore_permissions = True
+        track_doc = frappe.get_doc("Carrier Tracking", tracks.name)
+        if tracks.cred == 1 or tracks.tracking_only == 1:
+            print("{}. Getting Tracking for {} from Fedex".format(str(sno+1), tracks.name))
+            if track_doc.carrier_name not in fedex_cred:
+                fedex_cred[track_doc.carrier_name] = get_fedex_credentials(
+                    frappe.get_cached_doc("Transporters", track_doc.carrier_name))
+            tk_req = make_fedex_track_request(track_doc, fedex_cred[track_doc.carrier_name], timeout=timeout)
+            track_docs[tracks.name] = ["Fedex", track_doc, tk_req]
+            jobs.append({"name": tracks.name, "function": tk_req.send_request, "args": [],
+                         "limiter": fedex_limiter})
+        else:
+            print("{}. Getting Tracking for {} from Shipway".format(str(sno+1), tracks.name))
+            track_docs[tracks.name] = ["Shipway", track_doc, None]
+            jobs.append({"name": tracks.name, "function": shipway_tracking_request,
+                         "args": [tracks.name, username, license_key, timeout, retries, backoff],
+                         "limiter": shipway_limiter})
         sno += 1
 
+    results = fetch_concurrently(jobs, max_workers=workers)
+    for name, res in results.items():
+        carrier, track_doc, tk_req = track_docs[name]
+        if res["error"]:
+            print("Error Getting Tracking for {} from {}: {}".format(name, carrier, res["error"]))
+            set_poll_backoff(track_doc, carrier)
+            frappe.db.commit()
+            continue
+        try:
+            if carrier == "Fedex":
+                update_tracking_from_fedex(track_doc, tk_req)
+            else:
+                update_tracking_from_shipway(track_doc, res["result"])
+        except Exception as e:
+            frappe.db.rollback()
+            print("Error Updating Tracking for {}: {}".format(name, e))
+            set_poll_backoff(track_doc, carrier)
         frappe.db.commit()
+    print("Fetched {} Trackings in {} Seconds of Request Time".format(
+        len(results), round(sum([res["time"] for res in results.values()]), 2)))
+    print_http_metrics()
 
 
 def pushOrderData(track_doc):
@@ -171,27 +260,13 @@ def pushOrderData(track_doc):
                                                                                  trans_doc.fedex_tracking_only != 1):
         check_upload = post_to_shipway(track_doc)
         username, license_key = get_shipway_pass()
+        payload = get_shipway_payload(track_doc.name, track_doc.awb_number, trans_doc.shipway_id)
         if check_upload.get("status") != "Success":
-            url = get_shipway_url() + "pushOrderData"
-            post_data = {
-                "username": username,
-                "password": license_key,
-                "carrier_id": frappe.get_value("Transporters", track_doc.carrier_name,
-                                               "shipway_id"),  # from transporters doc
-                "awb": track_doc.awb_number,
-                "order_id": track_doc.name,
-                "first_name": "Rohit",
-                "last_name": "Cutting Tools",
-                "email": "gmail@gmail.com",
-                "phone": "9999999999",
-                "products": "N/A"
-            }
-            p_response = requests.get(url=url, verify=False, \
-                                      data=json.dumps(post_data))
-            post_response = json.loads(p_response.text)
+            post_response = shipway_push_request(payload, username, license_key)
             if post_response.get("status") == "Success":
                 track_doc.status = "Shipment Data Uploaded"
                 track_doc.posted_to_shipway = 1
+                track_doc.shipway_payload_hash = get_payload_hash(payload)
                 track_doc.save()
             else:
                 track_doc.status = "Posting Issues"
@@ -199,11 +274,41 @@ def pushOrderData(track_doc):
         else:
             track_doc.posted_to_shipway = 1
             track_doc.status = "Shipment Data Uploaded"
+            track_doc.shipway_payload_hash = get_payload_hash(payload)
             track_doc.save()
     elif track_doc.posted_to_shipway == 1:
         frappe.msgprint("Already Posted to Shipway")
 
 
+def get_shipway_payload(order_id, awb_number, shipway_id):
+    # Order Data without the Login so that the Hash does not change with Password
+    return {
+        "carrier_id": shipway_id,  # from transporters doc
+        "awb": awb_number,
+        "order_id": order_id,
+        "first_name": "Rohit",
+        "last_name": "Cutting Tools",
+        "email": "gmail@gmail.com",
+        "phone": "9999999999",
+        "products": "N/A"
+    }
+
+
+def get_payload_hash(payload):
+    return hashlib.md5(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def shipway_push_request(payload, username, license_key, timeout=None, retries=None, backoff=None):
+    # Only makes the Request and does not use DB when timeout, retries and backoff are given
+    url = get_shipway_url() + "pushOrderData"
+    post_data = dict(payload)
+    post_data["username"] = username
+    post_data["password"] = license_key
+    p_response = http_get(url, verify=False, data=json.dumps(post_data), timeout=timeout, retries=retries,
+                          backoff=backoff)
+    return json.loads(p_response.text)
+
+
 def getOrderShipmentDetails(track_doc):
     print("Processing Carrier Tracking #: " + track_doc.name)
     credentials = frappe.get_value("Transporters", track_doc.carrier_name, "fedex_credentials")
@@ -215,56 +320,66 @@ def getOrderShipmentDetails(track_doc):
     if track_doc.get("__islocal") != 1 and track_doc.status != "Delivered":
         if fedex_cred != 1:
             response = post_to_shipway(track_doc)
-            track_doc.json_reply = str(response)
-
-            if response.get("status") == "Success":
-                track_doc.scans = []
-                web_response = response.get("response")
-                web_scans = web_response.get("scan")
-
-                if web_response.get("current_status_code") == "DEL":
-                    track_doc.status = "Delivered"
-                    track_doc.docstatus = 1
-                elif web_response.get("current_status_code") == "NFI":
-                    track_doc.status = "No Information"
-                elif web_response.get("current_status_code") in ("CAN", "UND"):
-                    track_doc.docstatus = 1
-                    track_doc.status = "Cancelled"
-                else:
-                    track_doc.status = "In Transit"
-                if web_scans:
-                    for scan in web_scans:
-                        track_doc.append("scans", scan)
-
-                track_doc.status_code = web_response.get("current_status_code")
-                track_doc.pickup_date = web_response.get("pickupdate")
-                track_doc.ship_to_city = web_response.get("to")
-                #if web_response.get("awbno"):
-                    #track_doc.awb_number = web_response.get("awbno")
-                track_doc.recipient = web_response.get("recipient")
-                if track_doc.status == "Delivered":
-                    track_doc.delivery_date_time = web_response.get("time")
-                else:
-                    track_doc.delivery_date_time = None
-
-                track_doc.save()
-            else:
-                track_doc.status = "Posting Error"
+            update_tracking_from_shipway(track_doc, response)
         else:
             get_tracking_from_fedex(track_doc)
     elif track_doc.status == 'Delivered':
         frappe.msgprint(("{0} is Already Delivered").format(track_doc.name))
 
 
+def update_tracking_from_shipway(track_doc, response):
+    track_doc.json_reply = str(response)
+    if response.get("status") == "Success":
+        snapshot = get_tracking_snapshot(track_doc)
+        web_response = response.get("response")
+        web_scans = web_response.get("scan")
+
+        if web_response.get("current_status_code") == "DEL":
+            track_doc.status = "Delivered"
+            track_doc.docstatus = 1
+        elif web_response.get("current_status_code") == "NFI":
+            track_doc.status = "No Information"
+        elif web_response.get("current_status_code") in ("CAN", "UND"):
+            track_doc.docstatus = 1
+            track_doc.status = "Cancelled"
+        else:
+            track_doc.status = "In Transit"
+        new_scans = append_new_scans(track_doc, web_scans or [])
+
+        track_doc.status_code = web_response.get("current_status_code")
+        track_doc.pickup_date = web_response.get("pickupdate")
+        track_doc.ship_to_city = web_response.get("to")
+        #if web_response.get("awbno"):
+            #track_doc.awb_number = web_response.get("awbno")
+        track_doc.recipient = web_response.get("recipient")
+        if track_doc.status == "Delivered":
+            track_doc.delivery_date_time = web_response.get("time")
+        else:
+            track_doc.delivery_date_time = None
+
+        save_if_changed(track_doc, snapshot, new_scans)
+    else:
+        track_doc.status = "Posting Error"
+        print("Error in Shipway Reply for {}: {}".format(track_doc.name, track_doc.json_reply))
+        set_poll_backoff(track_doc)
+
+
 def post_to_shipway (track_doc):
     username, license_key = get_shipway_pass()
+    return shipway_tracking_request(track_doc.name, username, license_key)
+
+
+def shipway_tracking_request(order_id, username, license_key, timeout=None, retries=None, backoff=None):
+    # Only makes the Request and does not use DB when timeout, retries and backoff are given
+    # so it can be called in a Thread
     url = get_shipway_url() + "getOrderShipmentDetails"
     request = {
         "username": username,
         "password": license_key,
-        "order_id": track_doc.name
+        "order_id": order_id
     }
-    response = requests.get(url=url, verify=False, data=json.dumps(request))
+    response = http_get(url, verify=False, data=json.dumps(request), timeout=timeout, retries=retries,
+                        backoff=backoff)
     response_json = json.loads(response.text)
     return response_json
 
@@ -6,6 +6,7 @@ from frappe import msgprint
 from frappe.utils import getdate, cint, add_months, date_diff, add_days, nowdate, \
 	get_datetime_str, cstr, get_datetime, time_diff, time_diff_in_seconds
 from datetime import datetime, timedelta
+from rigpl_erpnext.utils.hr_calendar import get_calendar
 
 def on_update(doc,method):
 	validate(doc,method)
@@ -47,12 +48,9 @@ def get_shift(doc,method):
 	sa_list = frappe.db.sql(query, as_list=1)
 	if len(sa_list)<1:
 		#Check if Date is Holiday or not and if its holiday then take the shift of previous day
-		holiday_lst = frappe.get_value("Employee", doc.employee, "holiday_list")
-		hol_lst_doc = frappe.get_doc("Holiday List", holiday_lst)
 		check = 0
-		for d in hol_lst_doc.holidays:
-			if d.holiday_date == getdate(doc.attendance_date):
-				check = 1
+		if get_calendar().is_holiday(doc.employee, doc.attendance_date):
+			check = 1
 
 		if check == 1:
 			attendance_date = add_days(getdate(doc.attendance_date), -1)
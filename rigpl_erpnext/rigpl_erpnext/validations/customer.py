@@ -3,11 +3,13 @@ from __future__ import unicode_literals
 import frappe
 from frappe import msgprint
 from rigpl_erpnext.utils.rigpl_perm import *
+from rigpl_erpnext.utils.contact_keys import update_contact_keys
 import frappe.permissions
 import re
 
 def on_update(doc,method):
 	allowed_ids = []
+	update_contact_keys(doc, method)
 	#Check if Customer Login ID is not Repeated
 	if doc.customer_login_id:
 		other_login_id = frappe.db.sql("""SELECT name FROM `tabCustomer` 
@@ -49,6 +51,7 @@ def on_update(doc,method):
 				frappe.db.set_value("Opportunity", i[0], "customer", None)
 		
 			
+	refresh_customer_index(doc.name)
 	allowed_ids = get_customer_allowed_ids(doc.name)
 	for user in allowed_ids:
 		role_list = get_user_roles(user)
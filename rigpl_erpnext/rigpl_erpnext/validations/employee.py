@@ -34,6 +34,8 @@ def validate(doc,method):
 
 def on_update(doc,method):
 	allowed_ids = []
+	#Employee changes the Reporting and Sales Team Users so rebuild the Index
+	clear_permission_index()
 	allowed_ids = get_employees_allowed_ids(doc.employee)
 	for user in allowed_ids:
 		role_list = get_user_roles(user)
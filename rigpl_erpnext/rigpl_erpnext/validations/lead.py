@@ -5,6 +5,7 @@ from frappe import msgprint
 from frappe.share import add, remove
 import frappe.permissions
 from rigpl_erpnext.utils.rigpl_perm import *
+from rigpl_erpnext.utils.contact_keys import update_contact_keys
 
 def validate(doc,method):
 	if doc.lead_owner:
@@ -19,6 +20,7 @@ def validate(doc,method):
 
 def on_update(doc,method):
 	check_sys = 0
+	update_contact_keys(doc, method)
 	#Lock Lead if its linked to a Customer so no editing on Lead is allowed
 	check_conversion = frappe.db.sql("""SELECT name FROM `tabCustomer` 
 		WHERE lead_name = '%s'"""%(doc.name), as_list=1)
@@ -7,20 +7,38 @@ from frappe import msgprint
 from frappe.model.mapper import get_mapped_doc
 from frappe.utils import money_in_words, flt
 from erpnext.accounts.general_ledger import make_gl_entries, delete_gl_entries
-from erpnext.accounts.utils import get_fiscal_years, validate_fiscal_year, get_account_currency
+from erpnext.accounts.utils import validate_fiscal_year, get_account_currency
 from erpnext.hr.doctype.payroll_entry.payroll_entry import get_month_details, get_start_end_dates
-from erpnext.hr.doctype.employee.employee import get_holiday_list_for_employee
 from erpnext.hr.doctype.salary_slip.salary_slip import SalarySlip
 from erpnext.accounts.utils import get_fiscal_year
+from rigpl_erpnext.utils.hr_calendar import get_calendar
+from rigpl_erpnext.utils.payroll_batch import get_payroll_cache, forget_employee
 
 def post_gl_entry(doc):
-	comp_doc = frappe.get_doc("Company", doc.company)
+	#GL of Slips Submitted by a Payroll Run is kept and Inserted in Bulk after every Chunk
+	gl_map, ec_gl_maps = get_gl_map(doc)
+	for ec_gl_map in ec_gl_maps:
+		if frappe.flags.batch_salary_gl:
+			get_payroll_cache().pending_gl.extend(ec_gl_map)
+		else:
+			make_gl_entries(ec_gl_map, cancel=0, adv_adj=0)
+		frappe.msgprint(("Posted Expense Claim # {0}").format(ec_gl_map[0].voucher_no))
+	if frappe.flags.batch_salary_gl:
+		get_payroll_cache().pending_gl.extend(gl_map)
+	else:
+		make_gl_entries(gl_map, cancel=0, adv_adj=0)
+
+def get_gl_map(doc):
+	#Accounts of Company and Salary Components come from the Payroll Cache
+	cache = get_payroll_cache()
+	accounts = cache.get_gl_accounts(doc.company)
 	gl_map = []
-	fiscal_year = get_fy(doc)
+	ec_gl_maps = []
+	fiscal_year = cache.get_fiscal_year(doc)
 	ec_ded = 0
 	
 	for earn in doc.earnings:
-		earn_doc = frappe.get_doc("Salary Component", earn.salary_component)
+		earn_doc = cache.get_component(earn.salary_component)
 		if earn.amount != 0 and earn.expense_claim is None and earn_doc.only_for_deductions != 1:
 			#Condition for Earning Posting which is actually paid and not just for calculation
 			gl_dict = frappe._dict({
@@ -30,10 +48,10 @@ def post_gl_entry(doc):
 				'voucher_type': 'Salary Slip',
 				'voucher_no': doc.name,
 				'account': earn_doc.account,
-				'cost_center': comp_doc.cost_center,
+				'cost_center': accounts.cost_center,
 				'debit': flt(earn.amount),
 				'debit_in_account_currency': flt(earn.amount),
-				'against': comp_doc.default_payroll_payable_account
+				'against': accounts.default_payroll_payable_account
 			})
 			gl_map.append(gl_dict)
 		elif earn.expense_claim and earn.amount > 0:
@@ -41,15 +59,13 @@ def post_gl_entry(doc):
 			ec_ded += earn.amount
 			#Check if the expense claim is already posted if not then post the expense claim
 			#separately
-			ec_posted = frappe.db.sql("""SELECT name FROM `tabGL Entry` WHERE docstatus =1 AND
-				voucher_type = 'Expense Claim' AND voucher_no = '%s'
-				"""%(earn.expense_claim), as_list=1)
+			ec_posted = cache.get_ec_gl_entries(earn.expense_claim)
 			if not ec_posted:
 				
 				#Post the Expense Claim Separately.	
 				ec_doc = frappe.get_doc("Expense Claim", earn.expense_claim)
+				ecfy = cache.get_fiscal_year(ec_doc)
 				for exp in ec_doc.expenses:
-					ecfy = get_fy(ec_doc)
 					ec_gl_dict = frappe._dict({
 						'company': ec_doc.company,
 						'posting_date' : ec_doc.posting_date,
@@ -57,7 +73,7 @@ def post_gl_entry(doc):
 						'voucher_type': 'Expense Claim',
 						'voucher_no': ec_doc.name,
 						'account': exp.default_account,
-						'cost_center': comp_doc.cost_center,
+						'cost_center': accounts.cost_center,
 						'debit': flt(exp.sanctioned_amount),
 						'debit_in_account_currency': flt(exp.sanctioned_amount),
 						'against': ec_doc.employee
@@ -69,19 +85,18 @@ def post_gl_entry(doc):
 					'fiscal_year': ecfy,
 					'voucher_type': 'Expense Claim',
 					'voucher_no': ec_doc.name,
-					'account': (ec_doc.payable_account or comp_doc.default_payroll_payable_account),
-					'cost_center': (ec_doc.cost_center or comp_doc.cost_center),
+					'account': (ec_doc.payable_account or accounts.default_payroll_payable_account),
+					'cost_center': (ec_doc.cost_center or accounts.cost_center),
 					'party_type': 'Employee',
 					'party': ec_doc.employee,
 					'credit': flt(ec_doc.total_sanctioned_amount),
 					'credit_in_account_currency': flt(ec_doc.total_sanctioned_amount)
 				})
 				ec_gl_map.append(ec_gl_dict)
-				make_gl_entries(ec_gl_map, cancel=0, adv_adj=0)
-				frappe.msgprint(("Posted Expense Claim # {0}").format(earn.expense_claim))
+				ec_gl_maps.append(ec_gl_map)
 				
 	for ded in doc.deductions:
-		ded_doc = frappe.get_doc("Salary Component", ded.salary_component)
+		ded_doc = cache.get_component(ded.salary_component)
 		if flt(ded.amount) > 0 and ded.employee_loan is None:
 			gl_dict = frappe._dict({
 				'company': doc.company,
@@ -92,7 +107,7 @@ def post_gl_entry(doc):
 				'account': ded_doc.account,
 				'credit': flt(ded.amount),
 				'credit_in_account_currency': flt(ded.amount),
-				'against': comp_doc.default_payroll_payable_account
+				'against': accounts.default_payroll_payable_account
 			})
 			gl_map.append(gl_dict)
 		elif flt(ded.amount) > 0 and ded.employee_loan is not None:
@@ -117,12 +132,12 @@ def post_gl_entry(doc):
 			'fiscal_year': fiscal_year,
 			'voucher_type': 'Salary Slip',
 			'voucher_no': doc.name,
-			'account': comp_doc.default_payroll_payable_account,
+			'account': accounts.default_payroll_payable_account,
 			'credit': flt(doc.rounded_total - ec_ded),
 			'credit_in_account_currency': flt(doc.rounded_total - ec_ded),
 			'party_type': 'Employee',
 			'party': doc.employee,
-			'against': comp_doc.default_payroll_payable_account
+			'against': accounts.default_payroll_payable_account
 		})
 		gl_map.append(gl_dict)
 		gl_dict = frappe._dict({
@@ -131,17 +146,17 @@ def post_gl_entry(doc):
 			'fiscal_year': fiscal_year,
 			'voucher_type': 'Salary Slip',
 			'voucher_no': doc.name,
-			'account': comp_doc.round_off_account,
-			'cost_center': comp_doc.round_off_cost_center,
+			'account': accounts.round_off_account,
+			'cost_center': accounts.round_off_cost_center,
 			'debit': flt(doc.rounded_total - doc.net_pay),
 			'debit_in_account_currency': flt(doc.rounded_total - doc.net_pay),
-			'against': comp_doc.default_payroll_payable_account
+			'against': accounts.default_payroll_payable_account
 		})
 		gl_map.append(gl_dict)
 			
 	for cont in doc.contributions:
 		if cont.amount > 0:
-			cont_doc = frappe.get_doc("Salary Component", cont.salary_component)
+			cont_doc = cache.get_component(cont.salary_component)
 			gl_dict = frappe._dict({
 				'company': doc.company,
 				'posting_date' : doc.posting_date,
@@ -149,7 +164,7 @@ def post_gl_entry(doc):
 				'voucher_type': 'Salary Slip',
 				'voucher_no': doc.name,
 				'account': cont_doc.account,
-				'cost_center': comp_doc.cost_center,
+				'cost_center': accounts.cost_center,
 				'debit': flt(cont.amount),
 				'debit_in_account_currency': flt(cont.amount),
 				'against': cont_doc.liability_account
@@ -167,17 +182,8 @@ def post_gl_entry(doc):
 				'against': cont_doc.account
 			})
 			gl_map.append(gl_dict)
-	make_gl_entries(gl_map, cancel=0, adv_adj=0)
+	return gl_map, ec_gl_maps
 		
-def get_fy(document):
-	fiscal_years = get_fiscal_years(document.posting_date, company=document.company)
-	if len(fiscal_years) > 1:
-		frappe.throw(_("Multiple fiscal years exist for the date {0}. \
-			Please set company in Fiscal Year").format(formatdate(document.posting_date)))
-	else:
-		fiscal_year = fiscal_years[0][0]
-	return fiscal_year
-
 def on_submit(doc,method):
 	if doc.net_pay < 0:
 		frappe.throw(("Negative Net Pay Not Allowed for {0}").format(doc.name))
@@ -185,24 +191,25 @@ def on_submit(doc,method):
 	#Update the expense claim amount cleared so that no new JV can be made
 	for i in doc.earnings:
 		if i.expense_claim:
-			ec = frappe.get_doc("Expense Claim", i.expense_claim)
-			frappe.db.set_value("Expense Claim", i.expense_claim, "total_amount_reimbursed", \
-				i.amount)
-			frappe.db.set_value("Expense Claim", i.expense_claim, "status", "Paid")
+			frappe.db.set_value("Expense Claim", i.expense_claim, {"total_amount_reimbursed": i.amount, \
+				"status": "Paid"})
 
 	#post the salary slip to GL entry table
 	post_gl_entry(doc)	
+	forget_employee(doc)
 			
 def on_cancel(doc,method):
 	#Update the expense claim amount cleared so that no new JV can be made
 	for i in doc.earnings:
 		if i.expense_claim:
-			ec = frappe.get_doc("Expense Claim", i.expense_claim)
-			frappe.db.set_value("Expense Claim", i.expense_claim, "total_amount_reimbursed", 0)
-			frappe.db.set_value("Expense Claim", i.expense_claim, "status", "Unpaid")
+			frappe.db.set_value("Expense Claim", i.expense_claim, {"total_amount_reimbursed": 0, \
+				"status": "Unpaid"})
 	delete_gl_entries(None, 'Salary Slip', doc.name)
+	forget_employee(doc)
 	
 def validate(doc,method):
+	#Inputs of all Employees of the Payroll Entry are loaded by the first Slip of the Payroll Entry
+	get_payroll_cache(doc)
 	get_edc(doc)
 	update_fields(doc)
 	msd, med = get_month_dates(doc)
@@ -214,32 +221,27 @@ def validate(doc,method):
 	validate_ec_posting(doc)
 
 def update_fields(doc):
-	sstr = frappe.get_doc("Salary Structure", doc.salary_structure)
+	sstr = get_payroll_cache().get_salary_structure(doc.salary_structure)
 	doc.letter_head = sstr.letter_head
-	doc.deparment = frappe.get_value("Employee", doc.employee, "department")
+	doc.deparment = get_payroll_cache().get_employee(doc.employee).department
 
 def validate_ec_posting(doc):
-	comp_doc = frappe.get_doc("Company", doc.company)
+	comp_doc = frappe.get_cached_doc("Company", doc.company)
 	for e in doc.earnings:
 		if e.expense_claim:
 			#Check if the expense claim is properly posted in  Expenses Payable
-			posted = frappe.db.sql("""SELECT name FROM `tabGL Entry` 
-					WHERE voucher_type = 'Expense Claim' AND voucher_no = '%s'
-					AND docstatus = 1""" %(e.expense_claim), as_list=1)
+			posted = get_payroll_cache().get_ec_gl_entries(e.expense_claim)
 			if posted:
 				for ec_claim in posted:
 					#Check Credit Entry's account should be Expenses Payable
-					debit = frappe.db.sql("""SELECT name, credit, account
-						FROM `tabGL Entry` WHERE name = '%s'"""%(ec_claim[0]), as_list=1)
-						
-					if debit[0][1] > 0:
-						if debit[0][2] != comp_doc.default_payroll_payable_account:
+					if ec_claim.credit > 0:
+						if ec_claim.account != comp_doc.default_payroll_payable_account:
 							frappe.throw(("Expense Claim {0} in Salary Slip {1} is not posted \
 							correctly").format(e.expense_claim, doc.name))
 	
 def recalculate_formula(doc, table):
 	data = SalarySlip.get_data_for_eval(doc)
-	salary_structure_doc = frappe.get_doc("Salary Structure", doc.salary_structure)
+	salary_structure_doc = get_payroll_cache().get_salary_structure(doc.salary_structure)
 	for table_name in table:
 		for comp in salary_structure_doc.get(table_name):
 			amount = SalarySlip.eval_condition_and_formula(doc, comp, data)
@@ -250,7 +252,7 @@ def calculate_net_salary(doc, msd, med):
 	tot_ded = 0
 	tot_cont = 0
 	tot_books = 0
-	emp = frappe.get_doc("Employee", doc.employee)
+	emp = get_payroll_cache().get_employee(doc.employee)
 	tdim, twd = get_total_days(doc, emp, msd, med)
 	holidays = get_holidays(doc, msd, med, emp)
 	lwp, plw = get_leaves(doc, msd, med, emp)
@@ -258,20 +260,9 @@ def calculate_net_salary(doc, msd, med):
 	doc.posting_date = med
 	wd = twd - holidays #total working days
 	doc.total_days_in_month = tdim
-	att = frappe.db.sql("""SELECT sum(overtime), count(name) FROM `tabAttendance` 
-		WHERE employee = '%s' AND attendance_date >= '%s' AND attendance_date <= '%s' 
-		AND status = 'Present' AND docstatus=1""" \
-		%(doc.employee, msd, med),as_list=1)
-
-	half_day = frappe.db.sql("""SELECT count(name) FROM `tabAttendance` 
-		WHERE employee = '%s' AND attendance_date >= '%s' AND attendance_date <= '%s' 
-		AND status = 'Half Day' AND docstatus=1""" \
-		%(doc.employee, msd, med),as_list=1)
-	
-	t_hd = flt(half_day[0][0])
-	t_ot = flt(att[0][0])
+	#Overtime, Present and Half Days of all Employees in the Cache are loaded in one Query
+	t_ot, tpres, t_hd = get_payroll_cache().get_attendance(doc.employee, msd, med)
 	doc.total_overtime = t_ot
-	tpres = flt(att[0][1])
 
 	ual = twd - tpres - lwp - holidays - plw - (t_hd/2)
 	
@@ -304,7 +295,7 @@ def calculate_net_salary(doc, msd, med):
 			chk_ot = 1
 	
 	for d in doc.earnings:
-		earn = frappe.get_doc("Salary Component", d.salary_component)
+		earn = get_payroll_cache().get_component(d.salary_component)
 		if earn.depends_on_lwp == 1:
 			d.depends_on_lwp = 1
 		else:
@@ -340,7 +331,7 @@ def calculate_net_salary(doc, msd, med):
 	#Calculate Deductions
 	for d in doc.deductions:
 		if d.salary_component != 'Loan Deduction':
-			sal_comp_doc = frappe.get_doc("Salary Component", d.salary_component)
+			sal_comp_doc = get_payroll_cache().get_component(d.salary_component)
 			if sal_comp_doc.depends_on_lwp == 1:
 				if sal_comp_doc.round_up == 1:
 					d.amount = int(flt(d.default_amount) * flt(doc.payment_days_for_deductions)/tdim)+1
@@ -368,24 +359,17 @@ def get_leaves(doc, start_date, end_date, emp):
 	#Find out the number of leaves applied by the employee only working days
 	lwp = 0 #Leaves without pay
 	plw = 0 #paid leaves
-	diff = (end_date - start_date).days + 1
-	for day in range(0, diff):
-		date = start_date + datetime.timedelta(days=day)
-		auth_leaves = frappe.db.sql("""SELECT la.name FROM `tabLeave Application` la
-			WHERE la.status = 'Approved' AND la.docstatus = 1 AND la.employee = '%s'
-			AND la.from_date <= '%s' AND la.to_date >= '%s'""" % (doc.employee, date, date), as_list=1)
-		if auth_leaves:
-			auth_leaves = auth_leaves[0][0]
-			lap = frappe.get_doc("Leave Application", auth_leaves)
-			ltype = frappe.get_doc("Leave Type", lap.leave_type)
-			hol = get_holidays(doc, date, date, emp)
-			if hol:
-				pass
+	#Approved Leaves of the Period come from the Calendar shared by the Payroll Run
+	leaves = get_calendar().get_leaves(doc.employee, start_date, end_date)
+	for date, is_lwp in leaves.items():
+		hol = get_holidays(doc, date, date, emp)
+		if hol:
+			pass
+		else:
+			if is_lwp == 1:
+				lwp += 1
 			else:
-				if ltype.is_lwp == 1:
-					lwp += 1
-				else:
-					plw += 1
+				plw += 1
 	lwp = flt(lwp)
 	plw = flt(plw)
 	return lwp,plw
@@ -402,12 +386,8 @@ def get_holidays(doc, start_date, end_date,emp):
 	if relieving_date < end_date:
 		end_date = relieving_date
 	
-	holiday_list = get_holiday_list_for_employee(doc.employee)
-	holidays = frappe.db.sql("""SELECT count(name) FROM `tabHoliday` WHERE parent = '%s' AND 
-		holiday_date >= '%s' AND holiday_date <= '%s'""" %(holiday_list, \
-			start_date, end_date), as_list=1)
-	
-	holidays = flt(holidays[0][0]) #no of holidays in a month from the holiday list
+	#no of holidays in a month from the holiday list
+	holidays = flt(get_calendar().count_holidays(doc.employee, start_date, end_date))
 	return holidays
 
 def get_total_days(doc, emp, msd, med):
@@ -428,57 +408,39 @@ def get_total_days(doc, emp, msd, med):
 
 def get_expense_claim(doc, med):
 	#Get total Expense Claims Due for an Employee
-	query = """SELECT ec.name, ec.employee, ec.total_sanctioned_amount, ec.total_amount_reimbursed
-		FROM `tabExpense Claim` ec
-		WHERE ec.docstatus = 1 AND ec.approval_status = 'Approved' AND
-			ec.total_amount_reimbursed < ec.total_sanctioned_amount AND
-			ec.posting_date <= '%s' AND ec.pay_with_salary = 1 AND
-			ec.employee = '%s'""" %(med, doc.employee)
-	
-	
-	ec_list = frappe.db.sql(query, as_list=1)
+	ec_list = get_payroll_cache().get_expense_claims(doc.employee, med)
 	for i in ec_list:
 		existing_ec = []
 		for e in doc.earnings:
 			existing_ec.append(e.expense_claim)
 		
-		if i[0] not in existing_ec:
+		if i.name not in existing_ec:
 			#Add earning claim for each EC separately:
+			balance = i.total_sanctioned_amount - i.total_amount_reimbursed
 			doc.append("earnings", {
-				"idx": len(doc.earnings)+1, "depends_on_lwp": 0, "default_amount": (i[2]-i[3]), \
-				"expense_claim": i[0], "salary_component": "Expense Claim", "amount": (i[2]- i[3])
+				"idx": len(doc.earnings)+1, "depends_on_lwp": 0, "default_amount": balance, \
+				"expense_claim": i.name, "salary_component": "Expense Claim", "amount": balance
 			})
 
 def get_loan_deduction(doc, msd, med):
 	existing_loan = []
 	for d in doc.deductions:
 		existing_loan.append(d.employee_loan)
-	#get total loan due for employee
-	query = """SELECT el.name, eld.name, eld.emi, el.deduction_type, eld.loan_amount
-		FROM 
-			`tabEmployee Advance` el, `tabEmployee Loan Detail` eld
-		WHERE
-			eld.parent = el.name AND
-			el.docstatus = 1 AND el.posting_date <= '%s' AND
-			eld.employee = '%s'""" %(med, doc.employee)
-		
-	loan_list = frappe.db.sql(query, as_list=1)
-	for i in loan_list:
+	#get total loan due for employee, Loans and Deducted Amounts come from the Payroll Cache
+	cache = get_payroll_cache()
+	loan_list = cache.get_loans(doc.employee, med)
+	for loan in loan_list:
+		i = [loan.name, loan.detail, loan.emi, loan.deduction_type, loan.loan_amount]
 		emi = i[2]
 		total_loan = i[4]
 		if i[0] not in existing_loan:
 			#Check if the loan has already been deducted
-			query = """SELECT SUM(ssd.amount) 
-				FROM `tabSalary Detail` ssd, `tabSalary Slip` ss
-				WHERE ss.docstatus = 1 AND
-					ssd.parent = ss.name AND
-					ssd.employee_loan = '%s' and ss.employee = '%s'""" %(i[0], doc.employee)
-			deducted_amount = frappe.db.sql(query, as_list=1)
+			deducted_amount = cache.get_loan_deducted(i[0], doc.employee)
 
-			if flt(total_loan) > flt(deducted_amount[0][0]):
+			if flt(total_loan) > flt(deducted_amount):
 				#Add deduction for each loan separately
 				#Check if EMI is less than balance
-				balance = flt(total_loan) - flt(deducted_amount[0][0])
+				balance = flt(total_loan) - flt(deducted_amount)
 				if balance > emi:
 					doc.append("deductions", {
 						"idx": len(doc.deductions)+1, "depends_on_lwp": 0, "default_amount": balance, \
@@ -491,16 +453,12 @@ def get_loan_deduction(doc, msd, med):
 					})
 	for d in doc.deductions:
 		if d.employee_loan:
-			total_given = frappe.db.sql("""SELECT eld.loan_amount 
-				FROM `tabEmployee Advance` el, `tabEmployee Loan Detail` eld
-				WHERE eld.parent = el.name AND eld.employee = '%s' 
-				AND el.name = '%s'"""%(doc.employee, d.employee_loan), as_list=1)
-			
-			deducted = frappe.db.sql("""SELECT SUM(ssd.amount) 
-				FROM `tabSalary Detail` ssd, `tabSalary Slip` ss
-				WHERE ss.docstatus = 1 AND ssd.parent = ss.name 
-				AND ssd.employee_loan = '%s' and ss.employee = '%s'"""%(d.employee_loan, doc.employee), as_list=1)
-			balance = flt(total_given[0][0]) - flt(deducted[0][0])
+			total_given = [loan.loan_amount for loan in cache.get_loans(doc.employee) \
+				if loan.name == d.employee_loan]
+			if not total_given:
+				frappe.throw("Loan {} in Row# {} is not given to {}".format(d.employee_loan, d.idx, doc.employee))
+			deducted = cache.get_loan_deducted(d.employee_loan, doc.employee)
+			balance = flt(total_given[0]) - flt(deducted)
 			if balance < d.amount:
 				frappe.throw(("Max deduction allowed {0} for Loan Deduction {1} \
 				check row # {2} in Deduction Table").format(balance, d.employee_loan, d.idx))
@@ -520,27 +478,24 @@ def get_edc(doc):
 	#2. If a user adds a type of earning
 	#3. If a user deletes and adds a type of another earning
 	#Function to get the Earnings, Deductions and Contributions (E,D,C)
-	doj = frappe.get_value("Employee", doc.employee, "date_of_joining")
+	doj = get_payroll_cache().get_employee(doc.employee).date_of_joining
 	if doj > datetime.datetime.strptime(doc.start_date, '%Y-%m-%d').date():
 		date_for_sstra = doj
 	else:
 		date_for_sstra = doc.start_date
 
-	appl_sstr = frappe.db.sql("""SELECT sstra.salary_structure FROM `tabSalary Structure Assignment` sstra
-		WHERE sstra.employee = '%s' 
-		AND sstra.from_date <= '%s'
-		ORDER BY sstra.from_date DESC LIMIT 1"""%(doc.employee, date_for_sstra), as_list=1)
+	appl_sstr = get_payroll_cache().get_salary_structure_for(doc.employee, date_for_sstra)
 	if appl_sstr:
-		doc.salary_structure = appl_sstr[0][0]
+		doc.salary_structure = appl_sstr
 	else:
 		frappe.throw("No Salary Structure Found for Employee {}".format(doc.employee))
-	sstr = frappe.get_doc("Salary Structure", doc.salary_structure)
+	sstr = get_payroll_cache().get_salary_structure(doc.salary_structure)
 	existing_ded = []
 	manual_earn = []
 	
 	earn_dict = {}
 	for comp in doc.earnings:
-		earn_doc = frappe.get_doc("Salary Component", comp.salary_component)
+		earn_doc = get_payroll_cache().get_component(comp.salary_component)
 		if earn_doc.manual == 1:
 			earn_dict['salary_component'] = comp.salary_component
 			earn_dict['idx'] = comp.idx
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Rohit Industries Group Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+'''
+Contact Key Index for Lead, Customer, Contact and Address so that Duplicates can be found
+with exact Index Probes instead of LIKE over Global Search.
+1. Phones are kept as + and Digits only (E.164 Style). 10 Digit Numbers without Country Code
+   are taken as Indian Numbers. Emails are kept in Lower Case and GSTIN in Upper Case.
+2. Keys are updated on Save and deleted on Trash by doc_events, only changed Keys are written.
+3. rebuild_contact_keys rebuilds the Index for a DocType or all DocTypes with Bulk Inserts.
+bench --site site_name execute rigpl_erpnext.utils.contact_keys.rebuild_contact_keys
+'''
+from __future__ import unicode_literals
+import frappe
+import re
+from frappe.utils import cstr, now_datetime
+
+INDEX_DOCTYPE = "Contact Key Index"
+# Fields of each DocType per Key Type, Child Tables are given as table_field.field
+KEY_FIELDS = {
+    "Lead": {"Phone": ["phone", "mobile_no"], "Email": ["email_id"], "GSTIN": []},
+    "Customer": {"Phone": ["mobile_no"], "Email": ["email_id"], "GSTIN": ["gstin"]},
+    "Contact": {"Phone": ["phone", "mobile_no", "phone_nos.phone"], "Email": ["email_id", "email_ids.email_id"],
+                "GSTIN": []},
+    "Address": {"Phone": ["phone", "fax"], "Email": ["email_id"], "GSTIN": ["gstin"]}
+}
+CHILD_TABLES = {"phone_nos": "Contact Phone", "email_ids": "Contact Email"}
+SPLIT_VALUES = re.compile(r"[,;/\n]")
+MIN_PHONE_DIGITS = 6
+CHUNK_SIZE = 1000
+
+
+def normalise_phone(value, country=None):
+    value = cstr(value).strip()
+    international = value.startswith("+") or value.startswith("00")
+    digits = re.sub(r"[^0-9]", "", value)
+    if value.startswith("00"):
+        digits = digits[2:]
+    if not international:
+        digits = digits.lstrip("0")
+        if len(digits) == 10 and country in (None, "", "India", "IN", "in"):
+            digits = "91" + digits
+    if len(digits) < MIN_PHONE_DIGITS:
+        return None
+    return "+" + digits
+
+
+def normalise_email(value):
+    value = cstr(value).strip().lower()
+    return value if "@" in value else None
+
+
+def normalise_gstin(value):
+    value = re.sub(r"[^0-9A-Z]", "", cstr(value).upper())
+    return value if len(value) == 15 else None
+
+
+def normalise_key(key_type, value, country=None):
+    if key_type == "Phone":
+        return normalise_phone(value, country)
+    elif key_type == "Email":
+        return normalise_email(value)
+    return normalise_gstin(value)
+
+
+def get_keys_from_values(key_type, values, country=None):
+    keys = set()
+    for value in values:
+        for part in SPLIT_VALUES.split(cstr(value)):
+            key = normalise_key(key_type, part, country)
+            if key:
+                keys.add((key_type, key[:140]))
+    return keys
+
+
+def get_contact_keys(doc):
+    # Returns a Set of (Key Type, Key Value) for the Document
+    keys = set()
+    country = doc.get("country")
+    for key_type, fields in KEY_FIELDS.get(doc.doctype, {}).items():
+        values = []
+        for field in fields:
+            if "." in field:
+                table, child_field = field.split(".")
+                values.extend([row.get(child_field) for row in (doc.get(table) or [])])
+            else:
+                values.append(doc.get(field))
+        keys |= get_keys_from_values(key_type, values, country)
+    return keys
+
+
+def update_contact_keys(doc, method=None):
+    if doc.doctype not in KEY_FIELDS:
+        return
+    keys = get_contact_keys(doc)
+    existing = frappe.db.sql("""SELECT name, key_type, key_value FROM `tabContact Key Index`
+        WHERE link_doctype = %s AND link_name = %s""", (doc.doctype, doc.name), as_dict=1)
+    stale = []
+    for row in existing:
+        if (row.key_type, row.key_value) in keys:
+            keys.discard((row.key_type, row.key_value))
+        else:
+            stale.append(row.name)
+    if stale:
+        frappe.db.sql("""DELETE FROM `tabContact Key Index` WHERE name IN (%s)"""
+                      % (", ".join(["%s"] * len(stale))), tuple(stale))
+    bulk_insert_keys([[key_type, key_value, doc.doctype, doc.name] for key_type, key_value in keys])
+
+
+def delete_contact_keys(doc, method=None):
+    frappe.db.sql("""DELETE FROM `tabContact Key Index` WHERE link_doctype = %s AND link_name = %s""",
+                  (doc.doctype, doc.name))
+
+
+def bulk_insert_keys(key_list):
+    # key_list is a list of [Key Type, Key Value, Link DocType, Link Name]
+    now = now_datetime()
+    for i in range(0, len(key_list), CHUNK_SIZE):
+        chunk = key_list[i:i + CHUNK_SIZE]
+        values = []
+        for key in chunk:
+            values.extend([frappe.generate_hash(INDEX_DOCTYPE, 10), now, now, frappe.session.user,
+                           frappe.session.user] + key)
+        placeholders = ", ".join(["(" + ", ".join(["%s"] * 9) + ")"] * len(chunk))
+        frappe.db.sql("""INSERT INTO `tabContact Key Index` (name, creation, modified, owner, modified_by,
+            key_type, key_value, link_doctype, link_name) VALUES %s""" % placeholders, tuple(values))
+
+
+def find_by_key(key_type, value, link_doctype="Lead", country=None):
+    # Returns list of Names of Link DocType with the same Normalised Key
+    key = normalise_key(key_type, value, country)
+    if not key:
+        return []
+    names = frappe.db.sql("""SELECT DISTINCT link_name FROM `tabContact Key Index`
+        WHERE key_type = %s AND key_value = %s AND link_doctype = %s""", (key_type, key[:140], link_doctype),
+                          as_list=1)
+    return [name[0] for name in names]
+
+
+def rebuild_contact_keys(doctype=None):
+    for dt in ([doctype] if doctype else sorted(KEY_FIELDS.keys())):
+        key_list = []
+        for name, keys in get_all_keys(dt).items():
+            key_list.extend([[key_type, key_value, dt, name] for key_type, key_value in keys])
+        frappe.db.sql("""DELETE FROM `tabContact Key Index` WHERE link_doctype = %s""", dt)
+        bulk_insert_keys(key_list)
+        frappe.db.commit()
+        print("Indexed {} Contact Keys for {}".format(len(key_list), dt))
+
+
+def get_all_keys(doctype):
+    # Reads the Fields of all Documents of a DocType with one Query per Table
+    all_keys = {}
+    fields = KEY_FIELDS[doctype]
+    columns = set([field for field_list in fields.values() for field in field_list if "." not in field])
+    if frappe.db.has_column(doctype, "country"):
+        columns.add("country")
+    columns = sorted([col for col in columns if frappe.db.has_column(doctype, col)])
+    docs = frappe.db.sql("""SELECT name%s FROM `tab%s`""" % ("".join([", `%s`" % col for col in columns]),
+                                                           doctype), as_dict=1)
+    for doc in docs:
+        keys = set()
+        for key_type, field_list in fields.items():
+            keys |= get_keys_from_values(key_type, [doc.get(field) for field in field_list if "." not in field],
+                                         doc.get("country"))
+        all_keys[doc.name] = keys
+
+    for key_type, field_list in fields.items():
+        for field in [field for field in field_list if "." in field]:
+            table, child_field = field.split(".")
+            for row in frappe.db.sql("""SELECT parent, `%s` FROM `tab%s` WHERE parenttype = '%s'"""
+                                     % (child_field, CHILD_TABLES[table], doctype), as_list=1):
+                if row[0] in all_keys:
+                    all_keys[row[0]] |= get_keys_from_values(key_type, [row[1]])
+    return all_keys
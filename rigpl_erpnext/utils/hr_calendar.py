@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Rohit Industries Group Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+'''
+Leave and Holiday Calendar shared by Salary Slips and Attendance in one Request or Job.
+1. Approved Leaves of all Employees for a Period are loaded with one Range Query and kept
+   per Employee and Day along with the Leave Without Pay flag of the Leave Type.
+2. Holiday Lists are loaded once as Sets of Dates and Holiday List of all Employees with
+   one Query, Employees without a Holiday List get the Default of their Company.
+3. Calendar lives in frappe.local so a Payroll Entry or Attendance Upload shares it, it is
+   cleared whenever a Leave Application or Holiday List is changed.
+'''
+from __future__ import unicode_literals
+import frappe
+import datetime
+from frappe.utils import getdate
+
+
+class HRCalendar(object):
+    def __init__(self):
+        self.employee_lists = None
+        self.holiday_sets = {}
+        self.leave_periods = {}
+
+    def get_holiday_list(self, employee):
+        if self.employee_lists is None:
+            self.load_employee_lists()
+        holiday_list = self.employee_lists.get(employee)
+        if not holiday_list:
+            frappe.throw("Please set a default Holiday List for Employee {0} or its Company".format(employee))
+        return holiday_list
+
+    def load_employee_lists(self):
+        company_lists = dict(frappe.db.sql("""SELECT name, default_holiday_list FROM `tabCompany`"""))
+        self.employee_lists = {}
+        for emp in frappe.db.sql("""SELECT name, holiday_list, company FROM `tabEmployee`""", as_dict=1):
+            self.employee_lists[emp.name] = emp.holiday_list or company_lists.get(emp.company)
+
+    def get_holidays(self, holiday_list):
+        if holiday_list not in self.holiday_sets:
+            self.holiday_sets[holiday_list] = set([getdate(hol[0]) for hol in frappe.db.sql(
+                """SELECT holiday_date FROM `tabHoliday` WHERE parent = %s AND parenttype = 'Holiday List'""",
+                holiday_list)])
+        return self.holiday_sets[holiday_list]
+
+    def is_holiday(self, employee, date):
+        return getdate(date) in self.get_holidays(self.get_holiday_list(employee))
+
+    def count_holidays(self, employee, start_date, end_date):
+        start_date, end_date = getdate(start_date), getdate(end_date)
+        if start_date > end_date:
+            return 0
+        holidays = self.get_holidays(self.get_holiday_list(employee))
+        if (end_date - start_date).days + 1 < len(holidays):
+            return len([day for day in date_range(start_date, end_date) if day in holidays])
+        return len([day for day in holidays if start_date <= day <= end_date])
+
+    def get_leaves(self, employee, start_date, end_date):
+        # Returns {Date: Is LWP} of Approved Leaves of Employee between the Dates, loads all Employees
+        key = (getdate(start_date), getdate(end_date))
+        if key not in self.leave_periods:
+            self.leave_periods[key] = load_leaves(*key)
+        return self.leave_periods[key].get(employee, {})
+
+
+def load_leaves(start_date, end_date):
+    leaves = {}
+    leave_list = frappe.db.sql("""SELECT la.employee, la.from_date, la.to_date, lt.is_lwp
+        FROM `tabLeave Application` la, `tabLeave Type` lt
+        WHERE la.leave_type = lt.name AND la.status = 'Approved' AND la.docstatus = 1
+        AND la.from_date <= %s AND la.to_date >= %s ORDER BY la.from_date, la.name""",
+                               (end_date, start_date), as_dict=1)
+    for leave in leave_list:
+        emp_leaves = leaves.setdefault(leave.employee, {})
+        for day in date_range(max(getdate(leave.from_date), start_date), min(getdate(leave.to_date), end_date)):
+            emp_leaves.setdefault(day, leave.is_lwp)
+    return leaves
+
+
+def date_range(start_date, end_date):
+    for i in range((end_date - start_date).days + 1):
+        yield start_date + datetime.timedelta(days=i)
+
+
+def get_calendar():
+    if not getattr(frappe.local, "hr_calendar", None):
+        frappe.local.hr_calendar = HRCalendar()
+    return frappe.local.hr_calendar
+
+
+def clear_calendar_cache(doc=None, method=None):
+    frappe.local.hr_calendar = None
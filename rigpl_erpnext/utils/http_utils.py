@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Rohit Industries Group Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+'''
+Helpers for calling outside APIs from the Scheduled Jobs.
+1. TokenBucket limits the number of requests per second sent to an API.
+2. fetch_concurrently runs the API calls in a pool of threads. The functions given to it
+   should only make the request and not use frappe.db since DB connection is not thread safe.
+3. http_request sends all calls for a Host over one pooled Session so connections are kept
+   alive, always has a timeout and retries with exponential backoff on errors, 429 and 5xx.
+   Time taken per Host is kept in METRICS and can be seen with print_http_metrics.
+'''
+from __future__ import unicode_literals
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from six.moves.urllib.parse import urlparse
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# No single wait between retries is longer than this so a Thread is never blocked for long
+MAX_RETRY_WAIT = 60
+SESSIONS = {}
+METRICS = {}
+# Set by integration_stub on Test Sites so that calls are Recorded or Replayed
+STUB = None
+LOCK = threading.Lock()
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+        self.tokens = self.capacity
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Blocks till a token is available
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def fetch_concurrently(jobs, max_workers=8):
+    '''
+    jobs: list of dicts with keys name, function, args and limiter (TokenBucket or None)
+    Returns dict of {name: {"result": result, "error": exception or None, "time": seconds}}
+    '''
+    results = {}
+
+    def run_job(job):
+        if job.get("limiter"):
+            job["limiter"].acquire()
+        started = time.time()
+        try:
+            result = job["function"](*job.get("args", []))
+            error = None
+        except Exception as e:
+            result = None
+            error = e
+        return job["name"], {"result": result, "error": error, "time": time.time() - started}
+
+    if not jobs:
+        return results
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for name, res in executor.map(run_job, jobs):
+            results[name] = res
+    return results
+
+
+def get_session(url):
+    # One Session per Host so that Connections and TLS are reused between calls
+    host = urlparse(url).netloc
+    with LOCK:
+        if host not in SESSIONS:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=32)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            SESSIONS[host] = session
+        return SESSIONS[host]
+
+
+def http_request(method, url, timeout=None, retries=None, backoff=None, **kwargs):
+    '''
+    Sends the request on the pooled Session for the Host and returns the response.
+    Timeouts, Connection Errors, 429 and 5xx are retried after backoff x 2^(try - 1) seconds,
+    or Retry-After if sent by the Server. Last response is returned or last error raised.
+    Wait is never more than the last backoff (or MAX_RETRY_WAIT), if the Server asks for a
+    longer Retry-After the response is returned without retrying.
+    '''
+    if timeout is None or retries is None or backoff is None:
+        sett_timeout, sett_retries, sett_backoff = get_http_settings()
+        timeout = sett_timeout if timeout is None else timeout
+        retries = sett_retries if retries is None else retries
+        backoff = sett_backoff if backoff is None else backoff
+    session = get_session(url)
+    host = urlparse(url).netloc
+    max_wait = min(backoff * (2 ** max(retries - 1, 0)), MAX_RETRY_WAIT)
+    attempt = 0
+    while True:
+        started = time.time()
+        response, error = None, None
+        try:
+            if STUB is not None:
+                response = STUB.request(session, method, url, timeout=timeout, **kwargs)
+            else:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+        retry = error is not None or response.status_code in RETRY_STATUS
+        update_metrics(host, time.time() - started, error=(1 if retry else 0), retried=(1 if attempt else 0))
+        if not retry or attempt >= retries:
+            if error is not None:
+                raise error
+            return response
+        wait = min(backoff * (2 ** attempt), max_wait)
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            wait = int(response.headers.get("Retry-After"))
+            if wait > max_wait:
+                print("Not Retrying {} since Retry-After of {} Seconds is more than {} Seconds".format(
+                    host, wait, max_wait))
+                return response
+        attempt += 1
+        print("Retry {} for {} after {} Seconds due to {}".format(
+            attempt, host, wait, error if error is not None else response.status_code))
+        time.sleep(wait)
+
+
+def http_get(url, **kwargs):
+    return http_request("GET", url, **kwargs)
+
+
+def http_post(url, **kwargs):
+    return http_request("POST", url, **kwargs)
+
+
+def get_http_settings():
+    # Read in the Main Thread and pass the values when calling from a Thread
+    import frappe
+    from frappe.utils import cint, flt
+    timeout, retries, backoff = frappe.db.get_value("RIGPL Settings", "RIGPL Settings",
+                                                    ["tracking_request_timeout", "http_max_retries",
+                                                     "http_backoff_factor"])
+    return cint(timeout) or DEFAULT_TIMEOUT, cint(retries) if retries is not None else DEFAULT_RETRIES, \
+        flt(backoff) if backoff is not None else DEFAULT_BACKOFF
+
+
+def update_metrics(host, time_taken, error=0, retried=0):
+    with LOCK:
+        met = METRICS.setdefault(host, {"calls": 0, "errors": 0, "retries": 0, "total_time": 0.0,
+                                        "max_time": 0.0})
+        met["calls"] += 1
+        met["errors"] += error
+        met["retries"] += retried
+        met["total_time"] += time_taken
+        met["max_time"] = max(met["max_time"], time_taken)
+
+
+def print_http_metrics(reset=1):
+    # METRICS are not reset while the Stub is active since run_benchmark reads them after the Job
+    print("{:<30} {:>8} {:>8} {:>8} {:>10} {:>10}".format("Host", "Calls", "Errors", "Retries", "Avg (s)",
+                                                          "Max (s)"))
+    with LOCK:
+        for host, met in METRICS.items():
+            print("{:<30} {:>8} {:>8} {:>8} {:>10} {:>10}".format(
+                host, met["calls"], met["errors"], met["retries"],
+                round(met["total_time"] / met["calls"], 3), round(met["max_time"], 3)))
+        if reset == 1 and STUB is None:
+            METRICS.clear()
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Rohit Industries Group Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+'''
+Record and Replay Stub for Shipway, IndiaMart (both over http_utils) and Fedex (SOAP over suds).
+Only runs on sites with allow_tests set in site_config.json, never run it on the Production Site.
+1. record runs the Jobs against the Live APIs and saves every Reply as a Fixture in
+   sites/<site>/private/integration_fixtures. Logins in the Request are not part of the Fixture Key.
+2. replay serves the Fixtures without any Network Call. A Request not recorded gets the last
+   captured Fixture of the same Endpoint. Latency, Error Rate (5xx) and Timeout Rate can be injected.
+3. run_benchmark replays the Hourly and Daily Integration Jobs and records Queries, Wall Time,
+   Memory and Calls, Errors and Retries per Host so that changes can be compared.
+bench --site test_site execute rigpl_erpnext.utils.integration_stub.record --kwargs "{'jobs': ['hourly']}"
+bench --site test_site execute rigpl_erpnext.utils.integration_stub.run_benchmark --kwargs "{'latency': 0.3}"
+'''
+from __future__ import unicode_literals
+import frappe
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from rigpl_erpnext.utils import http_utils
+from rigpl_erpnext.utils.perm_benchmark import check_allowed, measure
+
+FIXTURE_FOLDER = "integration_fixtures"
+# Logins are masked in the Fixture Key so Fixtures work with any Credentials
+MASK_JSON = ["username", "password", "GLUSR_MOBILE_KEY"]
+MASK_URL = re.compile(r"(GLUSR_MOBILE_KEY|GLUSR_MOBILE)/[^/]*")
+MASK_XML = re.compile(r"<([\w:]*)(Key|Password|AccountNumber|MeterNumber)>[^<]*</")
+
+
+class IntegrationStub(object):
+    def __init__(self, mode="replay", latency=0.0, error_rate=0.0, timeout_rate=0.0, seed=1):
+        self.mode = mode
+        self.latency = float(latency)
+        self.error_rate = float(error_rate)
+        self.timeout_rate = float(timeout_rate)
+        self.random = random.Random(seed)
+        self.folder = frappe.get_site_path("private", FIXTURE_FOLDER)
+        self.lock = threading.Lock()
+        self.endpoint_index = {}
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        # Fixtures are indexed in order of Capture so the last captured one is kept per Endpoint
+        fixtures = []
+        for file_name in os.listdir(self.folder):
+            path = os.path.join(self.folder, file_name)
+            with open(path) as f:
+                fixture = json.loads(f.read())
+            fixtures.append([fixture.get("captured_at") or os.path.getmtime(path), file_name, fixture])
+        for fixture in sorted(fixtures, key=lambda fix: (fix[0], fix[1])):
+            self.endpoint_index[fixture[2]["endpoint"]] = fixture[2]
+
+    def request(self, session, method, url, **kwargs):
+        endpoint = get_endpoint(url)
+        key = get_fixture_key(method, url, kwargs.get("data"))
+        if self.mode == "record":
+            response = session.request(method, url, **kwargs)
+            self.save_fixture(key, {"endpoint": endpoint, "status_code": response.status_code,
+                                    "headers": dict(response.headers), "text": response.text})
+            return response
+        fixture = self.get_fixture(key, endpoint)
+        try:
+            self.inject_faults()
+        except StubError:
+            return make_response({"status_code": 503, "text": ""})
+        return make_response(fixture)
+
+    def suds_transport(self):
+        return make_suds_transport(self)
+
+    def inject_faults(self):
+        with self.lock:
+            roll = self.random.random()
+        if self.latency:
+            time.sleep(self.latency)
+        if roll < self.timeout_rate:
+            import requests
+            raise requests.exceptions.Timeout("Injected Timeout by Integration Stub")
+        if roll < self.timeout_rate + self.error_rate:
+            raise StubError()
+
+    def get_fixture(self, key, endpoint):
+        path = os.path.join(self.folder, key + ".json")
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.loads(f.read())
+        if endpoint in self.endpoint_index:
+            return self.endpoint_index[endpoint]
+        raise Exception("No Fixture Recorded for {}, run record on a Site with Live Access".format(endpoint))
+
+    def save_fixture(self, key, fixture):
+        fixture["captured_at"] = time.time()
+        with self.lock:
+            self.endpoint_index[fixture["endpoint"]] = fixture
+            with open(os.path.join(self.folder, key + ".json"), "w") as f:
+                f.write(json.dumps(fixture, indent=1, sort_keys=True))
+
+
+class StubError(Exception):
+    # Injected 503, converted to a Response for http_utils and a TransportError for suds
+    pass
+
+
+def make_response(fixture):
+    import requests
+    from requests.structures import CaseInsensitiveDict
+    response = requests.Response()
+    response.status_code = fixture.get("status_code", 200)
+    response.headers = CaseInsensitiveDict(fixture.get("headers") or {})
+    response._content = (fixture.get("text") or "").encode("utf-8")
+    response.encoding = "utf-8"
+    return response
+
+
+def make_suds_transport(stub):
+    from suds.transport import Reply, TransportError
+    from suds.transport.https import HttpAuthenticated
+
+    class StubTransport(HttpAuthenticated):
+        def send(self, request):
+            message = request.message.decode("utf-8") if isinstance(request.message, bytes) else request.message
+            endpoint = get_endpoint(request.url) + "#" + get_soap_action(request.headers)
+            key = get_fixture_key("POST", endpoint, message)
+            if stub.mode == "record":
+                reply = HttpAuthenticated.send(self, request)
+                stub.save_fixture(key, {"endpoint": endpoint, "status_code": reply.code,
+                                        "headers": dict(reply.headers or {}),
+                                        "text": reply.message.decode("utf-8")})
+                return reply
+            fixture = stub.get_fixture(key, endpoint)
+            try:
+                stub.inject_faults()
+            except StubError:
+                raise TransportError("Injected Error by Integration Stub", 503)
+            return Reply(fixture.get("status_code", 200), fixture.get("headers") or {},
+                         fixture.get("text").encode("utf-8"))
+
+    return StubTransport()
+
+
+def get_soap_action(headers):
+    return str((headers or {}).get("SOAPAction", "")).strip('"')
+
+
+def get_endpoint(url):
+    # URL without Query, Logins or Values in the Path for IndiaMart
+    return MASK_URL.sub(r"\1/", url.split("?")[0]).split("/Start_Time/")[0]
+
+
+def get_fixture_key(method, url, data=None):
+    url = MASK_URL.sub(r"\1/", url)
+    body = data or ""
+    if body:
+        try:
+            body_dict = json.loads(body)
+            for field in MASK_JSON:
+                body_dict.pop(field, None)
+            body = json.dumps(body_dict, sort_keys=True)
+        except (TypeError, ValueError):
+            body = MASK_XML.sub(r"<\1\2></", str(body))
+    return hashlib.md5((method + " " + url + " " + body).encode("utf-8")).hexdigest()
+
+
+def activate(mode="replay", latency=0.0, error_rate=0.0, timeout_rate=0.0, seed=1):
+    check_allowed()
+    http_utils.STUB = IntegrationStub(mode=mode, latency=latency, error_rate=error_rate,
+                                      timeout_rate=timeout_rate, seed=seed)
+    print("Integration Stub in {} mode with {} Fixtures".format(mode, len(http_utils.STUB.endpoint_index)))
+    return http_utils.STUB
+
+
+def deactivate():
+    http_utils.STUB = None
+
+
+def get_jobs():
+    from rigpl_erpnext.rigpl_erpnext.scheduled_tasks import indiamart, shipment_data_update
+    return {
+        "hourly": [
+            ["shipment_data_update.send_bulk_tracks", shipment_data_update.send_bulk_tracks],
+            ["shipment_data_update.get_all_ship_data", shipment_data_update.get_all_ship_data]
+        ],
+        "daily": [
+            ["indiamart.execute", indiamart.execute]
+        ]
+    }
+
+
+def run_job(function):
+    # Jobs written to exit when there is nothing to do are a normal end of the Job here
+    try:
+        function()
+    except SystemExit:
+        pass
+
+
+def make_trackings_due():
+    # Open Shipments are made due so that the Hourly Job has the same work on every run
+    frappe.db.sql("""UPDATE `tabCarrier Tracking` SET next_poll_at = NOW()
+        WHERE docstatus != 2 AND status != 'Delivered' AND manual_exception_removed = 0
+        AND IFNULL(awb_number, '') NOT IN ('', 'NA')""")
+    frappe.db.commit()
+
+
+def record(jobs=None):
+    '''
+    Runs the Jobs against the Live APIs and saves the Replies, run it again to get more Fixtures.
+    '''
+    activate(mode="record")
+    try:
+        for job_type in (jobs or ["hourly", "daily"]):
+            for name, function in get_jobs()[job_type]:
+                print("Recording " + name)
+                run_job(function)
+                frappe.db.commit()
+    finally:
+        deactivate()
+
+
+def run_benchmark(jobs=None, latency=0.0, error_rate=0.0, timeout_rate=0.0, seed=1, make_due=1):
+    activate(mode="replay", latency=latency, error_rate=error_rate, timeout_rate=timeout_rate, seed=seed)
+    frappe.flags.mute_emails = True
+    results = {}
+    try:
+        for job_type in (jobs or ["hourly", "daily"]):
+            for name, function in get_jobs()[job_type]:
+                if make_due == 1:
+                    make_trackings_due()
+                with http_utils.LOCK:
+                    http_utils.METRICS.clear()
+                results[name] = measure(lambda: run_job(function))
+                results[name]["hosts"] = dict(http_utils.METRICS)
+                frappe.db.commit()
+    finally:
+        deactivate()
+        with http_utils.LOCK:
+            http_utils.METRICS.clear()
+
+    print("{:<40} {:>10} {:>12} {:>12} {:>8} {:>8}".format("Job", "Queries", "Time (s)", "Memory (MB)",
+                                                            "Calls", "Errors"))
+    for name, res in results.items():
+        calls = sum([met["calls"] for met in res["hosts"].values()])
+        errors = sum([met["errors"] for met in res["hosts"].values()])
+        print("{:<40} {:>10} {:>12} {:>12} {:>8} {:>8}".format(name, res["queries"], res["wall_time"],
+                                                                res["peak_memory"], calls, errors))
+    return results
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Rohit Industries Group Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+'''
+Payroll Cache and Batch Run for Salary Slips.
+1. Salary Slip Hooks read Employees, Structure Assignments, Salary Structures, Components,
+   Attendance, Expense Claims, Loans and Posted Expense Claims from the Payroll Cache.
+   Cache lives in frappe.local and loads the inputs of all Employees of a Payroll Entry with
+   one Query each for the first Slip of the Payroll Entry, other Slips load one Employee.
+2. Inputs of an Employee are reloaded after a Salary Slip of the Employee is Submitted or
+   Cancelled since Loans and Expense Claims are changed by the Slip. Cache is cleared when a
+   Salary Component or Salary Structure is changed.
+3. run_payroll makes (and optionally Submits) the Slips of a Payroll Entry in Chunks with
+   a Commit after every Chunk and prints the Time taken by each Phase.
+4. Slips Submitted by run_payroll keep their GL Entries in the Cache, after every Chunk the
+   Debit and Credit of each Voucher and of the Chunk are checked and the GL Entries are
+   Inserted with one Query. Accounts of Components and Company are read once per Company.
+bench --site site_name execute rigpl_erpnext.utils.payroll_batch.run_payroll --kwargs "{'payroll_entry': 'HR-PRUN-2020-00008'}"
+'''
+from __future__ import unicode_literals
+import frappe
+import time
+from frappe.utils import cint, flt, getdate, now_datetime
+from erpnext.accounts.utils import get_fiscal_years
+from erpnext.accounts.general_ledger import process_gl_map, validate_accounting_period, check_freezing_date
+from rigpl_erpnext.utils.hr_calendar import get_calendar
+
+DEFAULT_CHUNK_SIZE = 50
+GL_INSERT_SIZE = 500
+COMPONENT_FIELDS = ["name", "manual", "round_up", "account", "liability_account", "books", "depends_on_lwp",
+                    "earning", "based_on_earning", "only_for_deductions"]
+COMPANY_GL_FIELDS = ["cost_center", "default_payroll_payable_account", "round_off_account", "round_off_cost_center"]
+GL_FIELDS = ["company", "posting_date", "fiscal_year", "voucher_type", "voucher_no", "account", "cost_center",
+             "debit", "credit", "debit_in_account_currency", "credit_in_account_currency", "account_currency",
+             "against", "party_type", "party", "remarks", "is_opening", "is_advance"]
+# Difference upto which a Voucher is balanced with a Round Off Entry like make_gl_entries
+ROUND_OFF_ALLOWANCE = 0.5
+
+
+class PayrollCache(object):
+    def __init__(self):
+        self.components = None
+        self.structures = {}
+        self.payroll_entries = set()
+        self.loaded = set()
+        self.employees = {}
+        self.assignments = {}
+        self.expense_claims = {}
+        self.loans = {}
+        self.loan_deducted = {}
+        self.ec_gl_entries = {}
+        self.attendance = {}
+        self.gl_accounts = {}
+        self.fiscal_years = {}
+        self.pending_gl = []
+
+    def load_for_slip(self, doc):
+        # First Slip of a Payroll Entry loads all its Employees else only the Slip's Employee
+        if doc.get("payroll_entry") and doc.payroll_entry not in self.payroll_entries:
+            self.payroll_entries.add(doc.payroll_entry)
+            employees = [emp[0] for emp in frappe.db.sql("""SELECT employee FROM `tabPayroll Employee Detail`
+                WHERE parent = %s AND parenttype = 'Payroll Entry'""", doc.payroll_entry)]
+            self.preload(employees + [doc.employee])
+        elif doc.employee not in self.loaded:
+            self.preload([doc.employee])
+
+    def preload(self, employees):
+        employees = list(set([emp for emp in employees if emp and emp not in self.loaded]))
+        if not employees:
+            return
+        self.loaded |= set(employees)
+        cond = "IN (%s)" % ", ".join(["%s"] * len(employees))
+        values = tuple(employees)
+
+        for emp in frappe.db.sql("""SELECT name, employee_name, department, date_of_joining, relieving_date
+            FROM `tabEmployee` WHERE name %s""" % cond, values, as_dict=1):
+            self.employees[emp.name] = emp
+
+        for emp in employees:
+            self.assignments[emp] = []
+            self.expense_claims[emp] = []
+            self.loans[emp] = []
+        for ssa in frappe.db.sql("""SELECT employee, salary_structure, from_date
+            FROM `tabSalary Structure Assignment` WHERE employee %s ORDER BY from_date DESC""" % cond,
+                                 values, as_dict=1):
+            self.assignments[ssa.employee].append(ssa)
+
+        ec_names = []
+        for ec in frappe.db.sql("""SELECT name, employee, total_sanctioned_amount, total_amount_reimbursed,
+            posting_date FROM `tabExpense Claim` WHERE docstatus = 1 AND approval_status = 'Approved'
+            AND total_amount_reimbursed < total_sanctioned_amount AND pay_with_salary = 1
+            AND employee %s""" % cond, values, as_dict=1):
+            self.expense_claims[ec.employee].append(ec)
+            ec_names.append(ec.name)
+        self.load_ec_gl_entries(ec_names)
+
+        for loan in frappe.db.sql("""SELECT el.name, eld.name AS detail, eld.emi, el.deduction_type,
+            eld.loan_amount, eld.employee, el.posting_date, el.docstatus
+            FROM `tabEmployee Advance` el, `tabEmployee Loan Detail` eld
+            WHERE eld.parent = el.name AND eld.employee %s""" % cond, values, as_dict=1):
+            self.loans[loan.employee].append(loan)
+        for ded in frappe.db.sql("""SELECT ssd.employee_loan, ss.employee, SUM(ssd.amount)
+            FROM `tabSalary Detail` ssd, `tabSalary Slip` ss
+            WHERE ss.docstatus = 1 AND ssd.parent = ss.name AND IFNULL(ssd.employee_loan, '') != ''
+            AND ss.employee %s GROUP BY ssd.employee_loan, ss.employee""" % cond, values):
+            self.loan_deducted[(ded[0], ded[1])] = flt(ded[2])
+
+    def forget(self, employee):
+        # Loans and Expense Claims of Employee change when a Slip is Submitted or Cancelled
+        self.loaded.discard(employee)
+        for ec in self.expense_claims.get(employee, []):
+            self.ec_gl_entries.pop(ec.name, None)
+        for key in [key for key in self.loan_deducted if key[1] == employee]:
+            del self.loan_deducted[key]
+        for period in self.attendance.values():
+            period.pop(employee, None)
+
+    def get_employee(self, employee):
+        if employee not in self.loaded:
+            self.preload([employee])
+        if employee not in self.employees:
+            frappe.throw("Employee {} not found".format(employee))
+        return self.employees[employee]
+
+    def get_salary_structure_for(self, employee, date):
+        if employee not in self.loaded:
+            self.preload([employee])
+        date = getdate(date)
+        for ssa in self.assignments.get(employee, []):
+            if getdate(ssa.from_date) <= date:
+                return ssa.salary_structure
+
+    def get_salary_structure(self, name):
+        if name not in self.structures:
+            self.structures[name] = frappe.get_doc("Salary Structure", name)
+        return self.structures[name]
+
+    def get_components(self):
+        if self.components is None:
+            self.components = {}
+            for comp in frappe.db.sql("""SELECT %s FROM `tabSalary Component`"""
+                                      % ", ".join(["`%s`" % field for field in COMPONENT_FIELDS]), as_dict=1):
+                self.components[comp.name] = comp
+        return self.components
+
+    def get_component(self, name):
+        components = self.get_components()
+        if name not in components:
+            frappe.throw("Salary Component {} not found".format(name))
+        return components[name]
+
+    def get_gl_accounts(self, company):
+        # Company Accounts and Cost Centers with the Components, read once per Company
+        if company not in self.gl_accounts:
+            comp_doc = frappe.get_cached_doc("Company", company)
+            accounts = frappe._dict({field: comp_doc.get(field) for field in COMPANY_GL_FIELDS})
+            accounts.components = self.get_components()
+            self.gl_accounts[company] = accounts
+        return self.gl_accounts[company]
+
+    def get_fiscal_year(self, doc):
+        key = (doc.company, getdate(doc.posting_date))
+        if key not in self.fiscal_years:
+            fiscal_years = get_fiscal_years(doc.posting_date, company=doc.company)
+            if len(fiscal_years) > 1:
+                frappe.throw("Multiple fiscal years exist for the date {0}. Please set company in Fiscal "
+                             "Year".format(doc.posting_date))
+            self.fiscal_years[key] = fiscal_years[0][0]
+        return self.fiscal_years[key]
+
+    def get_expense_claims(self, employee, end_date):
+        if employee not in self.loaded:
+            self.preload([employee])
+        return [ec for ec in self.expense_claims.get(employee, []) if getdate(ec.posting_date) <= getdate(end_date)]
+
+    def get_loans(self, employee, end_date=None):
+        # Submitted Loans up to End Date, all Loans if End Date is not given
+        if employee not in self.loaded:
+            self.preload([employee])
+        if end_date is None:
+            return self.loans.get(employee, [])
+        return [loan for loan in self.loans.get(employee, []) if loan.docstatus == 1 and
+                getdate(loan.posting_date) <= getdate(end_date)]
+
+    def get_loan_deducted(self, loan, employee):
+        if employee not in self.loaded:
+            self.preload([employee])
+        return self.loan_deducted.get((loan, employee), 0)
+
+    def load_ec_gl_entries(self, ec_names):
+        ec_names = [ec for ec in ec_names if ec not in self.ec_gl_entries]
+        if not ec_names:
+            return
+        for ec in ec_names:
+            self.ec_gl_entries[ec] = []
+        for gle in frappe.db.sql("""SELECT voucher_no, name, credit, account FROM `tabGL Entry`
+            WHERE voucher_type = 'Expense Claim' AND docstatus = 1 AND voucher_no IN (%s)"""
+                                 % ", ".join(["%s"] * len(ec_names)), tuple(ec_names), as_dict=1):
+            self.ec_gl_entries[gle.voucher_no].append(gle)
+
+    def get_ec_gl_entries(self, expense_claim):
+        self.load_ec_gl_entries([expense_claim])
+        return self.ec_gl_entries[expense_claim]
+
+    def get_attendance(self, employee, start_date, end_date):
+        # Returns Overtime, Present Days and Half Days of Employee, loaded for all Employees in Cache
+        key = (getdate(start_date), getdate(end_date))
+        period = self.attendance.setdefault(key, {})
+        if employee not in period:
+            employees = [emp for emp in self.loaded | set([employee]) if emp not in period]
+            for emp in employees:
+                period[emp] = (0, 0, 0)
+            for att in frappe.db.sql("""SELECT employee, SUM(IF(status = 'Present', overtime, 0)),
+                COUNT(IF(status = 'Present', 1, NULL)), COUNT(IF(status = 'Half Day', 1, NULL))
+                FROM `tabAttendance` WHERE docstatus = 1 AND attendance_date >= %s AND attendance_date <= %s
+                AND employee IN (%s) GROUP BY employee""" % ("%s", "%s", ", ".join(["%s"] * len(employees))),
+                                     tuple([key[0], key[1]] + employees)):
+                period[att[0]] = (flt(att[1]), flt(att[2]), flt(att[3]))
+        return period[employee]
+
+
+def get_payroll_cache(doc=None):
+    if not getattr(frappe.local, "payroll_cache", None):
+        frappe.local.payroll_cache = PayrollCache()
+    if doc:
+        frappe.local.payroll_cache.load_for_slip(doc)
+    return frappe.local.payroll_cache
+
+
+def clear_payroll_cache(doc=None, method=None):
+    frappe.local.payroll_cache = None
+
+
+def forget_employee(doc, method=None):
+    if getattr(frappe.local, "payroll_cache", None):
+        frappe.local.payroll_cache.forget(doc.employee)
+
+
+def run_payroll(payroll_entry, submit=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Makes the Salary Slips of the Payroll Entry which are not made yet and Submits the Draft
+    Slips if submit is 1. All Inputs are loaded before the first Slip.
+    '''
+    chunk_size = max(cint(chunk_size), 1)
+    timings = {}
+    started = time.time()
+    pe = frappe.get_doc("Payroll Entry", payroll_entry)
+    employees = [row.employee for row in pe.employees]
+    cache = get_payroll_cache()
+    cache.payroll_entries.add(pe.name)
+    cache.preload(employees)
+    cache.get_components()
+    calendar = get_calendar()
+    calendar.load_employee_lists()
+    calendar.get_leaves(None, pe.start_date, pe.end_date)
+    timings["preload"] = time.time() - started
+
+    phase = time.time()
+    existing = set([sal[0] for sal in frappe.db.sql("""SELECT employee FROM `tabSalary Slip`
+        WHERE docstatus != 2 AND start_date >= %s AND end_date <= %s AND company = %s""",
+                                                     (pe.start_date, pe.end_date, pe.company))])
+    to_make = [emp for emp in employees if emp not in existing]
+    for i in range(0, len(to_make), chunk_size):
+        for emp in to_make[i:i + chunk_size]:
+            frappe.get_doc({
+                "doctype": "Salary Slip", "employee": emp, "payroll_entry": pe.name,
+                "salary_slip_based_on_timesheet": pe.salary_slip_based_on_timesheet,
+                "payroll_frequency": pe.payroll_frequency, "start_date": pe.start_date,
+                "end_date": pe.end_date, "company": pe.company, "posting_date": pe.posting_date
+            }).insert()
+        frappe.db.commit()
+        print("Made {} of {} Salary Slips".format(min(i + chunk_size, len(to_make)), len(to_make)))
+    # Flags are set like create_salary_slips of Payroll Entry so the Form does not offer it again
+    pe.db_set("salary_slips_created", 1)
+    frappe.db.commit()
+    timings["make_slips"] = time.time() - phase
+
+    if cint(submit) == 1:
+        phase = time.time()
+        submit_slips(pe.name, chunk_size)
+        if not frappe.db.sql("""SELECT name FROM `tabSalary Slip` WHERE docstatus = 0 AND payroll_entry = %s
+            LIMIT 1""", pe.name):
+            pe.db_set("salary_slips_submitted", 1)
+            frappe.db.commit()
+        timings["submit_slips"] = time.time() - phase
+    timings["total"] = time.time() - started
+    for name in ["preload", "make_slips", "submit_slips", "total"]:
+        if name in timings:
+            print("{:<20} {:>10}".format(name, round(timings[name], 2)))
+    return timings
+
+
+def submit_slips(payroll_entry, chunk_size=DEFAULT_CHUNK_SIZE):
+    slips = [sal[0] for sal in frappe.db.sql("""SELECT name FROM `tabSalary Slip`
+        WHERE docstatus = 0 AND payroll_entry = %s ORDER BY employee""", payroll_entry)]
+    frappe.flags.batch_salary_gl = True
+    try:
+        for i in range(0, len(slips), chunk_size):
+            for slip in slips[i:i + chunk_size]:
+                frappe.get_doc("Salary Slip", slip).submit()
+            entries = post_pending_gl()
+            frappe.db.commit()
+            print("Submitted {} of {} Salary Slips with {} GL Entries".format(min(i + chunk_size, len(slips)),
+                                                                             len(slips), entries))
+    finally:
+        frappe.flags.batch_salary_gl = False
+        get_payroll_cache().pending_gl = []
+
+
+def post_pending_gl():
+    # Returns the Number of GL Entries Inserted for the Slips Submitted since the last Call
+    cache = get_payroll_cache()
+    pending_gl = cache.pending_gl
+    cache.pending_gl = []
+    gl_map = process_vouchers(pending_gl)
+    if not gl_map:
+        return 0
+    gl_map = check_gl_balance(gl_map)
+    validate_posting_dates(gl_map)
+    validate_gl_accounts(gl_map)
+    bulk_insert_gl_entries(gl_map)
+    return len(gl_map)
+
+
+def process_vouchers(gl_map):
+    # process_gl_map merges Rows without looking at the Voucher so it is run for each Voucher,
+    # it also drops Zero Rows and makes Negative Debits into Credits and vice versa
+    vouchers = {}
+    for gle in gl_map:
+        vouchers.setdefault((gle.voucher_type, gle.voucher_no), []).append(gle)
+    processed = []
+    for key in sorted(vouchers.keys()):
+        processed.extend(process_gl_map(vouchers[key]))
+    return processed
+
+
+def validate_posting_dates(gl_map):
+    # Closed Accounting Periods and Frozen Accounts date are checked once per Posting Date
+    checked = set()
+    for gle in gl_map:
+        key = (gle.company, getdate(gle.posting_date), gle.voucher_type)
+        if key not in checked:
+            checked.add(key)
+            validate_accounting_period([gle])
+            check_freezing_date(gle.posting_date)
+
+
+def check_gl_balance(gl_map):
+    # Debit and Credit should match for every Voucher and for all Vouchers together, small
+    # Differences of a Voucher are posted to the Round Off Account of the Company
+    precision = frappe.get_precision("GL Entry", "debit") or 2
+    vouchers = {}
+    for gle in gl_map:
+        for field in ["debit", "credit", "debit_in_account_currency", "credit_in_account_currency"]:
+            gle[field] = flt(gle.get(field), precision)
+        if gle.debit < 0 or gle.credit < 0:
+            frappe.throw("Negative Debit or Credit for {0} #{1} in Account {2}".format(
+                gle.voucher_type, gle.voucher_no, gle.account))
+        vouchers.setdefault((gle.voucher_type, gle.voucher_no), []).append(gle)
+
+    for (voucher_type, voucher_no), entries in vouchers.items():
+        diff = flt(sum([gle.debit for gle in entries]) - sum([gle.credit for gle in entries]), precision)
+        if abs(diff) > ROUND_OFF_ALLOWANCE:
+            frappe.throw("Debit and Credit not equal for {0} #{1}. Difference is {2}.".format(
+                voucher_type, voucher_no, diff))
+        elif diff != 0:
+            accounts = get_payroll_cache().get_gl_accounts(entries[0].company)
+            round_off = frappe._dict(entries[0].copy())
+            round_off.update({"account": accounts.round_off_account, "cost_center": accounts.round_off_cost_center,
+                              "party_type": None, "party": None, "against": None,
+                              "debit": abs(diff) if diff < 0 else 0, "credit": diff if diff > 0 else 0})
+            round_off.debit_in_account_currency = round_off.debit
+            round_off.credit_in_account_currency = round_off.credit
+            gl_map.append(round_off)
+
+    total_debit = flt(sum([gle.debit for gle in gl_map]), precision)
+    total_credit = flt(sum([gle.credit for gle in gl_map]), precision)
+    if total_debit != total_credit:
+        frappe.throw("Total Debit {0} and Total Credit {1} of Salary Slips are not equal".format(
+            total_debit, total_credit))
+    return gl_map
+
+
+def validate_gl_accounts(gl_map):
+    # Checks all Accounts and Cost Centers of the GL Entries with one Query each
+    accounts = list(set([gle.account for gle in gl_map]))
+    acc_dict = {}
+    for acc in frappe.db.sql("""SELECT name, company, account_currency, is_group, disabled, freeze_account,
+        report_type FROM `tabAccount` WHERE name IN (%s)""" % ", ".join(["%s"] * len(accounts)), tuple(accounts), as_dict=1):
+        acc_dict[acc.name] = acc
+    cost_centers = list(set([gle.cost_center for gle in gl_map if gle.cost_center]))
+    cc_dict = {}
+    if cost_centers:
+        for cc in frappe.db.sql("""SELECT name, company, is_group FROM `tabCost Center` WHERE name IN (%s)"""
+                                % ", ".join(["%s"] * len(cost_centers)), tuple(cost_centers), as_dict=1):
+            cc_dict[cc.name] = cc
+
+    for gle in gl_map:
+        acc = acc_dict.get(gle.account)
+        if not acc:
+            frappe.throw("Account {0} for {1} #{2} not found, please set it in the Salary Component or "
+                         "Company".format(gle.account, gle.voucher_type, gle.voucher_no))
+        if acc.company != gle.company or acc.is_group == 1 or acc.disabled == 1 or acc.freeze_account == "Yes":
+            frappe.throw("Account {0} for {1} #{2} is either of another Company, a Group, Disabled or "
+                         "Frozen".format(gle.account, gle.voucher_type, gle.voucher_no))
+        gle.account_currency = acc.account_currency
+        if acc.report_type == "Profit and Loss" and not gle.cost_center:
+            frappe.throw("Cost Center is required for Profit and Loss Account {0} in {1} #{2}".format(
+                gle.account, gle.voucher_type, gle.voucher_no))
+        if gle.cost_center:
+            cc = cc_dict.get(gle.cost_center)
+            if not cc or cc.company != gle.company or cc.is_group == 1:
+                frappe.throw("Cost Center {0} for {1} #{2} is either not found, of another Company or a "
+                             "Group".format(gle.cost_center, gle.voucher_type, gle.voucher_no))
+
+
+def bulk_insert_gl_entries(gl_map):
+    now = now_datetime()
+    for i in range(0, len(gl_map), GL_INSERT_SIZE):
+        chunk = gl_map[i:i + GL_INSERT_SIZE]
+        values = []
+        for gle in chunk:
+            gle.setdefault("is_opening", "No")
+            gle.setdefault("is_advance", "No")
+            values.extend([frappe.generate_hash("GL Entry", 10), now, now, frappe.session.user,
+                           frappe.session.user, 1] + [gle.get(field) for field in GL_FIELDS])
+        placeholders = ", ".join(["(" + ", ".join(["%s"] * (len(GL_FIELDS) + 6)) + ")"] * len(chunk))
+        frappe.db.sql("""INSERT INTO `tabGL Entry` (name, creation, modified, owner, modified_by, docstatus, %s)
+            VALUES %s""" % (", ".join(["`%s`" % field for field in GL_FIELDS]), placeholders), tuple(values))
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Rohit Industries Group Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+'''
+Synthetic Workload and Benchmark for the Permission Code. Only runs on sites with
+allow_tests set in site_config.json, never run it on the Production Site.
+1. make_workload creates Users, Roles, Settings, Employees, Sales Persons, Customers,
+   Leads and Addresses. All names start with BENCH so delete_workload can remove them.
+2. run_benchmark runs each Permission entry point and records Query Count, Wall Time
+   and Peak Python Memory. Results are compared with the saved Baseline if any.
+bench --site test_site execute rigpl_erpnext.utils.perm_benchmark.make_workload --kwargs "{'users': 20}"
+bench --site test_site execute rigpl_erpnext.utils.perm_benchmark.run_benchmark --kwargs "{'save_baseline': 1}"
+'''
+from __future__ import unicode_literals
+import frappe
+import json
+import os
+import random
+import time
+import tracemalloc
+from frappe.utils import add_years, nowdate
+
+PREFIX = "BENCH"
+BENCH_ROLES = ["BENCH Sales User", "BENCH Sales Manager"]
+BASELINE_FILE = "rigpl_perm_benchmark.json"
+
+
+def check_allowed():
+    if not frappe.conf.get("allow_tests"):
+        frappe.throw("Permission Benchmark only runs on Test Sites with allow_tests in site_config.json")
+
+
+def make_workload(users=20, customers=200, leads=500, addresses=2, seed=1):
+    '''
+    Creates Workload where every User is an Employee and Sales Person reporting to the
+    first User, Customers are divided amongst Sales Persons and Leads amongst Users.
+    '''
+    check_allowed()
+    random.seed(seed)
+    frappe.flags.mute_emails = True
+    make_roles()
+    make_settings()
+    user_list = make_users(users)
+    emp_list = make_employees(user_list)
+    sp_list = make_sales_persons(emp_list)
+    cust_list = make_customers(customers, sp_list)
+    lead_list = make_leads(leads, user_list)
+    for party in cust_list:
+        make_addresses("Customer", party, addresses)
+    for party in lead_list:
+        make_addresses("Lead", party, addresses)
+    frappe.db.commit()
+    print("Created {} Users, {} Customers and {} Leads with {} Addresses each".format(
+        len(user_list), len(cust_list), len(lead_list), addresses))
+
+
+def make_roles():
+    for role in BENCH_ROLES:
+        if not frappe.db.exists("Role", role):
+            frappe.get_doc({"doctype": "Role", "role_name": role, "desk_access": 1}).insert(
+                ignore_permissions=True)
+
+
+def make_settings():
+    perm_sett = frappe.get_doc("User Permission Settings")
+    existing = [rule.role for rule in perm_sett.rules]
+    for role in BENCH_ROLES:
+        if role in existing:
+            continue
+        for doctype in ["Customer", "Contact", "Address", "Lead", "Employee", "Account"]:
+            perm_sett.append("rules", {"role": role, "allow_doctype": doctype,
+                                       "apply_to_all_values": 1, "apply_to_all_doctypes": 1})
+    perm_sett.save(ignore_permissions=True)
+
+    share_sett = frappe.get_doc("User Share Settings")
+    existing = [rule.role for rule in share_sett.rules]
+    for role in BENCH_ROLES:
+        if role in existing:
+            continue
+        for doctype in ["Lead", "Quotation", "Address"]:
+            share_sett.append("rules", {"role": role, "document_type": doctype,
+                                        "apply_to_all_values": 1, "read_access": 1,
+                                        "write_access": 1})
+    share_sett.save(ignore_permissions=True)
+
+
+def make_users(users):
+    user_list = []
+    for i in range(users):
+        email = "{}-user-{}@example.com".format(PREFIX.lower(), i)
+        if not frappe.db.exists("User", email):
+            usr = frappe.get_doc({"doctype": "User", "email": email, "first_name": PREFIX,
+                                  "last_name": "User " + str(i), "send_welcome_email": 0,
+                                  "roles": [{"role": random.choice(BENCH_ROLES)}]})
+            usr.flags.no_welcome_mail = True
+            usr.insert(ignore_permissions=True)
+        user_list.append(email)
+    return user_list
+
+
+def make_employees(user_list):
+    emp_list = []
+    company = frappe.db.get_single_value("Global Defaults", "default_company")
+    reports_to = None
+    for user in user_list:
+        emp = frappe.db.get_value("Employee", {"user_id": user}, "name")
+        if not emp:
+            emp_doc = frappe.get_doc({"doctype": "Employee", "first_name": PREFIX,
+                                      "last_name": user.split("@")[0], "gender": "Male",
+                                      "user_id": user, "create_user_permission": 1,
+                                      "company": company, "status": "Active",
+                                      "department": "All Departments", "reports_to": reports_to,
+                                      "date_of_birth": add_years(nowdate(), -30),
+                                      "date_of_joining": add_years(nowdate(), -2)})
+            emp_doc.flags.ignore_mandatory = True
+            emp_doc.insert(ignore_permissions=True)
+            emp = emp_doc.name
+        if not reports_to:
+            reports_to = emp
+        emp_list.append(emp)
+    return emp_list
+
+
+def make_sales_persons(emp_list):
+    sp_list = []
+    for emp in emp_list:
+        sp_name = "{} Sales Person {}".format(PREFIX, emp)
+        if not frappe.db.exists("Sales Person", sp_name):
+            frappe.get_doc({"doctype": "Sales Person", "sales_person_name": sp_name,
+                            "parent_sales_person": "Sales Team", "employee": emp,
+                            "enabled": 1}).insert(ignore_permissions=True)
+        sp_list.append(sp_name)
+    return sp_list
+
+
+def make_customers(customers, sp_list):
+    cust_list = []
+    for i in range(customers):
+        cust_name = "{}Customer{}".format(PREFIX, i)
+        if not frappe.db.exists("Customer", cust_name):
+            cust = frappe.get_doc({"doctype": "Customer", "customer_name": cust_name,
+                                   "customer_type": "Company", "customer_group": "Commercial",
+                                   "territory": "India",
+                                   "sales_team": [{"sales_person": random.choice(sp_list),
+                                                   "allocated_percentage": 100}]})
+            cust.flags.ignore_mandatory = True
+            cust.insert(ignore_permissions=True)
+        cust_list.append(cust_name)
+    return cust_list
+
+
+def make_leads(leads, user_list):
+    lead_list = []
+    for i in range(leads):
+        email = "{}-lead-{}@example.com".format(PREFIX.lower(), i)
+        lead = frappe.db.get_value("Lead", {"email_id": email}, "name")
+        if not lead:
+            lead_doc = frappe.get_doc({"doctype": "Lead", "lead_name": "{} Lead {}".format(PREFIX, i),
+                                       "company_name": "{} Company {}".format(PREFIX, i),
+                                       "email_id": email, "lead_owner": random.choice(user_list),
+                                       "territory": "India"})
+            lead_doc.flags.ignore_mandatory = True
+            lead_doc.insert(ignore_permissions=True)
+            lead = lead_doc.name
+        lead_list.append(lead)
+    return lead_list
+
+
+def make_addresses(link_doctype, link_name, addresses):
+    existing = frappe.db.sql("""SELECT COUNT(name) FROM `tabDynamic Link` WHERE parenttype = 'Address'
+        AND link_doctype = %s AND link_name = %s""", (link_doctype, link_name))[0][0]
+    for i in range(existing, addresses):
+        add_doc = frappe.get_doc({"doctype": "Address", "address_title": "{} {}".format(PREFIX, link_name),
+                                  "address_type": "Billing" if i == 0 else "Shipping",
+                                  "address_line1": "{} Street {}".format(PREFIX, i), "city": "New Delhi",
+                                  "state": "Delhi", "country": "India", "pincode": "110001",
+                                  "dont_update_from_google": 1,
+                                  "links": [{"link_doctype": link_doctype, "link_name": link_name}]})
+        add_doc.flags.ignore_mandatory = True
+        add_doc.insert(ignore_permissions=True)
+
+
+def delete_workload():
+    check_allowed()
+    for doctype, field in [["Address", "address_title"], ["Lead", "lead_name"], ["Customer", "name"],
+                           ["Sales Person", "name"], ["Employee", "first_name"], ["User", "first_name"]]:
+        for row in frappe.db.sql("""SELECT name FROM `tab%s` WHERE `%s` LIKE '%s%%'""" % (doctype, field, PREFIX),
+                                 as_list=1):
+            frappe.delete_doc(doctype, row[0], force=1, ignore_permissions=True)
+        frappe.db.commit()
+    frappe.db.sql("""DELETE FROM `tabUser Permission` WHERE user LIKE '%s%%'""" % PREFIX.lower())
+    frappe.db.commit()
+
+
+def get_entry_points():
+    from rigpl_erpnext.rigpl_erpnext.scheduled_tasks import automate_docshare, default_permissions, \
+        permission_check
+    from rigpl_erpnext.rigpl_erpnext.validations import customer
+
+    def customer_on_update():
+        for cust in frappe.db.sql("""SELECT name FROM `tabCustomer` WHERE name LIKE '%s%%'
+            LIMIT 20""" % PREFIX, as_list=1):
+            customer.on_update(frappe.get_doc("Customer", cust[0]), "on_update")
+
+    # Entry Point Name, Function to Time and an untimed Setup run before it. The no change
+    # run needs a plain run first so the fingerprint left by the full run is stored
+    return [
+        ["create_defaults", lambda: default_permissions.create_defaults(full=1), None],
+        ["create_defaults (no change)", default_permissions.create_defaults,
+         default_permissions.create_defaults],
+        ["customer.on_update x20", customer_on_update, None],
+        ["automate_docshare.execute", lambda: automate_docshare.execute(full=1), None],
+        ["check_permission_exist", permission_check.check_permission_exist, None]
+    ]
+
+
+def measure(function):
+    '''
+    Runs the function and returns the Query Count, Wall Time in Seconds and Peak Python
+    Memory in MB. Queries are counted by wrapping frappe.db.sql for the run only.
+    '''
+    query_count = [0]
+    db_sql = frappe.db.sql
+
+    def counted_sql(*args, **kwargs):
+        query_count[0] += 1
+        return db_sql(*args, **kwargs)
+
+    frappe.db.sql = counted_sql
+    tracemalloc.start()
+    started = time.time()
+    try:
+        function()
+    finally:
+        wall_time = time.time() - started
+        peak_memory = tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0
+        tracemalloc.stop()
+        frappe.db.sql = db_sql
+    return {"queries": query_count[0], "wall_time": round(wall_time, 3),
+            "peak_memory": round(peak_memory, 2)}
+
+
+def run_benchmark(save_baseline=0):
+    check_allowed()
+    frappe.flags.mute_emails = True
+    baseline_path = os.path.join(frappe.get_site_path("private", "files"), BASELINE_FILE)
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.loads(f.read())
+    results = {}
+    for name, function, setup in get_entry_points():
+        if setup:
+            setup()
+            frappe.db.commit()
+        results[name] = measure(function)
+        frappe.db.commit()
+
+    print("{:<30} {:>10} {:>12} {:>12}".format("Entry Point", "Queries", "Time (s)", "Memory (MB)"))
+    for name, res in results.items():
+        print("{:<30} {:>10} {:>12} {:>12}".format(name, res["queries"], res["wall_time"],
+                                                   res["peak_memory"]))
+        base = baseline.get(name)
+        if base:
+            print("{:<30} {:>10} {:>12} {:>12}".format(
+                "  vs Baseline", res["queries"] - base["queries"],
+                round(res["wall_time"] - base["wall_time"], 3),
+                round(res["peak_memory"] - base["peak_memory"], 2)))
+    if save_baseline == 1:
+        with open(baseline_path, "w") as f:
+            f.write(json.dumps(results, indent=1, sort_keys=True))
+        print("Saved Baseline to " + baseline_path)
+    return results
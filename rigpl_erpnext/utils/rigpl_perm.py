@@ -4,6 +4,13 @@
 
 from __future__ import unicode_literals
 import frappe
+import json
+import time
+from frappe.utils import cint, flt, now_datetime
+
+#Permission Indexes in Cache are rebuilt atleast once a day
+INDEX_EXPIRY = 24 * 3600
+CUSTOMER_INDEX = "rigpl_customer_index"
 
 def create_new_user_perm(user, allow=None, for_value=None, applicable_for=None, \
 	apply_to_all_doctypes=None):
@@ -74,6 +81,47 @@ def delete_permission(name=None, user=None, allow=None, for_value=None, \
 		print ('Deleted User Permission: ' + perm[0] + ' for User: ' + perm[3] \
 			+ ' for Doctype ' + perm[1] + " Value " + perm[2])
 
+def bulk_insert_user_perm(perm_list):
+	'''
+	Inserts User Permissions in a single query, perm_list is a list of dicts
+	with keys user, allow, for_value, applicable_for and apply_to_all_doctypes
+	'''
+	if not perm_list:
+		return
+	now = now_datetime()
+	values = []
+	for perm in perm_list:
+		values.extend([frappe.generate_hash("User Permission", 10), now, now, \
+			frappe.session.user, frappe.session.user, perm.get("user"), \
+			perm.get("allow"), perm.get("for_value"), perm.get("applicable_for"), \
+			cint(perm.get("apply_to_all_doctypes"))])
+	placeholders = ", ".join(["(" + ", ".join(["%s"] * 10) + ")"] * len(perm_list))
+	frappe.db.sql("""INSERT INTO `tabUser Permission` (name, creation, modified, 
+		owner, modified_by, user, allow, for_value, applicable_for, 
+		apply_to_all_doctypes) VALUES %s"""%(placeholders), tuple(values))
+	for perm in perm_list:
+		print("Added New Permission for " + perm.get("allow") + ": " + \
+			perm.get("for_value") + " for User: " + perm.get("user"))
+	clear_user_perm_cache([perm.get("user") for perm in perm_list])
+	frappe.db.commit()
+
+def bulk_delete_user_perm(perm_list):
+	#perm_list is list of permissions as returned by get_permission
+	if not perm_list:
+		return
+	frappe.db.sql("""DELETE FROM `tabUser Permission` WHERE name IN (%s)"""\
+		%(", ".join(["%s"] * len(perm_list))), tuple([perm[0] for perm in perm_list]))
+	for perm in perm_list:
+		print ('Deleted User Permission: ' + perm[0] + ' for User: ' + perm[3] \
+			+ ' for Doctype ' + perm[1] + " Value " + perm[2])
+	clear_user_perm_cache([perm[3] for perm in perm_list])
+	frappe.db.commit()
+
+def clear_user_perm_cache(user_list):
+	#Bulk queries skip the User Permission hooks which clear the cache
+	for user in set(user_list):
+		frappe.cache().hdel("user_permissions", user)
+
 def get_docshare(name=None, user=None, share_doctype=None, share_name=None):
 	conditions = ''
 	if name:
@@ -103,6 +151,33 @@ def delete_docshare(name=None, user=None, share_doctype=None, share_name=None):
 		print ('Deleted DocShare: ' + docsh.name + ' for User: ' + docsh.user \
 			+ ' for Doctype ' + docsh.share_doctype + " Value " + docsh.share_name)
 
+def bulk_insert_docshare(share_list):
+	'''
+	Inserts DocShare in a single query, share_list is a list of dicts with keys
+	user, share_doctype, share_name, write and share. Read is always given.
+	'''
+	if not share_list:
+		return
+	now = now_datetime()
+	values = []
+	for docsh in share_list:
+		values.extend([frappe.generate_hash("DocShare", 10), now, now, \
+			frappe.session.user, frappe.session.user, docsh.get("user"), \
+			docsh.get("share_doctype"), docsh.get("share_name"), 1, \
+			cint(docsh.get("write")), cint(docsh.get("share")), 0, 0])
+	placeholders = ", ".join(["(" + ", ".join(["%s"] * 13) + ")"] * len(share_list))
+	frappe.db.sql("""INSERT INTO `tabDocShare` (name, creation, modified, owner, 
+		modified_by, user, share_doctype, share_name, `read`, `write`, `share`, 
+		everyone, notify_by_email) VALUES %s"""%(placeholders), tuple(values))
+	print("Added {} DocShare".format(len(share_list)))
+
+def bulk_delete_docshare(name_list):
+	if not name_list:
+		return
+	frappe.db.sql("""DELETE FROM `tabDocShare` WHERE name IN (%s)"""\
+		%(", ".join(["%s"] * len(name_list))), tuple(name_list))
+	print("Deleted {} DocShare".format(len(name_list)))
+
 def check_system_manager(user):
 	sysmgr_list = frappe.db.sql("""SELECT name FROM `tabHas Role` 
 		WHERE parenttype = 'User' AND parent = '%s' 
@@ -121,36 +196,90 @@ def get_dl_parent(dt, linked_dt, linked_dn):
 	return dl_parent_list
 
 def delete_version(document, creator=None, creation=None):
-	commit_chk = 0
-	conditions = ''
+	conditions = " AND ref_doctype = '%s'"%(document)
 	if creator:
 		conditions += " AND owner = '%s'" %(creator)
 	
 	if creation:
 		conditions += " AND creation <= DATE_SUB(NOW(), INTERVAL %s DAY)"%(creation)
 
-	version_list = frappe.db.sql("""SELECT name FROM `tabVersion` 
-		WHERE ref_doctype = '%s' %s""" %(document, conditions), as_list=1)
-	if version_list:
-		for version in version_list:
-			frappe.db.sql("""DELETE FROM `tabVersion` WHERE name = '%s'"""%(version[0]))
-			commit_chk += 1
-			if commit_chk%1000 == 0:
-				frappe.db.commit()
-			print(str(commit_chk) + ". Deleted Version: " + version[0])
+	return purge_table("tabVersion", conditions, \
+		purge_key="Version:" + document)
 
 def delete_from_deleted_doc(document):
-	commit_chk = 0
-	del_doc_list = frappe.db.sql("""SELECT name FROM `tabDeleted Document` 
-		WHERE deleted_doctype = '%s'"""%(document), as_list=1)
-	if del_doc_list:
-		for del_doc in del_doc_list:
-			frappe.db.sql("""DELETE FROM `tabDeleted Document` 
-				WHERE name = '%s'"""%(del_doc[0]))
-			commit_chk += 1
-			if commit_chk%1000 == 0:
-				frappe.db.commit()
-			print(str(commit_chk) + ". Deleted " + del_doc[0])
+	conditions = " AND deleted_doctype = '%s'"%(document)
+	return purge_table("tabDeleted Document", conditions, \
+		purge_key="Deleted Document:" + document)
+
+def purge_table(table, conditions='', purge_key=None):
+	'''
+	Deletes rows of a table matching the conditions in chunks of name ranges.
+	Commits after every chunk and sleeps between chunks so that the locks on
+	the table are released for other users. Stops after the max runtime and
+	saves the last deleted name as cursor so that next run resumes from there.
+	'''
+	chunk_size, sleep_time, max_runtime = get_purge_settings()
+	purge_key = purge_key or table
+	cursor = get_purge_cursor(purge_key)
+	#Conditions are added to a query with parameters so escape the %
+	conditions = conditions.replace("%", "%%")
+	started = time.time()
+	deleted = 0
+	completed = 0
+	while True:
+		name_list = frappe.db.sql("""SELECT name FROM `%s` WHERE name > %%s %s 
+			ORDER BY name LIMIT %s"""%(table, conditions, chunk_size), (cursor,), as_list=1)
+		if not name_list:
+			completed = 1
+			break
+		last_name = name_list[-1][0]
+		frappe.db.sql("""DELETE FROM `%s` WHERE name > %%s AND name <= %%s %s"""\
+			%(table, conditions), (cursor, last_name))
+		frappe.db.commit()
+		deleted += len(name_list)
+		cursor = last_name
+		if len(name_list) < chunk_size:
+			completed = 1
+			break
+		if time.time() - started >= max_runtime:
+			break
+		time.sleep(sleep_time)
+
+	if completed == 1:
+		#Names are not sequential so start again from beginning in next run
+		cursor = ''
+	set_purge_cursor(purge_key, cursor)
+	run_time = time.time() - started
+	rows_per_sec = deleted / run_time if run_time > 0 else deleted
+	print("Purged {} Rows from {} for {} in {:.1f} Seconds ({:.0f} Rows/Second){}".format(\
+		deleted, table, purge_key, run_time, rows_per_sec, \
+		"" if completed == 1 else " Resume From: " + cursor))
+	return frappe._dict({"deleted": deleted, "run_time": run_time, \
+		"rows_per_sec": rows_per_sec, "completed": completed, "cursor": cursor})
+
+def get_purge_settings():
+	chunk_size, sleep_time, max_runtime = frappe.db.get_value("RIGPL Settings", \
+		"RIGPL Settings", ["purge_chunk_size", "purge_sleep_time", "purge_max_runtime"])
+	chunk_size = cint(chunk_size) or 1000
+	sleep_time = flt(sleep_time) or 0.5
+	max_runtime = cint(max_runtime) or 900
+	return chunk_size, sleep_time, max_runtime
+
+def get_purge_cursor(purge_key):
+	cursor_dict = json.loads(frappe.db.get_value("RIGPL Settings", \
+		"RIGPL Settings", "purge_cursor") or "{}")
+	return cursor_dict.get(purge_key, '')
+
+def set_purge_cursor(purge_key, cursor):
+	cursor_dict = json.loads(frappe.db.get_value("RIGPL Settings", \
+		"RIGPL Settings", "purge_cursor") or "{}")
+	if cursor:
+		cursor_dict[purge_key] = cursor
+	else:
+		cursor_dict.pop(purge_key, None)
+	frappe.db.set_value("RIGPL Settings", "RIGPL Settings", "purge_cursor", \
+		json.dumps(cursor_dict, indent=1, sort_keys=True), update_modified=False)
+	frappe.db.commit()
 
 def get_user_lead(user):
 	lead_list = frappe.db.sql("""SELECT name FROM `tabLead` 
@@ -195,18 +324,56 @@ def get_employees(status=None):
 	return emp_list
 
 def get_employees_allowed_ids(employee):
-	allowed_ids = []
-	status = frappe.get_value("Employee", employee, "status")
-	if status == 'Active':
-		user_id = frappe.get_value("Employee", employee, "user_id")
-		user_id_perm = frappe.get_value("Employee", employee, "create_user_permission")
-		reports_to = frappe.get_value("Employee", employee, "reports_to")
-		if user_id is not None and user_id_perm == 1:
-			allowed_ids.append(user_id)
-		if reports_to:
-			allowed_ids.append(reports_to)
+	emp_index = get_employee_index()
+	allowed_ids = list(emp_index["employee"].get(employee, []))
 	return allowed_ids
 
+def get_user_allowed_employees(user):
+	emp_index = get_employee_index()
+	emp_list = list(emp_index["user"].get(user, []))
+	return emp_list
+
+def get_employee_index():
+	'''
+	Inverted Index for Employee Permissions kept in Cache, with 2 keys
+	employee: {Employee: [Allowed IDs]} and user: {Allowed ID: [Employees]}
+	'''
+	emp_index = frappe.cache().get_value("rigpl_employee_index")
+	if emp_index is None:
+		emp_index = build_employee_index()
+		frappe.cache().set_value("rigpl_employee_index", emp_index, \
+			expires_in_sec=INDEX_EXPIRY)
+	return emp_index
+
+def build_employee_index():
+	emp_index = {"employee": {}, "user": {}}
+	emp_list = frappe.db.sql("""SELECT name, user_id, create_user_permission, 
+		reports_to FROM `tabEmployee` WHERE status = 'Active'""", as_dict=1)
+	for emp in emp_list:
+		allowed_ids = []
+		if emp.user_id and emp.create_user_permission == 1:
+			allowed_ids.append(emp.user_id)
+		if emp.reports_to:
+			allowed_ids.append(emp.reports_to)
+		emp_index["employee"][emp.name] = allowed_ids
+		for allowed_id in allowed_ids:
+			emp_index["user"].setdefault(allowed_id, []).append(emp.name)
+	return emp_index
+
+def clear_permission_index(doc=None, method=None):
+	frappe.cache().delete_value("rigpl_employee_index")
+	clear_customer_index()
+
+def clear_customer_index(doc=None, method=None):
+	frappe.cache().delete_value([CUSTOMER_INDEX, CUSTOMER_INDEX + ":customer", \
+		CUSTOMER_INDEX + ":user"])
+
+def clear_index_on_user_change(doc, method=None):
+	#Disabled Users are not in the Customer Index so it is rebuilt when a User is enabled or disabled
+	old_doc = doc.get_doc_before_save()
+	if old_doc and cint(old_doc.enabled) != cint(doc.enabled):
+		clear_customer_index()
+
 def get_department_allowed_ids(dept_doc):
 	allowed_ids = []
 	if dept_doc.leave_approvers:
@@ -218,92 +385,223 @@ def get_department_allowed_ids(dept_doc):
 	return allowed_ids
 
 def get_customer_allowed_ids(customer):
-	allowed_ids = []
-	customer_doc = frappe.get_doc("Customer", customer)
-	for sperson in customer_doc.sales_team:
-		if sperson.sales_person:
-			s_person_emp = frappe.get_value("Sales Person", sperson.sales_person, "employee")
-			if s_person_emp:
-				emp_doc = frappe.get_doc("Employee", s_person_emp)
-				if emp_doc.status == "Active":
-					if  emp_doc.user_id:
-						allowed_ids.extend([emp_doc.user_id])
-	if customer_doc.customer_login_id:
-		allowed_ids.extend([customer_doc.customer_login_id])
-	if customer_doc.default_sales_partner:
-		s_partner = frappe.get_doc("Sales Partner", customer_doc.default_sales_partner)
-		if s_partner.user:
-			user = frappe.get_doc("User", s_partner.user)
-			if user.enabled == 1:
-				allowed_ids.extend([s_partner.user])
-	return allowed_ids
+	get_customer_index()
+	allowed_ids = frappe.cache().hget(CUSTOMER_INDEX + ":customer", customer)
+	if allowed_ids is None:
+		allowed_ids = refresh_customer_index(customer)
+	return list(allowed_ids)
+
+def get_user_allowed_customers(user):
+	#Customers where the Sales Person linked to User is in Sales Team
+	get_customer_index()
+	cust_list = list(frappe.cache().hget(CUSTOMER_INDEX + ":user", user) or [])
+	return cust_list
 
-def create_account_perms(acc_doc, user_dict):
-	allowed_ids = get_account_allowed_ids(acc_doc.name, user_dict)
-	if allowed_ids:
-		for user in allowed_ids:
-			role_list = get_user_roles(user)
-			role_in_settings, apply_to_all_doctypes, applicable_for = \
-				check_role(role_list, doctype=acc_doc.doctype, \
-				apply_to_all_doctypes="None")
-			if role_in_settings == 1:
-				create_new_user_perm(user=user, allow=acc_doc.doctype, \
-					for_value=acc_doc.name, applicable_for=applicable_for, \
-					apply_to_all_doctypes=apply_to_all_doctypes)
-	delete_extra_account_perms(acc_doc, user_dict)
-
-def delete_extra_account_perms(acc_doc, user_dict):
-	allowed_ids = get_account_allowed_ids(acc_doc.name, user_dict)
-	acc_perm_list = get_permission(for_value=acc_doc.name)
-	settings_list = get_user_perm_settings(allow="Account", \
-		apply_to_all_values="None", apply_to_all_doctypes="None", \
-		apply_to_all_roles="None")
-	applicable_for_dt_list = []
-	for settings in settings_list:
-		if settings[4] != 1:
-			applicable_for_dt_list.append(settings[3])
+def get_customer_index():
+	'''
+	Inverted Index for Customer Permissions kept in Cache as 2 Hashes so that a Customer
+	or a User is updated on its own, customer: {Customer: [Allowed IDs]} and
+	user: {User: [Customers]}. Both are rebuilt when the Marker Key has expired.
+	'''
+	if frappe.cache().get_value(CUSTOMER_INDEX) is None:
+		clear_customer_index()
+		for customer, allowed_ids in build_customer_index().items():
+			frappe.cache().hset(CUSTOMER_INDEX + ":customer", customer, allowed_ids)
+		for user, cust_list in build_user_customer_index().items():
+			frappe.cache().hset(CUSTOMER_INDEX + ":user", user, cust_list)
+		frappe.cache().set_value(CUSTOMER_INDEX, 1, expires_in_sec=INDEX_EXPIRY)
+
+def refresh_customer_index(customer):
+	'''
+	Recomputes the Allowed IDs of the Customer and the Customers of the Users in its old
+	and new Sales Team only. Returns the Allowed IDs of the Customer.
+	'''
+	get_customer_index()
+	allowed_ids = build_customer_index(customer).get(customer, [])
+	frappe.cache().hset(CUSTOMER_INDEX + ":customer", customer, allowed_ids)
+	users = set([user for user, cust_list in \
+		(frappe.cache().hgetall(CUSTOMER_INDEX + ":user") or {}).items() if customer in cust_list])
+	users |= set([team[0] for team in frappe.db.sql("""SELECT emp.user_id
+		FROM `tabSales Team` st, `tabSales Person` sp, `tabEmployee` emp
+		WHERE st.parenttype = 'Customer' AND st.parent = %s AND sp.name = st.sales_person 
+		AND sp.enabled = 1 AND emp.name = sp.employee 
+		AND IFNULL(emp.user_id, '') != ''""", customer, as_list=1)])
+	if users:
+		user_index = build_user_customer_index(list(users))
+		for user in users:
+			frappe.cache().hset(CUSTOMER_INDEX + ":user", user, user_index.get(user, []))
+	return allowed_ids
 
-	for perm in acc_perm_list:
-		if perm[4] not in applicable_for_dt_list:
-			delete_permission(name=perm[0])
-		if perm[3] in allowed_ids:
-			#Check if the user role is there and if not delete
-			role_list = get_user_roles(perm[3])
-			role_in_settings, apply_to_all_doctypes, applicable_for = \
-				check_role(role_list, doctype=acc_doc.doctype, \
-				apply_to_all_doctypes="None")
-			if role_in_settings != 1:
-				delete_permission(name=perm[0])
-		else:
-			delete_permission(name=perm[0])
+def build_customer_index(customer=None):
+	#Allowed IDs are Active Sales Team Users, Customer Login and Sales Partner User
+	cond_st = ''
+	cond_cu = ''
+	if customer:
+		cond_st = " AND st.parent = '%s'"%(customer)
+		cond_cu = " AND cu.name = '%s'"%(customer)
+	cust_index = {}
+	team_list = frappe.db.sql("""SELECT st.parent, emp.user_id 
+		FROM `tabSales Team` st, `tabSales Person` sp, `tabEmployee` emp
+		WHERE st.parenttype = 'Customer' AND sp.name = st.sales_person 
+		AND emp.name = sp.employee AND emp.status = 'Active' 
+		AND IFNULL(emp.user_id, '') != '' %s 
+		ORDER BY st.parent, st.idx"""%(cond_st), as_list=1)
+	cust_list = frappe.db.sql("""SELECT cu.name, cu.customer_login_id, 
+		IF(usr.enabled = 1, spt.user, NULL)
+		FROM `tabCustomer` cu
+		LEFT JOIN `tabSales Partner` spt ON spt.name = cu.default_sales_partner
+		LEFT JOIN `tabUser` usr ON usr.name = spt.user
+		WHERE cu.docstatus = 0 %s"""%(cond_cu), as_list=1)
+	for cust in cust_list:
+		cust_index[cust[0]] = []
+	for team in team_list:
+		cust_index.setdefault(team[0], []).append(team[1])
+	for cust in cust_list:
+		if cust[1]:
+			cust_index[cust[0]].append(cust[1])
+		if cust[2]:
+			cust_index[cust[0]].append(cust[2])
+	return cust_index
+
+def build_user_customer_index(users=None):
+	#Only the given Users are indexed if users is a list
+	cond = ''
+	values = ()
+	if users:
+		cond = " AND emp.user_id IN (%s)"%(", ".join(["%s"] * len(users)))
+		values = tuple(users)
+	user_index = {}
+	cust_list = frappe.db.sql("""SELECT emp.user_id, st.parent
+		FROM `tabSales Team` st, `tabSales Person` sp, `tabEmployee` emp
+		WHERE st.parenttype = 'Customer' AND sp.name = st.sales_person 
+		AND sp.enabled = 1 AND emp.name = sp.employee 
+		AND IFNULL(emp.user_id, '') != '' %s"""%(cond), values, as_list=1)
+	for cust in cust_list:
+		if cust[1] not in user_index.setdefault(cust[0], []):
+			user_index[cust[0]].append(cust[1])
+	return user_index
 
 def check_account_perm(acc_doc):
-	if acc_doc.users:
-		create_account_perms(acc_doc, acc_doc.users)
-		if acc_doc.is_group	== 1:
-			child_acc_list = get_child_acc_list(acc_doc.name)
-			for child_acc in child_acc_list:
-				child_acc_doc = frappe.get_doc("Account", child_acc[0])
-				create_account_perms(child_acc_doc, child_acc_doc.users)
+	#Child Accounts saved by copy_users_to_child_accounts are synced with their Group
+	if frappe.flags.in_group_account_sync:
+		return
+	users_override = {acc_doc.name: [row.approver for row in acc_doc.users]}
+	if acc_doc.is_group == 1:
+		sync_account_perms(group_account=acc_doc.name, users_override=users_override)
 	else:
-		delete_extra_account_perms(acc_doc, acc_doc.users)
+		sync_account_perms(account_list=[acc_doc.name], users_override=users_override)
 
 def check_all_account_perm():
-	acc_list = frappe.db.sql("""SELECT name
-		FROM `tabAccount`""", as_list=1)
-	for acc in acc_list:
-		acc_doc = frappe.get_doc("Account", acc[0])
-		if acc_doc.users:
-			create_account_perms(acc_doc, acc_doc.users)
-		delete_extra_account_perms(acc_doc, acc_doc.users)
+	sync_account_perms()
+
+def sync_account_perms(account_list=None, group_account=None, users_override=None):
+	'''
+	Reads the Users and Account Permissions of the Accounts once and then creates
+	or deletes the Account Permissions in bulk for the differences.
+	account_list: Only check these Accounts, if None then all accounts are checked
+	group_account: Check the Group Account and all Accounts under it using lft and rgt
+	users_override: {account: [users]} for Accounts being saved but not yet in DB
+	'''
+	check_all = 1 if account_list is None and not group_account else 0
+	if group_account:
+		grp = frappe.db.get_value("Account", group_account, ["lft", "rgt"], as_dict=1)
+		if not grp:
+			frappe.throw("Account {} not found".format(group_account))
+		account_list = [acc[0] for acc in frappe.db.sql("""SELECT name FROM `tabAccount` 
+			WHERE lft >= %s AND rgt <= %s ORDER BY lft""", (grp.lft, grp.rgt), as_list=1)]
+	elif account_list is None:
+		account_list = [acc[0] for acc in frappe.db.sql("""SELECT name FROM `tabAccount` 
+			ORDER BY lft""", as_list=1)]
+	accounts = set(account_list)
+	if not accounts:
+		return
+	#Whole tables are read only when all Accounts are checked
+	cond_users = ''
+	cond_perm = ''
+	values = ()
+	if check_all != 1:
+		cond_users = " AND parent IN (%s)"%(", ".join(["%s"] * len(accounts)))
+		cond_perm = " AND for_value IN (%s)"%(", ".join(["%s"] * len(accounts)))
+		values = tuple(accounts)
+
+	users_dt = frappe.get_meta("Account").get_field("users").options
+	acc_users = {}
+	for row in frappe.db.sql("""SELECT parent, approver FROM `tab%s` 
+		WHERE parenttype = 'Account' AND parentfield = 'users' %s
+		ORDER BY parent, idx"""%(users_dt, cond_users), values, as_list=1):
+		if row[0] in accounts and row[1]:
+			acc_users.setdefault(row[0], []).append(row[1])
+	if users_override:
+		acc_users.update(users_override)
+
+	settings_list = get_user_perm_settings(allow="Account", \
+		apply_to_all_values="None", apply_to_all_doctypes="None", \
+		apply_to_all_roles="None")
+	applicable_for_dt_list = [settings[3] for settings in settings_list \
+		if settings[4] != 1]
+
+	user_rules = {}
+	existing_perms = {}
+	to_delete = []
+	for perm in frappe.db.sql("""SELECT name, allow, for_value, user, applicable_for, 
+		apply_to_all_doctypes FROM `tabUser Permission` 
+		WHERE docstatus = 0 AND allow = 'Account' %s"""%(cond_perm), values, as_list=1):
+		if perm[2] not in accounts:
+			continue
+		rule = get_account_user_rule(perm[3], user_rules)
+		if perm[4] not in applicable_for_dt_list or rule is None or \
+			perm[3] not in acc_users.get(perm[2], []):
+			to_delete.append(perm)
+		else:
+			existing_perms.setdefault((perm[3], perm[2]), []).append(perm)
+
+	to_insert = []
+	for account in account_list:
+		for user in acc_users.get(account, []):
+			rule = get_account_user_rule(user, user_rules)
+			if rule is None:
+				continue
+			existing = [perm for perm in existing_perms.get((user, account), []) \
+				if (not rule[0] or perm[4] == rule[0]) and \
+				(rule[1] != 1 or perm[5] == 1)]
+			if not existing:
+				to_insert.append({"user": user, "allow": "Account", "for_value": account, \
+					"applicable_for": rule[0], "apply_to_all_doctypes": rule[1]})
+				existing_perms.setdefault((user, account), []).append([None, \
+					"Account", account, user, rule[0], rule[1]])
+	bulk_delete_user_perm(to_delete)
+	bulk_insert_user_perm(to_insert)
+
+def get_account_user_rule(user, user_rules):
+	'''
+	Returns None if User should not have any Account Permission. Like create_new_user_perm
+	Disabled Users and System Managers get no Account Permission and their existing
+	Account Permissions are deleted.
+	'''
+	if user not in user_rules:
+		user_rules[user] = None
+		if frappe.get_value("User", user, "enabled") == 1 and \
+			check_system_manager(user) != 1:
+			role_in_settings, apply_to_all_doctypes, applicable_for = \
+				check_role(get_user_roles(user), doctype="Account", \
+				apply_to_all_doctypes="None")
+			if role_in_settings == 1:
+				user_rules[user] = [applicable_for, apply_to_all_doctypes]
+	return user_rules[user]
 
 def copy_users_to_child_accounts(acc_doc):
 	if acc_doc.is_group == 1:
 		child_acc_list = get_child_acc_list(acc_doc.name)
 		if child_acc_list:
-			for child_acc in child_acc_list:
-				child_acc_doc = frappe.get_doc("Account", child_acc[0])
-				copy_grp_user_to_child(acc_doc, child_acc_doc)
+			#Permissions of Child Accounts are synced once by check_account_perm of the Group
+			in_sync = frappe.flags.in_group_account_sync
+			frappe.flags.in_group_account_sync = True
+			try:
+				for child_acc in child_acc_list:
+					child_acc_doc = frappe.get_doc("Account", child_acc[0])
+					copy_grp_user_to_child(acc_doc, child_acc_doc)
+			finally:
+				frappe.flags.in_group_account_sync = in_sync
 
 def copy_grp_user_to_child(grp_acc_doc, child_acc_doc):
 	child_acc_doc.users = []
@@ -320,20 +618,12 @@ def copy_grp_user_to_child(grp_acc_doc, child_acc_doc):
 	child_acc_doc.save()
 
 def get_child_acc_list(account_name):
-	acc_doc = frappe.get_doc("Account", account_name)
+	lft, rgt = frappe.db.get_value("Account", account_name, ["lft", "rgt"])
 	query = """SELECT name FROM `tabAccount` 
-		WHERE lft > %s AND rgt < %s"""%(acc_doc.lft, acc_doc.rgt)
+		WHERE lft > %s AND rgt < %s"""%(lft, rgt)
 	child_acc_list = frappe.db.sql(query, as_list=1)
 	return child_acc_list
 
-def get_account_allowed_ids(account_name, user_dict):
-	allowed_ids=[]
-	acc_doc = frappe.get_doc("Account", account_name)
-	if user_dict:
-		for row in user_dict:
-			allowed_ids.extend([row.approver])
-	return allowed_ids
-
 def get_extra_perms(allow, for_value, user, apply_to_all_doctypes=None, \
 	applicable_for=None):
 	conditions = ""
@@ -355,32 +645,56 @@ def restore_deleted_permission(name):
 	restore(name)
 
 def clean_dynamic_link_table():
-	query = """SELECT name FROM `tabDynamic Link` 
-		WHERE parenttype = 'Contact' 
-		AND parent NOT IN (SELECT name FROM `tabContact`)"""
-	wrong_contact_list = frappe.db.sql(query, as_list=1)
-	for contact in wrong_contact_list:
-		print (contact)
-
-	query = """SELECT name FROM `tabDynamic Link` 
-		WHERE parenttype = 'Address' 
-		AND parent NOT IN (SELECT name FROM `tabAddress`)"""
-	wrong_add_list = frappe.db.sql(query, as_list=1)
-	if wrong_add_list:
-		for address in wrong_add_list:
-			frappe.delete_doc_if_exists("Dynamic Link", address[0])
-			frappe.db.commit()
-			print("Deleted Dynamic Link " + address[0])
+	#Orphan Contact Links are only counted and not deleted
+	sweep_orphans("Dynamic Link", "parent", "Contact", dry_run=1)
+	sweep_orphans("Dynamic Link", "parent", "Address")
 
 def clean_sales_team_table():
-	query = """SELECT name, parent FROM `tabSales Team` WHERE parenttype = 'Customer' 
-	AND parent NOT IN (SELECT name FROM `tabCustomer`) """
-	list_of_st = frappe.db.sql(query, as_list=1)
-	if list_of_st:
-		for steam_lst in list_of_st:
-			frappe.delete_doc_if_exists("Sales Team", steam_lst[0])
-			frappe.db.commit()
-			print ("Deleted Sales Team Data " + steam_lst[0] + " For Customer: " + steam_lst[1])
+	sweep_orphans("Sales Team", "parent", "Customer")
+
+def sweep_orphans(child_dt, link_field, parent_dt, dry_run=0):
+	'''
+	Finds rows in the child_dt whose link_field does not exist in parent_dt with
+	an anti join and deletes them in chunks ordered by name. If link field is
+	parent then only rows with parenttype as parent_dt are checked.
+	dry_run: Only returns the count of orphan rows without deleting them
+	Stops after the max runtime of purge settings, next run starts again from the beginning.
+	'''
+	conditions = ''
+	if link_field == "parent":
+		conditions += " AND ch.parenttype = '%s'"%(parent_dt)
+	anti_join = """FROM `tab%s` ch LEFT JOIN `tab%s` par ON par.name = ch.`%s` 
+		WHERE par.name IS NULL %s"""%(child_dt, parent_dt, link_field, conditions)
+	if dry_run == 1:
+		orphans = frappe.db.sql("""SELECT COUNT(ch.name) %s"""%(anti_join), as_list=1)[0][0]
+		print("Found {} Orphan {} Rows for {}".format(orphans, child_dt, parent_dt))
+		return orphans
+
+	chunk_size, sleep_time, max_runtime = get_purge_settings()
+	#Anti Join is added to a query with parameters so escape the %
+	anti_join = anti_join.replace("%", "%%")
+	cursor = ''
+	orphans = 0
+	started = time.time()
+	while True:
+		orphan_list = frappe.db.sql("""SELECT ch.name %s AND ch.name > %%s 
+			ORDER BY ch.name LIMIT %s"""%(anti_join, chunk_size), (cursor,), as_list=1)
+		if not orphan_list:
+			break
+		frappe.db.sql("""DELETE FROM `tab%s` WHERE name IN (%s)"""%(child_dt, \
+			", ".join(["%s"] * len(orphan_list))), tuple([row[0] for row in orphan_list]))
+		frappe.db.commit()
+		orphans += len(orphan_list)
+		cursor = orphan_list[-1][0]
+		if len(orphan_list) < chunk_size:
+			break
+		if time.time() - started >= max_runtime:
+			print("Stopping Sweep of {} for {} after Max Runtime of {} Seconds".format(\
+				child_dt, parent_dt, max_runtime))
+			break
+		time.sleep(sleep_time)
+	print("Deleted {} Orphan {} Rows for {}".format(orphans, child_dt, parent_dt))
+	return orphans
 
 def get_user_roles(user):
 	role_list = frappe.db.sql("""SELECT role FROM `tabHas Role` 
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Rohit Industries Group Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+'''
+Helpers to update Carrier Tracking from the Carrier Response without rewriting it.
+1. Scans are keyed on Time, Location and Status and only Scans not already in the
+   Carrier Tracking are appended, existing Scan rows are never deleted or rewritten.
+2. Tracking Fields are noted before the Response is applied and the Carrier Tracking
+   is saved only if a Field changed or a new Scan was added. Else only Last Update is set
+   so that the Carrier Tracking is not polled again before it is due.
+3. Next Poll is set after every Poll based on the Status and Age of the Shipment. Out for
+   Delivery and Exceptions are polled often, Booked ones less often and the time between
+   Polls doubles every week. Delivered, Cancelled and Shipments older than the Carrier's
+   window are not polled again. After a failed Poll the Next Poll is moved by the time since
+   the last good Poll so the gap doubles with every failure upto the Max.
+4. Scan Summary (First and Last Scan, Last Status and Location, Transit Days) is kept on
+   the Carrier Tracking when it is saved so that Reports do not need to read the Scans.
+'''
+from __future__ import unicode_literals
+import frappe
+from frappe.utils import add_to_date, cint, cstr, get_datetime, getdate, now_datetime
+
+TRACKING_FIELDS = ["status", "status_code", "docstatus", "pickup_date", "ship_to_city", "recipient",
+                   "delivery_date_time", "manual_exception_removed"]
+# Fedex is tracked for 150 days and Shipway for 60 days from creation
+MAX_AGE_DAYS = {"Fedex": 150, "Shipway": 60}
+# Hours between Polls for Status Codes of Shipway and Fedex, others are as per Status
+POLL_HOURS_CODE = {"OOD": 2, "OD": 2, "DEX": 3, "UND": 3, "ONH": 3, "NWI": 3, "SMD": 3, "DE": 3, "SE": 3,
+                   "CD": 3}
+POLL_HOURS_STATUS = {"In Transit": 6, "Booked": 12, "Shipment Data Uploaded": 12, "No Information": 12}
+DEFAULT_POLL_HOURS = 6
+MAX_POLL_HOURS = 48
+ERROR_POLL_HOURS = 1
+
+
+def get_scan_key(scan):
+    scan_time = scan.get("time")
+    scan_time = get_datetime(scan_time).strftime('%Y-%m-%d %H:%M:%S') if scan_time else ""
+    return scan_time, cstr(scan.get("location")).strip(), cstr(scan.get("status_detail")).strip()
+
+
+def append_new_scans(track_doc, scans):
+    # Returns the Number of Scans Appended
+    existing = set([get_scan_key(row) for row in track_doc.scans])
+    new_scans = 0
+    for scan in scans:
+        key = get_scan_key(scan)
+        if key not in existing:
+            track_doc.append("scans", scan)
+            existing.add(key)
+            new_scans += 1
+    return new_scans
+
+
+def get_tracking_snapshot(track_doc):
+    snapshot = {}
+    for field in TRACKING_FIELDS:
+        value = track_doc.get(field)
+        if value and field == "pickup_date":
+            value = getdate(value)
+        elif value and field == "delivery_date_time":
+            value = get_datetime(value).replace(microsecond=0)
+        snapshot[field] = cstr(value)
+    return snapshot
+
+
+def save_if_changed(track_doc, snapshot, new_scans, carrier="Shipway", ignore_permissions=False):
+    # Returns 1 if Carrier Tracking was Saved else 0
+    next_poll_at = get_next_poll(track_doc, carrier)
+    if new_scans == 0 and get_tracking_snapshot(track_doc) == snapshot:
+        print("No Change in Tracking for {}, Not Saving".format(track_doc.name))
+        frappe.db.set_value("Carrier Tracking", track_doc.name, {"last_update": now_datetime(),
+                                                                 "next_poll_at": next_poll_at},
+                            update_modified=False)
+        return 0
+    track_doc.last_update = now_datetime()
+    track_doc.next_poll_at = next_poll_at
+    update_scan_summary(track_doc)
+    track_doc.save(ignore_permissions=ignore_permissions)
+    return 1
+
+
+def update_scan_summary(track_doc):
+    scans = [scan for scan in track_doc.scans if scan.time]
+    if not scans:
+        return
+    first_scan = min(scans, key=lambda scan: get_datetime(scan.time))
+    last_scan = max(scans, key=lambda scan: get_datetime(scan.time))
+    track_doc.first_scan_time = get_datetime(first_scan.time)
+    track_doc.last_scan_time = get_datetime(last_scan.time)
+    track_doc.last_scan_status = cstr(last_scan.status_detail)[:140]
+    track_doc.last_scan_location = cstr(last_scan.location)[:140]
+    start = get_datetime(track_doc.pickup_date) if track_doc.pickup_date else track_doc.first_scan_time
+    end = get_datetime(track_doc.delivery_date_time) if track_doc.delivery_date_time else track_doc.last_scan_time
+    track_doc.transit_days = round((end - start).total_seconds() / 86400.0, 1)
+
+
+def set_poll_backoff(track_doc, carrier="Shipway"):
+    # Sets the Next Poll after a failed Poll without saving the Carrier Tracking, Returns the Next Poll
+    next_poll_at = None
+    if get_next_poll(track_doc, carrier):
+        last_poll = get_datetime(track_doc.last_update or track_doc.creation)
+        hours = (now_datetime() - last_poll).total_seconds() / 3600.0
+        hours = min(max(hours, ERROR_POLL_HOURS), MAX_POLL_HOURS)
+        next_poll_at = add_to_date(now_datetime(), hours=hours)
+    frappe.db.set_value("Carrier Tracking", track_doc.name, "next_poll_at", next_poll_at, update_modified=False)
+    return next_poll_at
+
+
+def get_next_poll(track_doc, carrier="Shipway"):
+    # Returns None if the Shipment is not to be Polled again
+    if track_doc.status in ("Delivered", "Cancelled") or track_doc.docstatus == 2 or \
+            cint(track_doc.manual_exception_removed) == 1:
+        return None
+    age_days = (now_datetime() - get_datetime(track_doc.creation)).days
+    if age_days >= MAX_AGE_DAYS.get(carrier, 60):
+        return None
+    hours = POLL_HOURS_CODE.get(track_doc.status_code) or POLL_HOURS_STATUS.get(track_doc.status) or \
+        DEFAULT_POLL_HOURS
+    hours = min(hours * (2 ** min(age_days // 7, 4)), MAX_POLL_HOURS)
+    return add_to_date(now_datetime(), hours=hours)